@@ -1,3 +1,4 @@
 from simdirim import *
 from simdispim import *
+from axesimutils import AxePaths
 
@@ -9,6 +9,10 @@ import os
 import os.path
 import sys
 import subprocess
+import pyfits
+import numpy
+
+import axeengine
 
 from axesimerror import *
 from axesimutils import *
@@ -21,7 +25,7 @@ class TaskWrapper(object):
     """
     General class to execute C-tasks
     """
-    def __init__(self, taskname, tshort):
+    def __init__(self, taskname, tshort, paths=None):
         """
         Initializer for the class
 
@@ -29,21 +33,28 @@ class TaskWrapper(object):
         @type taskname: string
         @param tshort: shor name for task
         @type tshort: string
+        @param paths: the aXe directories (from the environment if None)
+        @type paths: AxePaths
         """
         self.taskname = taskname
         self.tshort   = tshort
 
+        # store the aXe directories
+        if paths == None:
+            paths = AxePaths()
+        self.paths = paths
+
         # initialize the command list
         self.command_list = []
 
         # save a name for stdout
-        self.stdout = putOUTPUT(get_random_filename(tshort, '.stdout'))
+        self.stdout = self.paths.putOUTPUT(get_random_filename(tshort, '.stdout'))
 
         # save a name for stderr
-        self.stderr = putOUTPUT(get_random_filename(tshort, '.stderr'))
+        self.stderr = self.paths.putOUTPUT(get_random_filename(tshort, '.stderr'))
 
         # put the command into the list
-        self.command_list.append(putAXESIMBIN(taskname))
+        self.command_list.append(self.paths.putAXESIMBIN(taskname))
 
     def run(self, silent=False):
         """
@@ -68,7 +79,8 @@ class TaskWrapper(object):
             # execute the task
             sout.write(str(self.command_list))
             sout.flush()
-            retcode = subprocess.call(self.command_list, stdout=sout, stderr=serr)
+            retcode = subprocess.call(self.command_list, stdout=sout, stderr=serr,
+                                      env=self.paths.get_environ())
 
             # close stdout/stderr
             sout.close()
@@ -78,7 +90,7 @@ class TaskWrapper(object):
 
             # execute the task with the default stdout and
             # stderr, which is the system one
-            retcode = subprocess.call(self.command_list)
+            retcode = subprocess.call(self.command_list, env=self.paths.get_environ())
 
         # return the result
         return retcode
@@ -145,7 +157,7 @@ class aXe_SEX2GOL(TaskWrapper):
     """
     Wrapper around the aXe_SEX2GOL task
     """
-    def __init__(self, grismname, configfile, iolname, dirname=None):
+    def __init__(self, grismname, configfile, iolname, dirname=None, paths=None):
         """
         Initializer for the class
 
@@ -161,9 +173,11 @@ class aXe_SEX2GOL(TaskWrapper):
         @type iolname: string
         @param dirname: name of the direct image
         @type dirname: string
+        @param paths: the aXe directories (from the environment if None)
+        @type paths: AxePaths
         """
         # initialize via superclass
-        super(aXe_SEX2GOL, self).__init__('aXe_SEX2GOL', 'sex2gol')
+        super(aXe_SEX2GOL, self).__init__('aXe_SEX2GOL', 'sex2gol', paths)
 
         # check whether a direct image exists
         if dirname != None:
@@ -194,7 +208,7 @@ class aXe_GOL2AF(TaskWrapper):
     Wrapper around the aXe_GOL2AF task
     """
     def __init__(self, grismname, configfile, extrfwhm=None, orient=0,
-                 slitless_geom=0, lambda_mark=None):
+                 slitless_geom=0, lambda_mark=None, paths=None, text_af=0):
         """
         Initializer for the class
 
@@ -212,9 +226,13 @@ class aXe_GOL2AF(TaskWrapper):
         @type orient: int
         @param lambda_mark: lambda-mark value
         @type lambda_mark: float
+        @param paths: the aXe directories (from the environment if None)
+        @type paths: AxePaths
+        @param text_af: write a text instead of a binary aperture file
+        @type text_af: int
         """
         # initialize via superclass
-        super(aXe_GOL2AF, self).__init__('aXe_GOL2AF', 'gol2af')
+        super(aXe_GOL2AF, self).__init__('aXe_GOL2AF', 'gol2af', paths)
 
         # put the grism name to the list
         self.command_list.append(grismname)
@@ -244,12 +262,16 @@ class aXe_GOL2AF(TaskWrapper):
             # put the lambda_mark value to the list
             self.command_list.append('-lambda_mark='+str(lambda_mark))
 
+        if text_af:
+            # put the text aperture file flag to the list
+            self.command_list.append('-text_AF')
+
 
 class aXe_AF2PET(TaskWrapper):
     """
     Wrapper around the aXe_AF2PET task
     """
-    def __init__(self, grismname, configfile):
+    def __init__(self, grismname, configfile, paths=None):
         """
         Initializer for the class
 
@@ -261,9 +283,11 @@ class aXe_AF2PET(TaskWrapper):
         @type grismname: string
         @param configfile: name of the aXe configuration file
         @type configfile: string
+        @param paths: the aXe directories (from the environment if None)
+        @type paths: AxePaths
         """
         # initialize via superclass
-        super(aXe_AF2PET, self).__init__('aXe_AF2PET', 'af2pet')
+        super(aXe_AF2PET, self).__init__('aXe_AF2PET', 'af2pet', paths)
 
         # put the grism name to the list
         self.command_list.append(grismname)
@@ -276,7 +300,7 @@ class aXe_PET2SPC(TaskWrapper):
     """
     Wrapper around the aXe_PET2SPC task
     """
-    def __init__(self, grismname, configfile, smooth_conv=True, bpet=0):
+    def __init__(self, grismname, configfile, smooth_conv=True, bpet=0, paths=None):
         """
         Initializer for the class
 
@@ -290,9 +314,11 @@ class aXe_PET2SPC(TaskWrapper):
         @type configfile: string
         @param bpet: marks the existence of a background pet
         @type bpet: int
+        @param paths: the aXe directories (from the environment if None)
+        @type paths: AxePaths
         """
         # initialize via superclass
-        super(aXe_PET2SPC, self).__init__('aXe_PET2SPC', 'pet2spc')
+        super(aXe_PET2SPC, self).__init__('aXe_PET2SPC', 'pet2spc', paths)
 
         # put the grism name to the list
         self.command_list.append(grismname)
@@ -313,7 +339,7 @@ class aXe_STAMPS(TaskWrapper):
     """
     Wrapper around the aXe_STAMPS task
     """
-    def __init__(self, grismname, configfile, rectified=1):
+    def __init__(self, grismname, configfile, rectified=1, paths=None):
         """
         Initializer for the class
 
@@ -327,9 +353,11 @@ class aXe_STAMPS(TaskWrapper):
         @type configfile: string
         @param rectified: flagg for rectified stamps
         @type rectified: int
+        @param paths: the aXe directories (from the environment if None)
+        @type paths: AxePaths
         """
         # initialize via superclass
-        super(aXe_STAMPS, self).__init__('aXe_STAMPS', 'stamps')
+        super(aXe_STAMPS, self).__init__('aXe_STAMPS', 'stamps', paths)
 
         # put the grism name to the list
         self.command_list.append(grismname)
@@ -347,7 +375,7 @@ class aXe_PETCONT(TaskWrapper):
     Wrapper around the aXe_PETCONT task
     """
     def __init__(self, grismname, configfile, lambda_psf=None,
-                 model_spectra=None, model_images=None):
+                 model_spectra=None, model_images=None, paths=None):
         """
         Initializer for the class
 
@@ -365,9 +393,11 @@ class aXe_PETCONT(TaskWrapper):
         @type model_spectra: string
         @param model_images: name of the model image file
         @type model_images: string
+        @param paths: the aXe directories (from the environment if None)
+        @type paths: AxePaths
         """
         # initialize via superclass
-        super(aXe_PETCONT, self).__init__('aXe_PETCONT', 'petcont')
+        super(aXe_PETCONT, self).__init__('aXe_PETCONT', 'petcont', paths)
 
         # put the grism name to the list
         self.command_list.append(grismname)
@@ -407,7 +437,7 @@ class aXe_DIRIMAGE(TaskWrapper):
     Wrapper around the aXe_DIRIMAGE task
     """
     def __init__(self, dirname, configfile, tpass_direct, model_spectra=None,
-                 model_images=None, tel_area=None):
+                 model_images=None, tel_area=None, paths=None):
         """
         Initializer for the class
 
@@ -427,9 +457,11 @@ class aXe_DIRIMAGE(TaskWrapper):
         @type model_images: string
         @param tel_area: collecting area of the telescope
         @type tel_area: float
+        @param paths: the aXe directories (from the environment if None)
+        @type paths: AxePaths
         """
         # initialize via superclass
-        super(aXe_DIRIMAGE, self).__init__('aXe_DIRIMAGE', 'dirimage')
+        super(aXe_DIRIMAGE, self).__init__('aXe_DIRIMAGE', 'dirimage', paths)
 
         # put the direct image name to the list
         self.command_list.append(dirname)
@@ -463,7 +495,7 @@ class aXe_DISPIMAGE(TaskWrapper):
     Wrapper around the aXe_PETCONT task
     """
     def __init__(self, grismname, configfile, lambda_psf=None,
-                 model_spectra=None, model_images=None):
+                 model_spectra=None, model_images=None, paths=None, nthreads=None):
         """
         Initializer for the class
 
@@ -481,9 +513,13 @@ class aXe_DISPIMAGE(TaskWrapper):
         @type model_spectra: string
         @param model_images: name of the model image file
         @type model_images: string
+        @param paths: the aXe directories (from the environment if None)
+        @type paths: AxePaths
+        @param nthreads: number of threads (0 for all cores)
+        @type nthreads: int
         """
         # initialize via superclass
-        super(aXe_DISPIMAGE, self).__init__('aXe_DISPIMAGE', 'dispimage')
+        super(aXe_DISPIMAGE, self).__init__('aXe_DISPIMAGE', 'dispimage', paths)
 
         # put the grism name to the list
         self.command_list.append(grismname)
@@ -506,12 +542,18 @@ class aXe_DISPIMAGE(TaskWrapper):
         if model_images != None:
             self.command_list.append('-model_images='+str(model_images))
 
+        # check whether the number of threads
+        # is given, append the number to the list
+        if nthreads != None:
+            self.command_list.append('-nthreads='+str(nthreads))
+
 class DispImator(object):
     """
     Class to create a dispersed image
     """
     def __init__(self, dummyImages, configfile, simobjects, lambda_psf=None,
-                 model_spectra=None, model_images=None):
+                 model_spectra=None, model_images=None, paths=None, use_engine=True,
+                 nthreads=1, text_af=0):
         """
         Initializer for the class
 
@@ -527,10 +569,22 @@ class DispImator(object):
         @type model_spectra: string
         @param model_images: name of the model image file
         @type model_images: string
+        @param paths: the aXe directories (from the environment if None)
+        @type paths: AxePaths
+        @param use_engine: use the in-process engine if available
+        @type use_engine: boolean
+        @param nthreads: number of threads to model the objects (0 for all cores)
+        @type nthreads: int
+        @param text_af: hand the apertures to aXe_DISPIMAGE in a text aperture file
+        @type text_af: int
         """
         # save the naked name of the grism image
         self.grismname  = os.path.basename(dummyImages.griname)
 
+        # save the image dimensions
+        self.nx = dummyImages.nx
+        self.ny = dummyImages.ny
+
         # check whether there is a direct image
         if dummyImages.dirname != None:
             # save the direct image name
@@ -545,6 +599,20 @@ class DispImator(object):
         self.model_spectra = model_spectra
         self.model_images  = model_images
         self.lambda_psf    = lambda_psf
+        self.nthreads      = nthreads
+        self.text_af       = text_af
+
+        # store the aXe directories
+        if paths == None:
+            paths = AxePaths()
+        self.paths = paths
+
+        # the in-process engine works
+        # without a direct image only
+        self.use_engine = use_engine and self.dirname == None
+
+        # the model image computed by the engine
+        self.image = None
 
     def run(self, silent=True):
         """
@@ -552,13 +620,20 @@ class DispImator(object):
 
         The method executes the series of aXe tasks necessary to generate
         a simulated dispersed image. The input from the class data is
-        supplemented with default values.
+        supplemented with default values. If the shared aXeSIM library
+        is available, the tasks are run in-process without intermediate
+        files, and the model image is also kept in 'self.image'.
 
         @param silent: boolean for silent mode
         @type silent: boolean
         """
+        if self.use_engine and axeengine.has_axesim_lib(self.paths):
+            self.run_engine()
+            return
+
         # define and run SEX2GOL
-        sex2gol = aXe_SEX2GOL(self.grismname, self.configfile, self.iolname, self.dirname)
+        sex2gol = aXe_SEX2GOL(self.grismname, self.configfile, self.iolname, self.dirname,
+                              paths=self.paths)
         print 'Running task "sex2gol" ...',
         sys.stdout.flush()
         retcode = sex2gol.run(silent=silent)
@@ -571,7 +646,8 @@ class DispImator(object):
             raise aXeSIMError(error_message)
 
         # define and run GOL2AF
-        gol2af = aXe_GOL2AF(self.grismname, self.configfile, orient=1, slitless_geom=1)
+        gol2af = aXe_GOL2AF(self.grismname, self.configfile, orient=1, slitless_geom=1,
+                            paths=self.paths, text_af=self.text_af)
         print 'Running task "gol2af" ...',
         sys.stdout.flush()
         retcode = gol2af.run(silent=silent)
@@ -585,7 +661,8 @@ class DispImator(object):
 
         # define and run DISPIMAGE
         dispimage = aXe_DISPIMAGE(self.grismname, self.configfile, lambda_psf=self.lambda_psf,
-                              model_spectra=self.model_spectra, model_images=self.model_images)
+                              model_spectra=self.model_spectra, model_images=self.model_images,
+                              paths=self.paths, nthreads=self.nthreads)
         
         print 'Running task "dispimage" ...',
         sys.stdout.flush()
@@ -598,6 +675,39 @@ class DispImator(object):
             error_message = 'Error in task: ' + 'dispimage!'
             raise aXeSIMError(error_message)
 
+    def run_engine(self):
+        """
+        Generates a simulated dispersed image in-process
+
+        The method computes the dispersed image with the shared
+        aXeSIM library and writes it to the grism image.
+        """
+        engine = axeengine.DispEngine(paths=self.paths)
+
+        model_spectra_path = None
+        if self.model_spectra != None:
+            model_spectra_path = self.paths.putIMAGE(self.model_spectra)
+        model_images_path = None
+        if self.model_images != None:
+            model_images_path = self.paths.putIMAGE(self.model_images)
+
+        print 'Running the dispersed image engine ...',
+        sys.stdout.flush()
+        grism_path = self.paths.putIMAGE(self.grismname)
+        self.image = engine.dispimage(grism_path, self.paths.putCONF(self.configfile),
+                                      self.iolname, self.nx, self.ny,
+                                      lambda_psf=self.lambda_psf,
+                                      model_spectra_path=model_spectra_path,
+                                      model_images_path=model_images_path,
+                                      nthreads=self.nthreads)
+        print ' Done'
+
+        # store the image as aXe_DISPIMAGE does
+        grism_img = pyfits.open(grism_path, mode='update')
+        grism_img['SCI'].data = self.image.astype(numpy.float32)
+        grism_img.flush()
+        grism_img.close()
+
     def mopup(self):
         """
         Deleting GOL and OAF files
@@ -609,10 +719,10 @@ class DispImator(object):
         root_name   = self.grismname[:pos]
 
         # delete the GOL, the OAF 
-        result_cat = putOUTPUT(root_name   + '_2.cat')
+        result_cat = self.paths.putOUTPUT(root_name   + '_2.cat')
         if os.path.isfile(result_cat):
             os.unlink(result_cat)
-        result_oaf = putOUTPUT(root_name   + '_2.OAF')
+        result_oaf = self.paths.putOUTPUT(root_name   + '_2.OAF')
         if os.path.isfile(result_oaf):
             os.unlink(result_oaf)
 
@@ -621,7 +731,7 @@ class DirImator(object):
     Class to create a direct image
     """
     def __init__(self, dummyImages, configfile, simobjects, tpass_direct,
-                 model_spectra=None, model_images=None, tel_area=None):
+                 model_spectra=None, model_images=None, tel_area=None, paths=None):
         """
         Initializer for the class
 
@@ -639,6 +749,8 @@ class DirImator(object):
         @type model_images: string
         @param tel_area: the collecting area of the telescope
         @type tel_area: float
+        @param paths: the aXe directories (from the environment if None)
+        @type paths: AxePaths
         """
         # save the naked name of the direct image
         self.dirname = os.path.basename(dummyImages.dirname)
@@ -651,6 +763,10 @@ class DirImator(object):
         self.model_images  = model_images
         self.tel_area      = tel_area
 
+        # store the aXe directories
+        if paths == None:
+            paths = AxePaths()
+        self.paths = paths
 
     def run(self, silent=True):
         """
@@ -663,7 +779,7 @@ class DirImator(object):
         @type silent: boolean
         """
         # define and run SEX2GOL
-        sex2gol = aXe_SEX2GOL(self.dirname, self.configfile, self.iolname)
+        sex2gol = aXe_SEX2GOL(self.dirname, self.configfile, self.iolname, paths=self.paths)
         print 'Running task "sex2gol" ...',
         sys.stdout.flush()
         retcode = sex2gol.run(silent=silent)
@@ -674,7 +790,7 @@ class DirImator(object):
             sex2gol.report_all(silent)
 
         # define and run GOL2AF
-        gol2af = aXe_GOL2AF(self.dirname, self.configfile)
+        gol2af = aXe_GOL2AF(self.dirname, self.configfile, paths=self.paths)
         print 'Running task "gol2af" ...',
         sys.stdout.flush()
         retcode = gol2af.run(silent=silent)
@@ -687,7 +803,7 @@ class DirImator(object):
         # define and run DIRIMAGE
         dirimage = aXe_DIRIMAGE(self.dirname, self.configfile, self.tpass_direct,
                                 model_spectra=self.model_spectra, model_images=self.model_images,
-                                tel_area=self.tel_area)
+                                tel_area=self.tel_area, paths=self.paths)
 
         print 'Running task "dirimage" ...',
         sys.stdout.flush()
@@ -709,10 +825,10 @@ class DirImator(object):
         root_name   = self.dirname[:pos]
 
         # delete the GOL, the OAF and the PET
-        result_cat = putOUTPUT(root_name   + '_2.cat')
+        result_cat = self.paths.putOUTPUT(root_name   + '_2.cat')
         if os.path.isfile(result_cat):
             os.unlink(result_cat)
-        result_oaf = putOUTPUT(root_name   + '_2.OAF')
+        result_oaf = self.paths.putOUTPUT(root_name   + '_2.OAF')
         if os.path.isfile(result_oaf):
             os.unlink(result_oaf)
 
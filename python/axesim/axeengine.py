@@ -0,0 +1,170 @@
+"""
+$Revision: 1.0 $ $Date: 2010/05/20 10:35:43 $
+Author: Julien Zoubian
+In-process binding to the aXeSIM C-library
+"""
+import os
+import os.path
+import ctypes
+import ctypes.util
+import numpy
+
+from axesimerror import *
+from axesimutils import *
+
+# name of the shared library
+AXESIM_LIBNAME = 'libaxesim.so'
+
+# the library, loaded once per process
+_axesim_lib = None
+
+def find_axesim_lib(paths=None):
+    """
+    Locate the shared aXeSIM library
+
+    The library is looked for in the location given in the
+    environment variable 'AXESIM_LIBRARY', in the directory of the
+    C-executables, in the 'lib' directory next to it and finally
+    in the system library path.
+
+    @param paths: the aXe directories (from the environment if None)
+    @type paths: AxePaths
+
+    @return: the path to the library or None
+    @rtype: string
+    """
+    if paths == None:
+        paths = AxePaths()
+
+    candidates = []
+    if 'AXESIM_LIBRARY' in os.environ:
+        candidates.append(os.environ['AXESIM_LIBRARY'])
+    candidates.append(paths.putAXESIMBIN(AXESIM_LIBNAME))
+    candidates.append(os.path.join(os.path.dirname(os.path.normpath(paths.axesimbin)),
+                                   'lib', AXESIM_LIBNAME))
+    for libpath in candidates:
+        if os.path.isfile(libpath):
+            return libpath
+    return ctypes.util.find_library('axesim')
+
+def load_axesim_lib(paths=None):
+    """
+    Load the shared aXeSIM library
+
+    @param paths: the aXe directories (from the environment if None)
+    @type paths: AxePaths
+
+    @return: the library
+    @rtype: ctypes.CDLL
+    """
+    global _axesim_lib
+
+    if _axesim_lib == None:
+        libpath = find_axesim_lib(paths)
+        if libpath == None:
+            error_message = 'Could not find the aXeSIM library: ' + AXESIM_LIBNAME
+            raise aXeSIMError(error_message)
+        try:
+            lib = ctypes.CDLL(libpath)
+        except OSError, e:
+            error_message = 'Could not load the aXeSIM library %s: %s' % (libpath, str(e))
+            raise aXeSIMError(error_message)
+
+        lib.dispimage_engine.restype  = ctypes.c_int
+        lib.dispimage_engine.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p,
+                                         ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p,
+                                         ctypes.c_double,
+                                         numpy.ctypeslib.ndpointer(dtype=numpy.float64,
+                                                                   ndim=2, flags='C_CONTIGUOUS'),
+                                         ctypes.c_int, ctypes.c_int, ctypes.c_int]
+        _axesim_lib = lib
+
+    return _axesim_lib
+
+def has_axesim_lib(paths=None):
+    """
+    Check whether the in-process engine is available
+
+    @param paths: the aXe directories (from the environment if None)
+    @type paths: AxePaths
+
+    @return: True if the library can be loaded
+    @rtype: boolean
+    """
+    try:
+        load_axesim_lib(paths)
+    except aXeSIMError:
+        return False
+    return True
+
+class DispEngine(object):
+    """
+    In-process computation of dispersed images
+
+    The class runs the chain aXe_SEX2GOL -> aXe_GOL2AF -> aXe_DISPIMAGE
+    in the shared aXeSIM library. The intermediate GOL and OAF files
+    are not written, and the model image is returned as an array.
+    Note that fatal errors in the C-code still terminate the process.
+    """
+    def __init__(self, paths=None):
+        """
+        Initializer for the class
+
+        @param paths: the aXe directories (from the environment if None)
+        @type paths: AxePaths
+        """
+        if paths == None:
+            paths = AxePaths()
+        self.paths = paths
+
+        # load the library
+        self.lib = load_axesim_lib(paths)
+
+    def dispimage(self, grism_path, conf_path, incat_path, nx, ny, lambda_psf=None,
+                  model_spectra_path=None, model_images_path=None, nthreads=1):
+        """
+        Compute a dispersed model image
+
+        The sensitivity tables are taken from the configuration
+        directory of the paths given to the class, not from the
+        environment of the process.
+
+        @param grism_path: path to the (dummy) grism image
+        @type grism_path: string
+        @param conf_path: path to the aXe configuration file
+        @type conf_path: string
+        @param incat_path: path to the model object table
+        @type incat_path: string
+        @param nx: number of columns in the image
+        @type nx: int
+        @param ny: number of rows in the image
+        @type ny: int
+        @param lambda_psf: reference wavelength for the psf
+        @type lambda_psf: float
+        @param model_spectra_path: path to the model spectra file
+        @type model_spectra_path: string
+        @param model_images_path: path to the model image file
+        @type model_images_path: string
+        @param nthreads: number of threads to model the objects (0 for all cores)
+        @type nthreads: int
+
+        @return: the model image
+        @rtype: numpy.ndarray
+        """
+        if lambda_psf == None:
+            lambda_psf = 800.0
+        if model_spectra_path == None:
+            model_spectra_path = ''
+        if model_images_path == None:
+            model_images_path = ''
+
+        image = numpy.zeros((ny, nx), dtype=numpy.float64)
+        nobjects = self.lib.dispimage_engine(grism_path, conf_path, self.paths.config_path,
+                                             incat_path, model_spectra_path, model_images_path,
+                                             float(lambda_psf), image, nx, ny,
+                                             int(nthreads))
+        if nobjects < 0:
+            error_message = 'Error in the dispersed image engine for: ' + grism_path
+            raise aXeSIMError(error_message)
+
+        return image
@@ -8,6 +8,7 @@ import os
 import os.path
 import sys
 import string
+import threading
 
 AXE_IMAGE_PATH   = './'
 AXE_OUTPUT_PATH  = './'
@@ -52,6 +53,175 @@ def get_environments():
 
     return ret
 
+class AxePaths(object):
+    """
+    Directories used by one aXeSIM run
+
+    The class holds the aXe directories (image, configuration, output, ...)
+    of a single simulation. It replaces the global variables set from the
+    environment by 'get_environments()', such that several simulations with
+    different directories can run concurrently in the same process.
+    Paths which are not given are taken from the environment variables of
+    the same name, as 'get_environments()' does.
+    """
+    def __init__(self, image_path=None, config_path=None, output_path=None,
+                 simdata_path=None, outsim_path=None, drizzle_path=None):
+        """
+        Initializer for the class
+
+        @param image_path: the path to the images (AXE_IMAGE_PATH)
+        @type image_path: string
+        @param config_path: the path to the configuration files (AXE_CONFIG_PATH)
+        @type config_path: string
+        @param output_path: the path to the aXe outputs (AXE_OUTPUT_PATH)
+        @type output_path: string
+        @param simdata_path: the path to the simulation data (AXE_SIMDATA_PATH)
+        @type simdata_path: string
+        @param outsim_path: the path to the simulated images (AXE_OUTSIM_PATH)
+        @type outsim_path: string
+        @param drizzle_path: the path to the drizzle outputs (AXE_DRIZZLE_PATH)
+        @type drizzle_path: string
+        """
+        self.image_path   = self._get_path('AXE_IMAGE_PATH', image_path)
+        self.config_path  = self._get_path('AXE_CONFIG_PATH', config_path)
+        self.output_path  = self._get_path('AXE_OUTPUT_PATH', output_path)
+        self.simdata_path = self._get_path('AXE_SIMDATA_PATH', simdata_path)
+        self.outsim_path  = self._get_path('AXE_OUTSIM_PATH', outsim_path)
+        self.drizzle_path = self._get_path('AXE_DRIZZLE_PATH', drizzle_path)
+
+        # the location of the C-executables
+        modfile = sys.modules['axesim'].__file__
+        self.axesimbin = os.path.abspath(os.path.join(os.path.dirname(modfile),'bin/'))
+
+    def _get_path(self, envname, path):
+        """
+        Determine one path
+
+        @param envname: name of the environment variable used as default
+        @type envname: string
+        @param path: the path given in the input
+        @type path: string
+
+        @return: the path
+        @rtype: string
+        """
+        if path != None:
+            return path
+        elif envname in os.environ:
+            return os.environ[envname]
+        else:
+            return './'
+
+    def get_environ(self):
+        """
+        Get the environment for the C-executables
+
+        The C-executables read the aXe directories from the
+        environment. The method returns a copy of the environment
+        of the process with the directories of the class.
+
+        @return: the environment
+        @rtype: {}
+        """
+        env = dict(os.environ)
+        env['AXE_IMAGE_PATH']   = self.image_path
+        env['AXE_CONFIG_PATH']  = self.config_path
+        env['AXE_OUTPUT_PATH']  = self.output_path
+        env['AXE_SIMDATA_PATH'] = self.simdata_path
+        env['AXE_OUTSIM_PATH']  = self.outsim_path
+        env['AXE_DRIZZLE_PATH'] = self.drizzle_path
+        return env
+
+    def putCONF(self, name=None):
+        """
+        Sets the path to a file in the configuration directory
+
+        @param name: basic file name
+        @type name: string
+
+        @return: the pathname to a file in the configuration directory
+        @rtype: string
+        """
+        return self._put(self.config_path, name)
+
+    def putIMAGE(self, name=None):
+        """
+        Sets the path to a file in the image directory
+
+        @param name: basic file name
+        @type name: string
+
+        @return: the pathname to a file in the image directory
+        @rtype: string
+        """
+        return self._put(self.image_path, name)
+
+    def putOUTPUT(self, name=None):
+        """
+        Sets the path to a file in the output directory
+
+        @param name: basic file name
+        @type name: string
+
+        @return: the pathname to a file in the output directory
+        @rtype: string
+        """
+        return self._put(self.output_path, name)
+
+    def putSIMDATA(self, name=None):
+        """
+        Sets the path to a file in the simulation data directory
+
+        @param name: basic file name
+        @type name: string
+
+        @return: the pathname to a file in the simulation data directory
+        @rtype: string
+        """
+        return self._put(self.simdata_path, name)
+
+    def putOUTSIM(self, name=None):
+        """
+        Sets the path to a file in the simulated image directory
+
+        @param name: basic file name
+        @type name: string
+
+        @return: the pathname to a file in the simulated image directory
+        @rtype: string
+        """
+        return self._put(self.outsim_path, name)
+
+    def putAXESIMBIN(self, name=None):
+        """
+        Sets the path to a C-executable
+
+        @param name: basic file name
+        @type name: string
+
+        @return: the pathname to a file in the executable directory
+        @rtype: string
+        """
+        return self._put(self.axesimbin, name)
+
+    def _put(self, path, name):
+        """
+        Join a directory and a file name
+
+        @param path: the directory
+        @type path: string
+        @param name: basic file name
+        @type name: string
+
+        @return: the pathname
+        @rtype: string
+        """
+        if name == None:
+            tmp = os.path.join(path,'/')
+        else:
+            tmp = os.path.join(path,name)
+        return tmp
+
 def putCONF(name=None):
     """
     Sets the path to a file in the $AXE_CONFIG_PATH directory
@@ -216,3 +386,51 @@ def get_random_filename(dirname=None, ext=None):
 
     # return the random name
     return fname
+
+
+# counter and lock to share the
+# redirection of stdout between threads
+_mute_lock  = threading.Lock()
+_mute_count = 0
+_mute_saved = None
+
+def mute_stdout():
+    """
+    Redirect stdout to /dev/null
+
+    The redirection is counted, such that concurrent simulations
+    in threads of the same process do not restore the wrong stream.
+    stdout is redirected by the first call and restored by the
+    last call to 'unmute_stdout()'.
+    """
+    global _mute_count
+    global _mute_saved
+
+    _mute_lock.acquire()
+    try:
+        if _mute_count == 0:
+            _mute_saved = sys.stdout
+            sys.stdout = open(os.devnull, 'w')
+        _mute_count += 1
+    finally:
+        _mute_lock.release()
+
+def unmute_stdout():
+    """
+    Restore stdout
+
+    The method undoes one call to 'mute_stdout()'.
+    """
+    global _mute_count
+    global _mute_saved
+
+    _mute_lock.acquire()
+    try:
+        if _mute_count > 0:
+            _mute_count -= 1
+            if _mute_count == 0:
+                sys.stdout.close()
+                sys.stdout = _mute_saved
+                _mute_saved = None
+    finally:
+        _mute_lock.release()
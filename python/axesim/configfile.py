@@ -112,6 +112,10 @@ class ConfigList(object):
         if b==None:
           for beam in self._beams:
               rstring += str(beam)
+        elif isinstance(b, list):
+          for beam in self._beams:
+              if beam.ident in b:
+                  rstring += str(beam)
         else:
           rstring += self.beams[b].toBeamA()
 
@@ -474,6 +478,7 @@ class ConfigList(object):
                      'DRZPSCALE', 'DRZKERNEL', 'MODEL_EXT', 'VARIANCE_EXT',
                      'RDNOISE', 'PSFCOEFFS', 'PSFRANGE', 'IPIXFUNCTION',
                      'POBJSIZE', 'SMFACTOR', 'PSFSIG1', 'PSFSIG2', 'PSFC',
+                     'EKERNEL_TOL',
                      'NPIXX', 'NPIXY', 'DC', 'QE',
                      'CRPIX1', 'CRPIX2', 'CRVAL1', 'CRVAL2', 'CD1_1',
                      'CD1_2', 'CD2_1', 'CD2_2', 'ORIENTAT', 'EXPNAME',
@@ -512,7 +517,7 @@ class ConfigList(object):
         # return the list of global keys
         return gkeys
 
-    def check_files(self):
+    def check_files(self, paths=None):
         """
         Checks whether all files exist
 
@@ -520,6 +525,9 @@ class ConfigList(object):
         are within the class data do exist or not.
         An error is reported in case that the files
         do not exist.
+
+        @param paths: the aXe directories (from the environment if None)
+        @type paths: AxePaths
         """
         n_sens = 0
 
@@ -527,7 +535,7 @@ class ConfigList(object):
         for bkey in self.beams.keys():
             # enhance the number of
             # sensitivity files
-            n_sens += self.beams[bkey].check_files()
+            n_sens += self.beams[bkey].check_files(paths)
 
         # return the number
         # of sens.-files
@@ -623,6 +631,9 @@ class ConfigFile(ConfigList):
     def axesim_prep(self, b=None):
         """
         Removes modifies some keywords
+
+        With a single beam 'b' the beam is written as beam A,
+        with a list of beams these beams keep their names.
         """
         # derive the new configuration file name
         new_name = self._get_simul_name()
@@ -800,7 +811,7 @@ class ConfigBeam(object):
         # return the list of global keys
         return bkeys
 
-    def check_files(self):
+    def check_files(self, paths=None):
         """
         Checks whether all files exist
 
@@ -809,7 +820,12 @@ class ConfigBeam(object):
         An error is reported in case that the files
         do not exist.
 
+        @param paths: the aXe directories (from the environment if None)
+        @type paths: AxePaths
         """
+        if paths == None:
+            paths = AxePaths()
+
         # initialize the number
         # of sensitivity files
         n_sens = 0
@@ -829,8 +845,8 @@ class ConfigBeam(object):
                 # check whether the current keyword is right
                 # and whether the keyvalue is not 'None'
                 if bkey.keyword == full_keyword and bkey.keyvalue.upper() != 'NONE':
-                    if not os.path.isfile(putCONF(bkey.keyvalue)):
-                        error_message = 'The file does not exist: ' + str(putCONF(bkey.keyvalue))
+                    if not os.path.isfile(paths.putCONF(bkey.keyvalue)):
+                        error_message = 'The file does not exist: ' + str(paths.putCONF(bkey.keyvalue))
                         raise aXeSIMError(error_message)
                     else:
                         n_sens += 1
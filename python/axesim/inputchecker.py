@@ -23,12 +23,17 @@ class InputChecker(object):
     in the main methods. Hence the initialization method
     is rather naked.
     """
-    def __init__(self):
+    def __init__(self, paths=None):
         """
         Initializes the class
+
+        @param paths: the aXe directories (from the environment if None)
+        @type paths: AxePaths
         """
-        # just set the environments
-        get_environments()
+        # store the aXe directories
+        if paths == None:
+            paths = AxePaths()
+        self.paths = paths
 
     def check_simdispim_input(self, incat, config, model_spectra, model_images, bck_flux):
         """
@@ -54,41 +59,41 @@ class InputChecker(object):
         # check the existence of the
         # model object table
         if incat != None:
-            if not os.path.isfile(putIMAGE(incat)):
-                error_message = 'The Model Object Table does not exist: ' + putIMAGE(incat)
+            if not os.path.isfile(self.paths.putIMAGE(incat)):
+                error_message = 'The Model Object Table does not exist: ' + self.paths.putIMAGE(incat)
                 raise aXeSIMError(error_message)
 
         # check the existence of the
         # axe configuration file
-        if not os.path.isfile(putCONF(config)):
-            error_message = 'The aXe configuration file does not exist: ' + putCONF(config)
+        if not os.path.isfile(self.paths.putCONF(config)):
+            error_message = 'The aXe configuration file does not exist: ' + self.paths.putCONF(config)
             raise aXeSIMError(error_message)
 
         else:
             # load the aXe configuration file
-            conf = configfile.ConfigFile(putCONF(config))
+            conf = configfile.ConfigFile(self.paths.putCONF(config))
 
             # make the internal checks
-            n_sens = conf.check_files()
+            n_sens = conf.check_files(self.paths)
 
             # make sure there is
             # at least one sens. file
             if n_sens < 1:
-                error_message = 'There must be at least one sensitivity file in: ' + putCONF(config)
+                error_message = 'There must be at least one sensitivity file in: ' + self.paths.putCONF(config)
                 raise aXeSIMError(error_message)
 
         if model_spectra != None:
             # check the existence of the
             # model spectra file
-            if not os.path.isfile(putIMAGE(model_spectra)):
-                error_message = 'The model spectra file does not exist: ' + putIMAGE(model_spectra)
+            if not os.path.isfile(self.paths.putIMAGE(model_spectra)):
+                error_message = 'The model spectra file does not exist: ' + self.paths.putIMAGE(model_spectra)
                 raise aXeSIMError(error_message)
 
         if model_images != None:
             # check the existence of the
             # model images file
-            if not os.path.isfile(putIMAGE(model_images)):
-                error_message = 'The model images file does not exist: ' + putIMAGE(model_images)
+            if not os.path.isfile(self.paths.putIMAGE(model_images)):
+                error_message = 'The model images file does not exist: ' + self.paths.putIMAGE(model_images)
                 raise aXeSIMError(error_message)
 
         try:
@@ -103,8 +108,8 @@ class InputChecker(object):
         # catch a string
         except ValueError:
             # check for existence of file
-            if not os.path.isfile(putCONF(bck_flux)):
-                error_message = 'The background file does not exist: ' + putCONF(bck_flux)
+            if not os.path.isfile(self.paths.putCONF(bck_flux)):
+                error_message = 'The background file does not exist: ' + self.paths.putCONF(bck_flux)
                 raise aXeSIMError(error_message)
 
 
@@ -140,47 +145,47 @@ class InputChecker(object):
         """
         # check the existence of the
         # model object table
-        if not os.path.isfile(putIMAGE(incat)):
-            error_message = 'The Model Object Table does not exist: ' + putIMAGE(incat)
+        if not os.path.isfile(self.paths.putIMAGE(incat)):
+            error_message = 'The Model Object Table does not exist: ' + self.paths.putIMAGE(incat)
             raise aXeSIMError(error_message)
 
         # check the existence of the
         # axe configuration file
-        if not os.path.isfile(putCONF(config)):
-            error_message = 'The aXe configuration file does not exist: ' + putCONF(config)
+        if not os.path.isfile(self.paths.putCONF(config)):
+            error_message = 'The aXe configuration file does not exist: ' + self.paths.putCONF(config)
             raise aXeSIMError(error_message)
 
         else:
             # load the aXe configuration file
-            conf = configfile.ConfigFile(putCONF(config))
+            conf = configfile.ConfigFile(self.paths.putCONF(config))
 
             # make the internal checks
-            n_sens = conf.check_files()
+            n_sens = conf.check_files(self.paths)
 
             # make sure there is
             # at least one sens. file
             if n_sens < 1:
-                error_message = 'There must be at least one sensitivity file in: ' + putCONF(config)
+                error_message = 'There must be at least one sensitivity file in: ' + self.paths.putCONF(config)
                 raise aXeSIMError(error_message)
 
         # check the existence of the
         # total passband file
-        if not os.path.isfile(putSIMDATA(tpass_direct)):
-            error_message = 'The total passband file does not exist: ' + putSIMDATA(tpass_direct)
+        if not os.path.isfile(self.paths.putSIMDATA(tpass_direct)):
+            error_message = 'The total passband file does not exist: ' + self.paths.putSIMDATA(tpass_direct)
             raise aXeSIMError(error_message)
 
         if model_spectra != None:
             # check the existence of the
             # model spectra file
-            if not os.path.isfile(putIMAGE(model_spectra)):
-                error_message = 'The model spectra file does not exist: ' + putIMAGE(model_spectra)
+            if not os.path.isfile(self.paths.putIMAGE(model_spectra)):
+                error_message = 'The model spectra file does not exist: ' + self.paths.putIMAGE(model_spectra)
                 raise aXeSIMError(error_message)
 
         if model_images != None:
             # check the existence of the
             # model images file
-            if not os.path.isfile(putIMAGE(model_images)):
-                error_message = 'The model images file does not exist: ' + putIMAGE(model_images)
+            if not os.path.isfile(self.paths.putIMAGE(model_images)):
+                error_message = 'The model images file does not exist: ' + self.paths.putIMAGE(model_images)
                 raise aXeSIMError(error_message)
 
         # check the nx-value
@@ -212,7 +217,7 @@ class InputChecker(object):
                 # catch a string
             except ValueError:
                 # check for existence of file
-                if not os.path.isfile(putCONF(bck_flux)):
-                    error_message = 'The background file does not exist: ' + putCONF(bck_flux)
+                if not os.path.isfile(self.paths.putCONF(bck_flux)):
+                    error_message = 'The background file does not exist: ' + self.paths.putCONF(bck_flux)
                     raise aXeSIMError(error_message)
 
@@ -7,6 +7,7 @@ WWW: http://www.stecf.org/software/slitless_software/axesim/
 import os
 import sys
 import string
+import numpy
 #from axe import axe_asciidata
 import axe_asciidata
 
@@ -367,6 +368,33 @@ class ModelObjectTable(MagColList):
         self._find_required_columns(reqColumnsNames)
 
 
+    def _get_column(self, colname):
+        """
+        Get the values of a column as array
+
+        @param colname: the column name
+        @type colname: string
+
+        @return: the column values
+        @rtype: numpy array
+        """
+        return numpy.asarray(self[colname].tonumpy(), dtype=numpy.float64)
+
+    def _set_column(self, colname, values):
+        """
+        Set all values of a column
+
+        The column is created if it does not exist.
+
+        @param colname: the column name
+        @type colname: string
+        @param values: the new values
+        @type values: numpy array
+        """
+        column = self[colname]
+        for index, value in enumerate(values.tolist()):
+            column[index] = value
+
     def fill_columns(self, WCSimage, WCSext=0, PSFSig=0):
         """
         Fill up column information to be ready for aXe
@@ -390,36 +418,42 @@ class ModelObjectTable(MagColList):
         
         if PSFSig == None:
             PSFSig = 0
-            
-        # go over all rows
-        for index in range(self.nrows):
+
+        # read the WCS once
+        img = pyfits.open(WCSimage)
+        header = img[WCSext].header
+        CRPIX1 = header['CRPIX1']
+        CRPIX2 = header['CRPIX2']
+        CRVAL1 = header['CRVAL1']
+        CRVAL2 = header['CRVAL2']
+        CD1_1 = header['CD1_1']
+        CD1_2 = header['CD1_2']
+        CD2_1 = header['CD2_1']
+        CD2_2 = header['CD2_2']
+        img.close()
+
+        if self.nrows > 0:
             # just copy some information
             # later it would be reasonable
             # to give more reasonable values
-            A_PSF = ((self['A_IMAGE'][index])**2+PSFSig**2)**0.5
-            B_PSF = ((self['B_IMAGE'][index])**2+PSFSig**2)**0.5
-            self['A_IMAGE'][index]     = A_PSF
-            self['B_IMAGE'][index]     = B_PSF
-            self['A_WORLD'][index]     = self['A_IMAGE'][index]
-            self['B_WORLD'][index]     = self['B_IMAGE'][index]
-            self['THETA_WORLD'][index] = self['THETA_IMAGE'][index]
-    
-            img = pyfits.open(WCSimage)
-            CRPIX1 = img[WCSext].header['CRPIX1']
-            CRPIX2 = img[WCSext].header['CRPIX2']
-            CRVAL1 = img[WCSext].header['CRVAL1']
-            CRVAL2 = img[WCSext].header['CRVAL2']
-            CD1_1 = img[WCSext].header['CD1_1']
-            CD1_2 = img[WCSext].header['CD1_2']
-            CD2_1 = img[WCSext].header['CD2_1']
-            CD2_2 = img[WCSext].header['CD2_2']
-
-            ra = ( CD1_1 * ( self['X_IMAGE'][index] - CRPIX1) ) + ( CD1_2 * (self['Y_IMAGE'][index] - CRPIX2) ) + CRVAL1
-            dec = ( CD2_1 * ( self['X_IMAGE'][index] - CRPIX1) ) + ( CD2_2 * (self['Y_IMAGE'][index] - CRPIX2) ) + CRVAL2
-
-            # store ra and dec
-            self['X_WORLD'][index] = ra
-            self['Y_WORLD'][index] = dec
+            A_PSF = numpy.sqrt(self._get_column('A_IMAGE')**2 + PSFSig**2)
+            B_PSF = numpy.sqrt(self._get_column('B_IMAGE')**2 + PSFSig**2)
+            THETA = self._get_column('THETA_IMAGE')
+
+            # the world coordinates of all objects
+            dx = self._get_column('X_IMAGE') - CRPIX1
+            dy = self._get_column('Y_IMAGE') - CRPIX2
+            ra  = ( CD1_1 * dx ) + ( CD1_2 * dy ) + CRVAL1
+            dec = ( CD2_1 * dx ) + ( CD2_2 * dy ) + CRVAL2
+
+            # store all values
+            self._set_column('A_IMAGE', A_PSF)
+            self._set_column('B_IMAGE', B_PSF)
+            self._set_column('A_WORLD', A_PSF)
+            self._set_column('B_WORLD', B_PSF)
+            self._set_column('THETA_WORLD', THETA)
+            self._set_column('X_WORLD', ra)
+            self._set_column('Y_WORLD', dec)
 
         # save the changes
         self.flush()
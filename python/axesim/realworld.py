@@ -6,15 +6,86 @@ WWW: http://www.stecf.org/software/slitless_software/axesim/
 """
 import os
 import os.path
+import threading
 #from pyraf import iraf
 #from iraf import artdata
 import pyfits
 import numpy
-from scipy import stats
 
 from axesimerror import *
 from axesimutils import *
 
+# the noise maps read in this process,
+# (path, shape) -> (modification time, map)
+_noise_maps = {}
+_noise_maps_lock = threading.Lock()
+
+# the parameters of the noise model stored
+# with a noiseless image (RealWorld.save_signal())
+NOISE_KEYWORDS = [('exptime', 'EXPTIME'), ('bck_flux', 'BCKFLUX'), ('qe', 'QE'),
+                  ('dc', 'DC'), ('rn', 'RDNOISE'), ('instrument', 'INSTRUME'),
+                  ('detector', 'DETNOISE'), ('cmap', 'COSMAP'), ('reject', 'REJECT'),
+                  ('nbit', 'NBIT'), ('norm', 'NORM'), ('rdmode', 'RDMODE'), ('ngrp', 'NGRP'),
+                  ('nfrm', 'NFRM'), ('dtgrp', 'DTGRP'), ('dtfrm', 'DTFRM')]
+
+def load_noise_map(noisePath, shape):
+    """
+    Load a noise map from a fits file
+
+    The map is taken from the primary extension or, if its shape
+    does not match, from the first extension. The map is converted
+    to float32 and cached for the path and the modification time of
+    the file, such that all images with the same detector share it.
+    The returned array is read-only.
+
+    @param noisePath: path to the fits file
+    @type noisePath: string
+    @param shape: the image shape
+    @type shape: (int, int)
+
+    @return: the map, or None if no extension has the image shape
+    @rtype: numpy array
+    """
+    key = (os.path.abspath(noisePath), tuple(shape))
+    mtime = os.stat(noisePath).st_mtime
+
+    _noise_maps_lock.acquire()
+    try:
+        if key in _noise_maps and _noise_maps[key][0] == mtime:
+            return _noise_maps[key][1]
+    finally:
+        _noise_maps_lock.release()
+
+    noise_map = None
+    noise_fits = pyfits.open(noisePath)
+    try:
+        for ext in range(min(2, len(noise_fits))):
+            if noise_fits[ext].data is not None and noise_fits[ext].data.shape == tuple(shape):
+                noise_map = numpy.array(noise_fits[ext].data, dtype=numpy.float32)
+                break
+    finally:
+        noise_fits.close()
+
+    if noise_map is not None:
+        noise_map.flags.writeable = False
+        _noise_maps_lock.acquire()
+        try:
+            _noise_maps[key] = (mtime, noise_map)
+        finally:
+            _noise_maps_lock.release()
+
+    return noise_map
+
+def clear_noise_maps():
+    """
+    Release the cached noise maps
+    """
+    _noise_maps_lock.acquire()
+    try:
+        _noise_maps.clear()
+    finally:
+        _noise_maps_lock.release()
+
 class RealWorld(object):
     """
     Class for to add poisson noise
@@ -22,7 +93,7 @@ class RealWorld(object):
     def __init__(self, image_name, extname='0', exptime=1.0, bck_flux=0.0,
                  qe=None, dc=None, rn=None, instrument=None, detector=True,
                  cmap=None, reject=None, nbit=None, norm=True, rdmode=None,
-                 ngrp=None, nfrm=None, dtgrp=None, dtfrm=None):
+                 ngrp=None, nfrm=None, dtgrp=None, dtfrm=None, paths=None, seed=None):
         """
         Initializes the class
 
@@ -30,8 +101,8 @@ class RealWorld(object):
         parameters. Reasonable defaults are defined as well.
         'None' as input is converted to the corresponding default.
 
-        @param image_name: the name of the input image
-        @type image_name: string
+        @param image_name: the name of the input image or the image itself
+        @type image_name: string or pyfits.HDUList
         @param extname: the extension to use
         @type extname: string
         @param exptime: the exposure time
@@ -62,21 +133,32 @@ class RealWorld(object):
         @type dtgrp: float
         @param dtfrm: time between each frame
         @type dtfrm: float
+        @param paths: the aXe directories (from the environment if None)
+        @type paths: AxePaths
+        @param seed: seed (integer or list of integers) or random state for the noise
+        @type seed: int, list or numpy.random.RandomState
         """
-        # check whether the image exists
-        if not os.path.isfile(image_name):
-            err_msg = '\nImage: "'+image_name+'" does not exist!'
-            raise aXeSIMError(err_msg)
+        # an image in memory is modified in place,
+        # an image on disk is updated
+        if isinstance(image_name, pyfits.HDUList):
+            self.image = image_name
+            self.image_name = None
+        else:
+            # check whether the image exists
+            if not os.path.isfile(image_name):
+                err_msg = '\nImage: "'+image_name+'" does not exist!'
+                raise aXeSIMError(err_msg)
+            self.image = None
+            self.image_name = image_name
 
         # save the parameters
-        self.image_name = image_name
         self.extname    = extname
         self.exptime    = exptime
         self.detector   = detector
         self.norm = norm
         
         # determine and store the image dimensions
-        self.dimension = self._get_dimension(self.image_name, self.extname)
+        self.dimension = self._get_dimension(self.extname)
         self.bck_flux = bck_flux
         self.qe = qe
         self.dc = dc
@@ -118,6 +200,17 @@ Value ignored.
         self.dtgrp = dtgrp
         self.dtfrm = dtfrm
 
+        # store the aXe directories
+        if paths == None:
+            paths = AxePaths()
+        self.paths = paths
+
+        # the random stream for the noise of this detector
+        if isinstance(seed, numpy.random.RandomState):
+            self.rng = seed
+        else:
+            self.rng = numpy.random.RandomState(seed)
+
     def _set_keywords(self, img):
         """
         Set header kewords in output image
@@ -155,28 +248,48 @@ Value ignored.
         if self.dtfrm != None:
             img[self.extname].header.update('DTFRM', str(self.dtfrm))
         
-    def _get_dimension(self, image_name, extname):
+    def _open_image(self, mode='readonly'):
+        """
+        Get the input image
+
+        @param mode: the mode to open an image on disk
+        @type mode: string
+
+        @return: the image
+        @rtype: pyfits.HDUList
+        """
+        if self.image is not None:
+            return self.image
+        return pyfits.open(self.image_name, mode=mode)
+
+    def _close_image(self, img):
+        """
+        Close the input image if it is on disk
+
+        @param img: the image
+        @type img: pyfits.HDUList
+        """
+        if self.image is None:
+            img.close()
+
+    def _get_dimension(self, extname):
         """
         Get the image dimension
 
-        @param image_name: the name of the image
-        @type image_name: string
         @param extname: the extension name
         @type extname: string
 
         @return: the image-dimension (yaxis, xaxis)
         @rtype: (int, int)
         """
-        import pyfits
-
         # open the fits
-        f_img = pyfits.open(image_name, 'readonly')
+        f_img = self._open_image()
 
         # extract the image dimension
         dimension = f_img[extname].data.shape
 
         # close the image
-        f_img.close()
+        self._close_image(f_img)
 
         # return the dimension
         return dimension
@@ -185,7 +298,8 @@ Value ignored.
         """
         Load noise 
 
-        return the noise numpy array
+        return the noise as float32 scalar for a value,
+        or as (shared, read-only) float32 numpy array for a map
 
         @param noise: noise
         @type noise: float or string
@@ -193,76 +307,92 @@ Value ignored.
         noisePath = None
         
         try:
-                noise_value = float(noise)
-                noise_flux = numpy.zeros(shape)+noise_value
+                noise_flux = numpy.float32(float(noise))
         except ValueError:
-                noisePath = putCONF(noise)
+                noisePath = self.paths.putCONF(noise)
                 if os.path.isfile(noisePath):
                         try:
-                                noise_fits = pyfits.open(noisePath)
-                                noise_flux = numpy.asarray(noise_fits[0].data)
-                                if noise_flux.shape != shape:
-                                        noise_flux = numpy.asarray(noise_fits[1].data)
-                                        if noise_flux.shape != shape:
-                                                print """
-Error: noise shape not match.
-Noise will set to zero.
-                                                """
-                                                noise_flux = numpy.zeros(shape)
+                                noise_flux = load_noise_map(noisePath, shape)
                         except:
+                                noise_flux = None
+                        if noise_flux is None:
                                 print """
 Error: noise shape not match.
 Noise will set to zero.
                                 """
-                                noise_flux = numpy.zeros(shape)
+                                noise_flux = numpy.float32(0.0)
 
                 else:
                         print """
 Error: no such file %s.
 Noise will set to zero.
                         """ % noisePath
-                        noise_flux = numpy.zeros(shape)
+                        noise_flux = numpy.float32(0.0)
 
         return (noise_flux, noisePath)
 
-    def _add_regular_noise(self, flux_img, qe, dc, rn, cos):
+    def _add_regular_noise(self, flux_img, qe, dc, rn, cos, nreal=None):
         """
         This methid compute the noise using:
         * poisson statistic for signal
         * poisson statistic for the dark
         * gaussian statistic for the read noise.
         
+        The parameters are scalars or arrays with the image shape,
+        the images are computed in float32. For several realisations
+        the count image contains one realisation per plane, the error
+        image is the same for all.
+
         @param flux_img: simulated image of the sky flux [e-]
         @type flux_img: numpy array
-        @param qe: array of quantum efficienty
-        @type qe: numpy array
-        @param dc: array of dark current in [e-]
-        @type dc: numpy array
-        @param rn: array of read noise in [e-]
-        @type rn: numpy array
-        @param cos: cosmics in [e-]
+        @param qe: quantum efficienty
+        @type qe: float or numpy array
+        @param dc: dark current in [e-]
+        @type dc: float or numpy array
+        @param rn: read noise in [e-]
+        @type rn: float or numpy array
+        @param cos: cosmics in [e-] (None for no cosmics)
         @type cos: numpy array
+        @param nreal: number of realisations (one if None)
+        @type nreal: int
         @return: tuple of the count image and the error image.
         """
         
         # compute counts
-        count_img = (flux_img*qe)+dc+cos
+        count_img = numpy.array(flux_img, dtype=numpy.float32)
+        count_img *= qe
+        count_img += dc
+        if cos is not None:
+            count_img += cos
 
         # compute errors
-        err_img = (count_img+rn**2)**0.5
+        err_img = count_img + numpy.square(rn)
+        numpy.sqrt(err_img, out=err_img)
+
+        if nreal != None:
+            count_img = numpy.repeat(count_img[numpy.newaxis], nreal, axis=0)
 
-        # add fluctuations
-        count_img[count_img>0] = stats.poisson.rvs(count_img[count_img>0])
-        count_img = count_img + numpy.rint(numpy.random.normal(numpy.zeros(count_img.shape),rn))
+        # add fluctuations; pixels without
+        # positive counts keep their value
+        counts = self.rng.poisson(numpy.maximum(count_img, 0.0))
+        numpy.copyto(count_img, counts, where=count_img>0.0, casting='unsafe')
+        del counts
+
+        rnoise = self.rng.standard_normal(count_img.shape).astype(numpy.float32)
+        rnoise *= rn
+        numpy.rint(rnoise, out=rnoise)
+        count_img += rnoise
 
         return (count_img, err_img)
         
-    def _sim_detector(self, flux_img):
+    def _sim_detector(self, flux_img, nreal=None):
         """
         This method compute the number of counts for each pixel of the detector and the associated errors.
         
         @param flux_img: simulated image of the sky flux [e-]
         @type flux_img: numpy array
+        @param nreal: number of realisations (one if None)
+        @type nreal: int
         @return: tuple of the science image, the error image end the mask image
         """
         
@@ -305,19 +435,18 @@ Noise will set to zero.
                 # flag cosmic
                 dq_img[(cos>0)&(dq_img<8192)] = 8192
         else:
-                cos = numpy.zeros(flux_img.shape)
+                cos = None
 
-        (count_img, err_img) = self._add_regular_noise(flux_img, qe, dc, rn, cos)
+        (count_img, err_img) = self._add_regular_noise(flux_img, qe, dc, rn, cos, nreal)
         
         # cosmic rejection
+        sci_img = count_img
         if self.cmap!=None and self.reject == 'Perfect':
-                sci_img = count_img - numpy.rint(cos)
-        else:
-                sci_img = count_img
+                sci_img -= numpy.rint(cos)
 
         return (sci_img, err_img, dq_img)
 
-    def _make_real_sciimage(self, signal):
+    def _make_real_sciimage(self, signal, nreal=None):
         """
         Create the science extension
 
@@ -326,6 +455,8 @@ Noise will set to zero.
 
         @param signal: image of the source flux in [e-/s]
         @type signal: numpy array
+        @param nreal: number of realisations (one if None)
+        @type nreal: int
         @return: tuple of the science image, the error image end the mask image
         """
 
@@ -342,50 +473,60 @@ Noise will set to zero.
         if not self.detector or self.rdmode == 'NoNoise':
                 return (flux_img, flux_img**0.5, numpy.zeros(flux_img.shape, dtype=numpy.int))
         else:
-                return self._sim_detector(flux_img)
+                return self._sim_detector(flux_img, nreal)
         
-    def make_real(self):
+    def _finish_sciimage(self, sci, err, dq):
         """
-        Create a 'natural' image
+        Apply the numerical saturation and the normalization
 
-        Depending on the class data, method adds background and noise
-        in ordr to create a 'natural' image from the plain,
-        simulated image.
-        """
-        
-        # load input image
-        img = pyfits.open(self.image_name, mode='update')
-        signal = numpy.asarray(img[self.extname].data)
-        
-        # set if needed exposure time
-        if self.exptime == None or self.exptime == 0.0:
-                self.exptime = 1.0
-        print 'SIMDISPIM: Exposure time:                 %f' % self.exptime
-        
-        (sci,err,dq) = self._make_real_sciimage(signal)
+        The images may contain several realisations
+        along the first axis.
 
+        @param sci: the science image [e-]
+        @type sci: numpy array
+        @param err: the error image [e-]
+        @type err: numpy array
+        @param dq: the mask image
+        @type dq: numpy array
+        @return: tuple of the science image, the error image end the mask image
+        """
         # numerical saturation
         if self.nbit != None and self.nbit>0:
                 print 'SIMDISPIM: Number of bits:                %d' % self.nbit
                 vsatnum = 2**self.nbit - 1
-                sci[sci>vsatnum] = vsatnum
-                dq[(sci>vsatnum)&(dq<256)] = 256
+                saturated = sci>vsatnum
+                sci[saturated] = vsatnum
+                dq = numpy.where(saturated&(dq<256), 256, dq)
                 if self.nbit <= 16:
                     sci = numpy.uint16(sci)
                 elif self.nbit <= 32:
                     sci = numpy.uint32(sci)
                 else:
                     sci = numpy.uint64(sci)
-        
-        # set header keyword
-        self._set_keywords(img)
 
         print 'SIMDISPIM: Normalized:                    %s' % str(self.norm)
         if self.norm:
                 sci = numpy.float64(sci) / self.exptime
                 err = err / self.exptime
-        
-        # write output
+
+        return (sci, err, dq)
+
+    def _write_extensions(self, img, sci, err, dq):
+        """
+        Set the science image and append the error and mask images
+
+        @param img: the output image
+        @type img: pyfits.HDUList
+        @param sci: the science image
+        @type sci: numpy array
+        @param err: the error image
+        @type err: numpy array
+        @param dq: the mask image
+        @type dq: numpy array
+        """
+        # set header keyword
+        self._set_keywords(img)
+
         img[self.extname].data = sci
         img[len(img)-1].header.update('EXTVER', '1')
         img.append(pyfits.ImageHDU(err))
@@ -394,4 +535,130 @@ Noise will set to zero.
         img.append(pyfits.ImageHDU(dq))
         img[len(img)-1].header.update('EXTNAME', 'DQ', 'name of this extension')
         img[len(img)-1].header.update('EXTVER', '1')
-        img.flush()
+
+    def _set_exptime(self):
+        """
+        Set if needed the exposure time
+        """
+        if self.exptime == None or self.exptime == 0.0:
+                self.exptime = 1.0
+        print 'SIMDISPIM: Exposure time:                 %f' % self.exptime
+
+    def make_real(self):
+        """
+        Create a 'natural' image
+
+        Depending on the class data, method adds background and noise
+        in ordr to create a 'natural' image from the plain,
+        simulated image. An image in memory is changed in place
+        and not written.
+        """
+        
+        # load input image
+        img = self._open_image(mode='update')
+        signal = numpy.asarray(img[self.extname].data)
+        
+        self._set_exptime()
+        
+        (sci,err,dq) = self._make_real_sciimage(signal)
+        (sci,err,dq) = self._finish_sciimage(sci, err, dq)
+        
+        # write output
+        self._write_extensions(img, sci, err, dq)
+        if self.image is None:
+            img.flush()
+            img.close()
+
+    def save_signal(self, signal_name):
+        """
+        Save the noiseless image
+
+        The input image is copied before the background and the
+        noise are added. The parameters of the noise model are
+        stored in the header of the science extension, such that
+        new noise realisations are made with 'renoise()'.
+
+        @param signal_name: the name of the noiseless image
+        @type signal_name: string
+        """
+        img = self._open_image()
+        out = pyfits.HDUList([pyfits.PrimaryHDU(header=img[0].header.copy()),
+                              pyfits.ImageHDU(data=img[self.extname].data,
+                                              header=img[self.extname].header.copy())])
+        out[1].header.update('EXTNAME', self.extname)
+        hdr = out[1].header
+        for (param, keyword) in NOISE_KEYWORDS:
+            value = getattr(self, param)
+            if value != None:
+                hdr.update(keyword, value)
+        if os.path.isfile(signal_name):
+            os.unlink(signal_name)
+        out.writeto(signal_name)
+        self._close_image(img)
+
+    def make_real_batch(self, out_names):
+        """
+        Create several 'natural' images
+
+        The method makes one noise realisation of the input image
+        for each output image. The noise of all realisations is drawn
+        in one batch, the input image is not changed.
+
+        @param out_names: the names of the output images
+        @type out_names: list of string
+        """
+        nreal = len(out_names)
+
+        # load input image
+        img = self._open_image()
+        signal = numpy.asarray(img[self.extname].data)
+
+        self._set_exptime()
+
+        (sci,err,dq) = self._make_real_sciimage(signal, nreal=nreal)
+        (sci,err,dq) = self._finish_sciimage(sci, err, dq)
+
+        for i in range(nreal):
+            out = pyfits.HDUList([pyfits.PrimaryHDU(header=img[0].header.copy()),
+                                  pyfits.ImageHDU(header=img[self.extname].header.copy())])
+            out[1].header.update('EXTNAME', self.extname)
+            if sci.ndim == 3:
+                self._write_extensions(out, sci[i], err, dq if dq.ndim == 2 else dq[i])
+            else:
+                self._write_extensions(out, sci, err, dq)
+            if os.path.isfile(out_names[i]):
+                os.unlink(out_names[i])
+            out.writeto(out_names[i])
+            out.close()
+        self._close_image(img)
+
+def renoise(signal_name, out_names, seed=None, paths=None, **params):
+    """
+    Make new noise realisations of a noiseless image
+
+    The noise model is set up from the header of an image saved
+    with 'RealWorld.save_signal()'. Any parameter of the model
+    (e.g. 'exptime', 'rdmode' or 'cmap') can be changed.
+
+    @param signal_name: the name of the noiseless image
+    @type signal_name: string
+    @param out_names: the names of the output images, one per realisation
+    @type out_names: list of string
+    @param seed: seed (integer or list of integers) or random state for the noise
+    @type seed: int, list or numpy.random.RandomState
+    @param paths: the aXe directories (from the environment if None)
+    @type paths: AxePaths
+    @param params: parameters of the noise model to change
+    @type params: dict
+    """
+    img = pyfits.open(signal_name)
+    hdr = img['SCI'].header
+    kwargs = {}
+    for (param, keyword) in NOISE_KEYWORDS:
+        if keyword in hdr:
+            kwargs[param] = hdr[keyword]
+    img.close()
+    kwargs.update(params)
+
+    rworld = RealWorld(signal_name, extname='SCI', seed=seed, paths=paths, **kwargs)
+    rworld.make_real_batch(out_names)
@@ -19,7 +19,9 @@ from scipy.ndimage.filters import gaussian_filter
 import imagemaker
 import modspeclist
 import axecommands
+import axeengine
 import realworld
+import thumbnails
 import configfile
 
 from axesimerror  import *
@@ -44,29 +46,33 @@ def addImages(img1_path, img2_path, c=None):
       img1.close()
       img2.close()
 
-def addBeams(img_list):
-      # combine the images
-      img1 = pyfits.open(img_list[0], mode='update')
-      signal = numpy.asarray(img1['SCI'].data)
-      for img2_path in img_list[1:]:
-        img2 = pyfits.open(img2_path)
-        signal += numpy.asarray(img2['SCI'].data)
-        img2.close()
-        os.unlink(img2_path)
-      img1['SCI'].data = signal
-      img1.flush()
-      img1.close()
+def readSignal(img_path):
+      # load the science extension
+      img = pyfits.open(img_path)
+      signal = numpy.array(img['SCI'].data, dtype=numpy.float64)
+      img.close()
+      return signal
+
+def writeImage(img, img_path):
+      # write an image in memory
+      if os.path.isfile(img_path):
+        os.unlink(img_path)
+      img.writeto(img_path)
+
+def simOne(confile, psfsig, psfwave, nx, ny, modCat, modSpc, modImg, randRoot='t', paths=None,
+           nthreads=1):
+    if paths == None:
+        paths = AxePaths()
 
-def simOne(confile, psfsig, psfwave, nx, ny, modCat, modSpc, modImg, randRoot='t'):
     # make a full path to the
     # direct image as dummy and as final output
-    dummy_grisima_path = putIMAGE(get_random_filename(randRoot, '_DISP.fits'))
+    dummy_grisima_path = paths.putIMAGE(get_random_filename(randRoot, '_DISP.fits'))
 
-    dummy_incat_path = putIMAGE(get_random_filename(randRoot, '.cat'))
-    shutil.copy(putIMAGE(modCat), dummy_incat_path)
+    dummy_incat_path = paths.putIMAGE(get_random_filename(randRoot, '.cat'))
+    shutil.copy(paths.putIMAGE(modCat), dummy_incat_path)
     
     # create the dummy image maker
-    i_maker = imagemaker.DummyImages(putCONF(confile), dummy_grisima_path, None, nx, ny)
+    i_maker = imagemaker.DummyImages(paths.putCONF(confile), dummy_grisima_path, None, nx, ny)
     i_maker.makeImages()
 
     # load the model object table
@@ -76,7 +82,8 @@ def simOne(confile, psfsig, psfwave, nx, ny, modCat, modSpc, modImg, randRoot='t
 
     # load the object to make the grism simulations
     grismator = axecommands.DispImator(i_maker, confile, dummy_incat_path,
-                                       psfwave, modSpc, modImg)
+                                       psfwave, modSpc, modImg, paths=paths,
+                                       nthreads=nthreads)
     grismator.run()
 
     grismator.mopup()
@@ -84,6 +91,121 @@ def simOne(confile, psfsig, psfwave, nx, ny, modCat, modSpc, modImg, randRoot='t
     
     return dummy_grisima_path
 
+def simGroup(i_maker, confile, components, psfwave, modCat, modSpc, modImg, randRoot='t', paths=None,
+             nthreads=1):
+    """
+    Model all beams of a configuration file for one or several PSF components
+
+    The dispersed images are computed in-process and summed with
+    the weights of the PSF components.
+
+    @param i_maker: the dummy images
+    @type i_maker: DummyImages
+    @param confile: the simulation configuration file
+    @type confile: string
+    @param components: the PSF sigma and the weight of each component
+    @type components: [(float, float)]
+    @param nthreads: number of threads to model the objects
+    @type nthreads: int
+
+    @return: the summed model image
+    @rtype: numpy.ndarray
+    """
+    if paths == None:
+        paths = AxePaths()
+
+    signal = None
+    for psfsig, weight in components:
+        # the PSF broadens the objects in the
+        # model object table, hence a new copy
+        dummy_incat_path = paths.putIMAGE(get_random_filename(randRoot, '.cat'))
+        shutil.copy(paths.putIMAGE(modCat), dummy_incat_path)
+
+        # load and fill the model object table
+        inobjects = modspeclist.ModelObjectTable(dummy_incat_path, modSpc, modImg)
+        inobjects.fill_columns(i_maker.WCSimage, i_maker.WCSext, psfsig)
+
+        grismator = axecommands.DispImator(i_maker, confile, dummy_incat_path,
+                                           psfwave, modSpc, modImg, paths=paths,
+                                           nthreads=nthreads)
+        grismator.run_engine()
+        os.unlink(dummy_incat_path)
+
+        if signal is None:
+            signal = weight * grismator.image
+        else:
+            signal += weight * grismator.image
+
+    return signal
+
+def getBeamPSF(conf, beam):
+    """
+    Get the PSF parameters of a beam
+
+    The beam specific keywords 'PSFSIG1<beam>', 'PSFSIG2<beam>'
+    and 'PSFC<beam>' take precedence over the global keywords.
+
+    @param conf: the aXe configuration file
+    @type conf: ConfigFile
+    @param beam: the beam
+    @type beam: string
+
+    @return: psfsig1, psfsig2, psfc
+    @rtype: (float, float, float)
+    """
+    # load PSFSIG1-value
+    psfkey = 'PSFSIG1'+beam
+    if conf.beams[beam].get_bvalue(psfkey) != None:
+      psfsig1 = float(conf.beams[beam].get_bvalue(psfkey))
+      print 'SIMDISPIM: Sigma PSF %s:                   %f' % (beam, psfsig1)
+    elif conf.get_gvalue('PSFSIG1') != None:
+      psfsig1 = float(conf.get_gvalue('PSFSIG1'))
+      print 'SIMDISPIM: Sigma PSF:                     %f' % psfsig1
+    else:
+      psfsig1=None
+
+    # load PSFSIG2-value is exist
+    psfkey = 'PSFSIG2'+beam
+    if conf.beams[beam].get_bvalue(psfkey) != None:
+      psfsig2 = float(conf.beams[beam].get_bvalue(psfkey))
+      print 'SIMDISPIM: Sigma PSF %s:                   %f' % (beam, psfsig2)
+    elif conf.get_gvalue('PSFSIG2') != None:
+      psfsig2 = float(conf.get_gvalue('PSFSIG2'))
+      print 'SIMDISPIM: Sigma PSF:                     %f' % psfsig2
+    else:
+      psfsig2=None
+
+    psfkey = 'PSFC'+beam
+    if conf.beams[beam].get_bvalue(psfkey) != None:
+      psfc = float(conf.beams[beam].get_bvalue(psfkey))
+      print 'SIMDISPIM: C PSF %s:                       %f' % (beam, psfc)
+    elif conf.get_gvalue('PSFC') != None:
+      psfc = float(conf.get_gvalue('PSFC'))
+      print 'SIMDISPIM: C PSF:                         %f' % psfc
+    else:
+      psfc=None
+
+    if psfsig1 != None and psfsig1 < 0:
+          error_message = 'Value for "PSFSIG1" most be positive: ' + str(psfsig1)
+          raise aXeSIMError(error_message)
+    if psfsig2 != None and psfsig2 < 0:
+          error_message = 'Value for "PSFSIG2" most be positive: ' + str(psfsig2)
+          raise aXeSIMError(error_message)
+    if psfsig2 != None and psfsig1 == None:
+          error_message = 'Value for "PSFSIG1" is not defined'
+          raise aXeSIMError(error_message)
+    if psfc != None and (psfc < 0 or psfc > 1):
+          error_message = 'Value for "PSFC" most be positive and smaller than 1.0: ' + str(psfc)
+          raise aXeSIMError(error_message)
+    if psfc == None and psfsig2 != None:
+          error_message = 'Value for "PSFC" is not defined'
+          raise aXeSIMError(error_message)
+    if psfc != None and psfsig2 == None:
+          error_message = 'Value for "PSFSIG2" is not defined'
+          raise aXeSIMError(error_message)
+
+    return psfsig1, psfsig2, psfc
+
 def doubleGaussConv(data, sigma1, sigma2, c, smpfac):
     if sigma1 == None:
         return data
@@ -112,44 +234,141 @@ def resample(data, smpfac):
         znew = f(xnew, ynew)
         return znew/znew.sum()
 
-def prepModImg(modimg_path, sigma1, sigma2, c, randRoot='t'):
+def prepModImg(modimg_path, sigma1, sigma2, c, randRoot='t', paths=None, nproc=1):
+    """
+    Convolve the model images with the PSF and resample them
+
+    All thumbnails are processed in batches (see 'thumbnails.prep_thumbnails()').
+    The model images are either packed (see 'thumbnails.pack_thumbnails()')
+    or stored with one image extension per thumbnail.
+
+    @param modimg_path: name of the model images
+    @type modimg_path: string
+    @param sigma1: the sigma of the first gaussian
+    @type sigma1: float
+    @param sigma2: the sigma of the second gaussian
+    @type sigma2: float
+    @param c: the weight of the first gaussian
+    @type c: float
+    @param nproc: number of processes (0 for all cores)
+    @type nproc: int
+
+    @return: name of the prepared model images
+    @rtype: string
+    """
+    if paths == None:
+        paths = AxePaths()
   
     # load model image
     dummy_modimg_path = get_random_filename(randRoot, '_MOD.fits')
-    inModImg = pyfits.open(putIMAGE(modimg_path))
-    outModImg = pyfits.HDUList()
-    outModImg.append(pyfits.PrimaryHDU())
+    inModImg = pyfits.open(paths.putIMAGE(modimg_path))
     
-    # loop on model images
-    irange = xrange(1, len(inModImg))
-    for i in irange:
-        # load image
-        data = numpy.asarray(inModImg[i].data)
-        
-        # get sampling factor
-        try:
-            smpfac = float(inModImg[i].header['SMPFAC'])
-            if smpfac <= 0.0:
-                error_message = 'Sampling factor must be positive: %f' % smpfac
-                raise aXeSIMError(error_message)
-        except KeyError, ValueError:
-            smpfac = 1.0
+    # collect the model images
+    # and their sampling factors
+    (thumbs, smpfacs) = thumbnails.read_thumbnails(inModImg)
     
-        # convolve with PSF
-        ndata = doubleGaussConv(data, sigma1, sigma2, c, smpfac)
+    # convolve with PSF and resample if needed
+    rthumbs = thumbnails.prep_thumbnails(thumbs, smpfacs, sigma1, sigma2, c, nproc=nproc)
+    inModImg.close()
 
-        # resample if needed
-        rdata = resample(ndata, smpfac)
-        
+    outModImg = pyfits.HDUList()
+    outModImg.append(pyfits.PrimaryHDU())
+    for rdata in rthumbs:
         outModImg.append(pyfits.ImageHDU(rdata))
         
-    outModImg.writeto(putIMAGE(dummy_modimg_path))
+    outModImg.writeto(paths.putIMAGE(dummy_modimg_path))
     return dummy_modimg_path
             
+class ModImgCache(object):
+    """
+    Cache of the model images prepared with 'prepModImg()'
+
+    The prepared model images are keyed by the model image file
+    (path, size and modification time), the PSF parameters and
+    the image directory. Identical sets of convolved thumbnails
+    are then made once and used by all beams with the same PSF,
+    also over several calls of 'simdispim()' (e.g. for detectors
+    sharing a model image file). The prepared files are deleted
+    with 'close()'.
+    """
+    def __init__(self):
+        """
+        Initializes the class
+        """
+        # the prepared model images
+        # and their full paths
+        self.mod_images = {}
+
+    def _get_key(self, modimg_path, sigma1, sigma2, c, paths):
+        """
+        Get the key of a prepared model image
+
+        @param modimg_path: name of the model images
+        @type modimg_path: string
+        @param sigma1: the sigma of the first gaussian
+        @type sigma1: float
+        @param sigma2: the sigma of the second gaussian
+        @type sigma2: float
+        @param c: the weight of the first gaussian
+        @type c: float
+        @param paths: the aXe directories
+        @type paths: AxePaths
+
+        @return: the key
+        @rtype: tuple
+        """
+        fullpath = os.path.abspath(paths.putIMAGE(modimg_path))
+        try:
+            stat = os.stat(fullpath)
+        except OSError:
+            error_message = 'Model image file does not exist: ' + fullpath
+            raise aXeSIMError(error_message)
+        return (fullpath, stat.st_size, stat.st_mtime, sigma1, sigma2, c,
+                os.path.abspath(paths.putIMAGE()))
+
+    def get(self, modimg_path, sigma1, sigma2, c, randRoot='t', paths=None, nproc=1):
+        """
+        Get the model images prepared for a PSF
+
+        The model images are prepared if they are not in the cache.
+
+        @param modimg_path: name of the model images
+        @type modimg_path: string
+        @param sigma1: the sigma of the first gaussian
+        @type sigma1: float
+        @param sigma2: the sigma of the second gaussian
+        @type sigma2: float
+        @param c: the weight of the first gaussian
+        @type c: float
+        @param nproc: number of processes (0 for all cores)
+        @type nproc: int
+
+        @return: name of the prepared model images
+        @rtype: string
+        """
+        if paths == None:
+            paths = AxePaths()
+
+        key = self._get_key(modimg_path, sigma1, sigma2, c, paths)
+        if key not in self.mod_images or not os.path.isfile(self.mod_images[key][1]):
+            name = prepModImg(modimg_path, sigma1, sigma2, c, randRoot=randRoot, paths=paths, nproc=nproc)
+            self.mod_images[key] = (name, paths.putIMAGE(name))
+        return self.mod_images[key][0]
+
+    def close(self):
+        """
+        Delete all prepared model images
+        """
+        for (name, fullpath) in self.mod_images.values():
+            if os.path.isfile(fullpath):
+                os.unlink(fullpath)
+        self.mod_images = {}
+
 def simdispim(incat=None, config=None, dispim_name=None, exptime=None,
               model_spectra=None, model_images=None, bck_flux=0.0,
               silent=True, debug=False, detector=True,
-              norm=True):
+              norm=True, paths=None, single_pass=True, nthreads=1, seed=None,
+              signal_name=None, finish=None, mod_cache=None):
     """
     Main function for the task SIMDISPIM
 
@@ -177,227 +396,286 @@ def simdispim(incat=None, config=None, dispim_name=None, exptime=None,
     @type detector: boolean
     @param norm: normalize image with exposure time if True
     @type norm: boolean
+    @param paths: the aXe directories (from the environment if None)
+    @type paths: AxePaths
+    @param single_pass: model beams with identical PSF together in-process
+    @type single_pass: boolean
+    @param nthreads: number of threads to model the objects (0 for all cores)
+    @type nthreads: int
+    @param seed: seed of the noise (random if None)
+    @type seed: int or list of int
+    @param signal_name: name of the noiseless image to keep for 'realworld.renoise()' (not kept if None)
+    @type signal_name: string
+    @param finish: function applied to the output image before it is written
+    @type finish: function(pyfits.HDUList)
+    @param mod_cache: the prepared model images, kept by the caller (for this call only if None)
+    @type mod_cache: ModImgCache
     """
     
     if silent:
-        stdout = sys.stdout
-        sys.stdout = open(os.devnull, 'w')
-        
-    # give brief feedback
-    print '\nSIMDISPIM: Starting ...'
-
-    # just set the environments
-    get_environments()
-
-    if config==None:
-        print __doc__
-        return 1
-
-    if incat == None and (model_images != None or model_spectra != None):
-        error_message = 'incat is not defined.'
-        print __doc__
-        return 1
-       
-    # check the input parameters
-    in_check = InputChecker()
-    # for the 'simdisp'-task
-    in_check.check_simdispim_input(incat, config, model_spectra, model_images, bck_flux)
-
-    if dispim_name == None:
-        if incat == None:
-            error_message = 'Both dispim_name and incat or not defined'
-            raise aXeSIMError(error_message)
-        else:
-            # derive the output name
-            pos = incat.rfind('.')
-            if pos < 0:
-                root = incat
-            else:
-                root = incat[:pos]
-    else:
-        root = dispim_name.replace('.fits','')
-    
-    dirima_name  = root + '_direct.fits'
-    grisima_name = root + '.fits'
-    
-    final_dirima_path  = putOUTSIM(dirima_name)
-    final_grisima_path = putOUTSIM(grisima_name)
-
-    # load the aXe configuration file
-    conf = configfile.ConfigFile(putCONF(config))
-
-    # load exptime-value
-    if exptime == None:
-      exptime = float(conf.get_gvalue('EXPTIME'))
-    if exptime != None and exptime < 0:
-      error_message = 'Value for "exptime" or "exptime_disp" most be positive: ' + str(exptime)
-      raise aXeSIMError(error_message)
-
-    # load lambda_psf 
-    lambda_psf = conf.confirm_lambda_psf()
-
-    # load nx-value
-    nx = int(conf.get_gvalue('NPIXX'))
-    if nx != None and nx <= 0.0:
-      error_message = 'Value for "nx" or "nx_disp" most be positive: ' + str(nx)
-      raise aXeSIMError(error_message)
-
-    # load ny-value
-    ny = int(conf.get_gvalue('NPIXY'))
-    if ny != None and ny <= 0:
-      error_message = 'Value for "ny" or "ny_disp" most be positive: ' + str(ny)
-      raise aXeSIMError(error_message)
-    if incat != None:
-        print 'SIMDISPIM: Input Model Object List:       %s' % putIMAGE(incat)
-    print 'SIMDISPIM: Input aXe configuration file:  %s' % putCONF(config)
-    if model_spectra != None:
-        print 'SIMDISPIM: Input Model Spectra:           %s' % putIMAGE(model_spectra)
-    if model_images != None:
-        print 'SIMDISPIM: Input Model Image:             %s' % putIMAGE(model_images)
-    print 'SIMDISPIM: Fixed wavlength for PSF:       %s' % str(lambda_psf)
-    if exptime != None:
-        print 'SIMDISPIM: Input exposure time:           %s' % str(exptime)
-    if nx == None and ny == None:
-        print 'SIMDISPIM: Input image dimensions:        %s' % 'AUTO'
-    else:
-        print 'SIMDISPIM: Input image dimensions:        (%s,%s)' % (str(nx),str(ny))
+        mute_stdout()
 
-    print 'SIMDISPIM: Output dispersed image:        %s' % final_grisima_path
+    # the model images prepared for each PSF
+    if mod_cache == None:
+      modimg_cache = ModImgCache()
+    else:
+      modimg_cache = mod_cache
 
-    print ''
-   
+    # the dummy images, deleted
+    # also on an error
+    dummy_grisima_path = None
     dummy_grisima_list = []
-    for beam in conf.beams:
-      # make the simulation configuration
-      # file pointing the correct extensions
-      config_simul = conf.axesim_prep(beam)
-
-      # load the simulation configuration file
-      conf_simul = configfile.ConfigFile(putCONF(config_simul))
-      
-      # load PSFSIG1-value
-      psfkey = 'PSFSIG1'+beam
-      if conf.beams[beam].get_bvalue(psfkey) != None:
-        psfsig1 = float(conf.beams[beam].get_bvalue(psfkey))
-        print 'SIMDISPIM: Sigma PSF %s:                   %f' % (beam, psfsig1)
-      elif conf_simul.get_gvalue('PSFSIG1') != None:
-        psfsig1 = float(conf_simul.get_gvalue('PSFSIG1'))
-        print 'SIMDISPIM: Sigma PSF:                     %f' % psfsig1
-      else:
-        psfsig1=None
- 
-      # load PSFSIG2-value is exist
-      psfkey = 'PSFSIG2'+beam
-      if conf.beams[beam].get_bvalue(psfkey) != None:
-        psfsig2 = float(conf.beams[beam].get_bvalue(psfkey))
-        print 'SIMDISPIM: Sigma PSF %s:                   %f' % (beam, psfsig2)
-      elif conf_simul.get_gvalue('PSFSIG2') != None:
-        psfsig2 = float(conf_simul.get_gvalue('PSFSIG2'))
-        print 'SIMDISPIM: Sigma PSF:                     %f' % psfsig2
-      else:
-        psfsig2=None       
-        
-      psfkey = 'PSFC'+beam
-      if conf.beams[beam].get_bvalue(psfkey) != None:
-        psfc = float(conf.beams[beam].get_bvalue(psfkey))
-        print 'SIMDISPIM: C PSF %s:                       %f' % (beam, psfc)
-      elif conf_simul.get_gvalue('PSFC') != None:
-        psfc = float(conf_simul.get_gvalue('PSFC'))
-        print 'SIMDISPIM: C PSF:                         %f' % psfc
-      else:
-        psfc=None
-      
-      if psfsig1 != None and psfsig1 < 0:
-            error_message = 'Value for "PSFSIG1" most be positive: ' + str(psfsig1)
-            raise aXeSIMError(error_message)     
-      if psfsig2 != None and psfsig2 < 0:
-            error_message = 'Value for "PSFSIG2" most be positive: ' + str(psfsig2)
-            raise aXeSIMError(error_message)
-      if psfsig2 != None and psfsig1 == None:
-            error_message = 'Value for "PSFSIG1" is not defined'
-            raise aXeSIMError(error_message)
-      if psfc != None and (psfc < 0 or psfc > 1):
-            error_message = 'Value for "PSFC" most be positive and smaller than 1.0: ' + str(psfc)
-            raise aXeSIMError(error_message)            
-      if psfc == None and psfsig2 != None:
-            error_message = 'Value for "PSFC" is not defined'
-            raise aXeSIMError(error_message)
-      if psfc != None and psfsig2 == None:
-            error_message = 'Value for "PSFSIG2" is not defined'
-            raise aXeSIMError(error_message)     
-      
-      if incat != None:
+    dummy_img = None
+
+    # stdout and the prepared model images are
+    # restored and deleted also on an error
+    try:
+        # give brief feedback
+        print '\nSIMDISPIM: Starting ...'
+
+        # the aXe directories of this run
+        if paths == None:
+            paths = AxePaths()
+
+        if config==None:
+            print __doc__
+            return 1
+
+        if incat == None and (model_images != None or model_spectra != None):
+            error_message = 'incat is not defined.'
+            print __doc__
+            return 1
+
+        # check the input parameters
+        in_check = InputChecker(paths)
+        # for the 'simdisp'-task
+        in_check.check_simdispim_input(incat, config, model_spectra, model_images, bck_flux)
+
+        if dispim_name == None:
+            if incat == None:
+                error_message = 'Both dispim_name and incat or not defined'
+                raise aXeSIMError(error_message)
+            else:
+                # derive the output name
+                pos = incat.rfind('.')
+                if pos < 0:
+                    root = incat
+                else:
+                    root = incat[:pos]
+        else:
+            root = dispim_name.replace('.fits','')
+
+        dirima_name  = root + '_direct.fits'
+        grisima_name = root + '.fits'
+
+        final_dirima_path  = paths.putOUTSIM(dirima_name)
+        final_grisima_path = paths.putOUTSIM(grisima_name)
+
+        # load the aXe configuration file
+        conf = configfile.ConfigFile(paths.putCONF(config))
+
+        # load exptime-value
+        if exptime == None:
+          exptime = float(conf.get_gvalue('EXPTIME'))
+        if exptime != None and exptime < 0:
+          error_message = 'Value for "exptime" or "exptime_disp" most be positive: ' + str(exptime)
+          raise aXeSIMError(error_message)
+
+        # load lambda_psf 
+        lambda_psf = conf.confirm_lambda_psf()
+
+        # load nx-value
+        nx = int(conf.get_gvalue('NPIXX'))
+        if nx != None and nx <= 0.0:
+          error_message = 'Value for "nx" or "nx_disp" most be positive: ' + str(nx)
+          raise aXeSIMError(error_message)
+
+        # load ny-value
+        ny = int(conf.get_gvalue('NPIXY'))
+        if ny != None and ny <= 0:
+          error_message = 'Value for "ny" or "ny_disp" most be positive: ' + str(ny)
+          raise aXeSIMError(error_message)
+        if incat != None:
+            print 'SIMDISPIM: Input Model Object List:       %s' % paths.putIMAGE(incat)
+        print 'SIMDISPIM: Input aXe configuration file:  %s' % paths.putCONF(config)
+        if model_spectra != None:
+            print 'SIMDISPIM: Input Model Spectra:           %s' % paths.putIMAGE(model_spectra)
         if model_images != None:
-           # check scipy version and print warning is < 0.12
-           scipy_version = (scipy.__version__).split('.')
-           if int(scipy_version[0])<1 and int(scipy_version[1])<12:
-               print "WARNING : scipy version = %s and thumbnails is currently not supported for  scipy version < 0.12.0" % scipy.__version__
-           modImgPath = prepModImg(model_images, psfsig1, psfsig2, psfc, randRoot=root)
-           dummy_grisima_path1 = simOne(config_simul, psfsig1, lambda_psf, nx, ny, incat, model_spectra, modImgPath, randRoot=root)
-           if debug:
-              shutil.copy(dummy_grisima_path1, final_grisima_path.replace('.fits', '_BEAM'+beam+'.fits'))
-              shutil.copy(modImgPath, final_grisima_path.replace('.fits', '_BEAM'+beam+'_MODIMG.fits'))
-           os.unlink(putIMAGE(modImgPath))
+            print 'SIMDISPIM: Input Model Image:             %s' % paths.putIMAGE(model_images)
+        print 'SIMDISPIM: Fixed wavlength for PSF:       %s' % str(lambda_psf)
+        if exptime != None:
+            print 'SIMDISPIM: Input exposure time:           %s' % str(exptime)
+        if nx == None and ny == None:
+            print 'SIMDISPIM: Input image dimensions:        %s' % 'AUTO'
         else:
-          dummy_grisima_path1 = simOne(config_simul, psfsig1, lambda_psf, nx, ny, incat, model_spectra, None, randRoot=root)
-          if debug:
-              shutil.copy(dummy_grisima_path1, final_grisima_path.replace('.fits', '_PSF1_BEAM'+beam+'.fits'))
-          if psfsig2 != None:
-              dummy_grisima_path2 = simOne(config_simul, psfsig2, lambda_psf, nx, ny, incat, model_spectra, None, randRoot=root)
-              if debug:
-                  shutil.copy(dummy_grisima_path2, final_grisima_path.replace('.fits', '_PSF2_BEAM'+beam+'.fits'))
-          
-              addImages(dummy_grisima_path1, dummy_grisima_path2, psfc)
-              if debug:
-                  shutil.copy(dummy_grisima_path1, final_grisima_path.replace('.fits', '_BEAM'+beam+'.fits'))
-              os.unlink(dummy_grisima_path2)
-              
-        dummy_grisima_list.append(dummy_grisima_path1)
-        
-        del conf_simul
+            print 'SIMDISPIM: Input image dimensions:        (%s,%s)' % (str(nx),str(ny))
+
+        print 'SIMDISPIM: Output dispersed image:        %s' % final_grisima_path
+
+        print ''
+
+        # get the PSF parameters of all beams
+        beam_psfs = {}
+        for beam in sorted(conf.beams.keys()):
+          beam_psfs[beam] = getBeamPSF(conf, beam)
+
+        if incat != None and model_images != None:
+          # check scipy version and print warning is < 0.12
+          scipy_version = (scipy.__version__).split('.')
+          if int(scipy_version[0])<1 and int(scipy_version[1])<12:
+            print "WARNING : scipy version = %s and thumbnails is currently not supported for  scipy version < 0.12.0" % scipy.__version__
+
+        if incat != None and single_pass and axeengine.has_axesim_lib(paths):
+          # make a full path to the
+          # dispersed image as dummy
+          dummy_grisima_path = paths.putIMAGE(get_random_filename(root, '_DISP.fits'))
+
+          # group the beams with identical PSF
+          psf_groups = {}
+          for beam in sorted(beam_psfs.keys()):
+            psf_groups.setdefault(beam_psfs[beam], []).append(beam)
+
+          signal = numpy.zeros((ny, nx), dtype=numpy.float64)
+          i_maker = None
+          for psf in sorted(psf_groups.keys()):
+            psfsig1, psfsig2, psfc = psf
+
+            # make the simulation configuration
+            # file with all beams of the group
+            config_simul = conf.axesim_prep(psf_groups[psf])
+            print 'SIMDISPIM: Modelling beam(s) %s in one pass' % ','.join(psf_groups[psf])
+
+            # create the dummy image once
+            if i_maker == None:
+              i_maker = imagemaker.DummyImages(paths.putCONF(config_simul), dummy_grisima_path, None, nx, ny)
+              i_maker.makeImages()
+
+            if model_images != None:
+              # the PSF is applied to the model images
+              modImgPath = modimg_cache.get(model_images, psfsig1, psfsig2, psfc, randRoot=root, paths=paths,
+                                            nproc=nthreads)
+              components = [(psfsig1, 1.0)]
+            elif psfsig2 != None:
+              modImgPath = None
+              components = [(psfsig1, psfc), (psfsig2, 1.0-psfc)]
+            else:
+              modImgPath = None
+              components = [(psfsig1, 1.0)]
+
+            signal += simGroup(i_maker, config_simul, components, lambda_psf, incat,
+                               model_spectra, modImgPath, randRoot=root, paths=paths,
+                               nthreads=nthreads)
+
+          # the summed model in the dummy image,
+          # the zero data of the dummy is not read
+          dummy_img = pyfits.open(dummy_grisima_path)
+          dummy_img['SCI'].data = signal.astype(numpy.float32)
+          print ''
+        else:
+          signal = numpy.zeros((ny, nx), dtype=numpy.float64)
+          for beam in sorted(beam_psfs.keys()):
+            psfsig1, psfsig2, psfc = beam_psfs[beam]
+
+            # make the simulation configuration
+            # file pointing the correct extensions
+            config_simul = conf.axesim_prep(beam)
+
+            if incat != None:
+              if model_images != None:
+                 modImgPath = modimg_cache.get(model_images, psfsig1, psfsig2, psfc, randRoot=root, paths=paths,
+                                               nproc=nthreads)
+                 dummy_grisima_path1 = simOne(config_simul, psfsig1, lambda_psf, nx, ny, incat, model_spectra, modImgPath, randRoot=root, paths=paths,
+                               nthreads=nthreads)
+                 if debug:
+                    shutil.copy(dummy_grisima_path1, final_grisima_path.replace('.fits', '_BEAM'+beam+'.fits'))
+                    shutil.copy(paths.putIMAGE(modImgPath), final_grisima_path.replace('.fits', '_BEAM'+beam+'_MODIMG.fits'))
+                 signal += readSignal(dummy_grisima_path1)
+              else:
+                dummy_grisima_path1 = simOne(config_simul, psfsig1, lambda_psf, nx, ny, incat, model_spectra, None, randRoot=root, paths=paths, nthreads=nthreads)
+                if debug:
+                    shutil.copy(dummy_grisima_path1, final_grisima_path.replace('.fits', '_PSF1_BEAM'+beam+'.fits'))
+                if psfsig2 != None:
+                    dummy_grisima_path2 = simOne(config_simul, psfsig2, lambda_psf, nx, ny, incat, model_spectra, None, randRoot=root, paths=paths, nthreads=nthreads)
+                    if debug:
+                        shutil.copy(dummy_grisima_path2, final_grisima_path.replace('.fits', '_PSF2_BEAM'+beam+'.fits'))
+
+                    signal += psfc*readSignal(dummy_grisima_path1) + (1.0-psfc)*readSignal(dummy_grisima_path2)
+                    if debug:
+                        addImages(dummy_grisima_path1, dummy_grisima_path2, psfc)
+                        shutil.copy(dummy_grisima_path1, final_grisima_path.replace('.fits', '_BEAM'+beam+'.fits'))
+                    os.unlink(dummy_grisima_path2)
+                else:
+                    signal += readSignal(dummy_grisima_path1)
+
+              dummy_grisima_list.append(dummy_grisima_path1)
+              print ''
+            else:
+              # make a full path to the
+              # direct image as dummy and as final output
+              dummy_grisima_path = paths.putIMAGE(get_random_filename(root, '_DISP.fits'))
+
+              # create the dummy image maker
+              i_maker = imagemaker.DummyImages(paths.putCONF(config_simul), dummy_grisima_path, None, nx, ny)
+              i_maker.makeImages()
+
+          if incat != None:
+            # the summed beams in the image of the first beam
+            dummy_grisima_path = dummy_grisima_list[0]
+            for dummy_grisima_path1 in dummy_grisima_list[1:]:
+              os.unlink(dummy_grisima_path1)
+            dummy_img = pyfits.open(dummy_grisima_path)
+            dummy_img['SCI'].data = signal.astype(numpy.float32)
+          else:
+            dummy_img = pyfits.open(dummy_grisima_path)
+
+        if debug and incat != None:
+          writeImage(dummy_img, final_grisima_path.replace('.fits', '_nodet.fits'))
+
+        # convert the image into
+        # a full output image with three extensions
+        # and noise (if desired), all in memory
+        rworld = realworld.RealWorld(dummy_img, extname='SCI', exptime=exptime,
+                                     bck_flux=bck_flux, qe=conf['QE'], dc=conf['DC'], rn=conf['RDNOISE'],
+                                     instrument=conf['INSTRUMENT'], detector=detector, cmap=conf['COSMAP'],
+                                     reject=conf['REJECT'], nbit=conf['NBIT'], norm=norm, rdmode=conf['RDMODE'], 
+                                     ngrp=conf['NGRP'], nfrm=conf['NFRM'], dtgrp=conf['DTGRP'], dtfrm=conf['DTFRM'],
+                                     paths=paths, seed=seed)
+        if signal_name != None:
+            rworld.save_signal(paths.putOUTSIM(signal_name))
+        rworld.make_real()
+
+        # rotate, set headers etc.
+        if finish != None:
+            finish(dummy_img)
+
+        # write the resulting image once
+        # to the correct name and place
+        writeImage(dummy_img, final_grisima_path)
+        dummy_img.close()
+        dummy_img = None
+        os.unlink(dummy_grisima_path)
+
+        # delete the object
+        # explicitly
+        del conf
+
+        # give brief feedback
+        print ''
+        print 'SIMDISPIM: Done'
         print ''
-        
-        # sum beams
-        dummy_grisima_path = dummy_grisima_list[0]
-        if len(dummy_grisima_list)>1:
-          addBeams(dummy_grisima_list)
-        
-        if debug:
-          shutil.copy(dummy_grisima_path, final_grisima_path.replace('.fits', '_nodet.fits'))
-      else:
-        # make a full path to the
-        # direct image as dummy and as final output
-        dummy_grisima_path = putIMAGE(get_random_filename(root, '_DISP.fits'))
-        
-        # create the dummy image maker
-        i_maker = imagemaker.DummyImages(putCONF(config_simul), dummy_grisima_path, None, nx, ny)
-        i_maker.makeImages()
-
-    # convert the image into
-    # a full output image with three extensions
-    # and noise (if desired)
-    rworld = realworld.RealWorld(dummy_grisima_path, extname='SCI', exptime=exptime,
-                                 bck_flux=bck_flux, qe=conf['QE'], dc=conf['DC'], rn=conf['RDNOISE'],
-                                 instrument=conf['INSTRUMENT'], detector=detector, cmap=conf['COSMAP'],
-                                 reject=conf['REJECT'], nbit=conf['NBIT'], norm=norm, rdmode=conf['RDMODE'], 
-                                 ngrp=conf['NGRP'], nfrm=conf['NFRM'], dtgrp=conf['DTGRP'], dtfrm=conf['DTFRM'])
-    rworld.make_real()
-
-    # move the resulting image to the correct
-    # name and place
-    shutil.move(dummy_grisima_path, final_grisima_path)
-
-    # delete the object
-    # explicitly
-    del conf
-
-    # give brief feedback
-    print ''
-    print 'SIMDISPIM: Done'
-    print ''
-    
-    if silent:
-        sys.stdout.close()
-        sys.stdout = stdout
 
-    return 0
+        return 0
+    finally:
+        # delete the dummy images left by an error
+        if dummy_img is not None:
+            dummy_img.close()
+        for dummy_path in dummy_grisima_list + [dummy_grisima_path]:
+            if dummy_path != None and os.path.isfile(dummy_path):
+                os.unlink(dummy_path)
+
+        # delete the prepared model images
+        # if they are not kept by the caller
+        if mod_cache == None:
+            modimg_cache.close()
+        if silent:
+            unmute_stdout()
@@ -0,0 +1,384 @@
+"""
+$Revision: 1.0 $ $Date: 2010/06/02 14:12:08 $
+Author: Julien Zoubian
+Batched PSF convolution and resampling of model image thumbnails
+"""
+import multiprocessing
+import numpy
+import pyfits
+
+from scipy import interpolate
+
+from axesimerror import *
+
+# truncation of the gaussian kernels in units
+# of sigma, as in 'gaussian_filter()'
+GAUSS_TRUNCATE = 4.0
+
+# maximal number of thumbnails processed together
+CHUNK_SIZE = 512
+
+# keyword marking a packed thumbnail file
+THM_PACK_KEY = 'THMPACK'
+
+# the Fourier transforms of the PSF kernels
+# and the resampling matrices, per process
+_psf_kernels = {}
+_resample_matrices = {}
+
+def gauss_kernel1d(sigma):
+    """
+    Compute a normalized, one dimensional gaussian kernel
+
+    The kernel is identical to the one used in 'gaussian_filter()'.
+
+    @param sigma: the sigma of the gaussian [pixel]
+    @type sigma: float
+
+    @return: the kernel, with the center in the middle
+    @rtype: numpy array
+    """
+    if sigma <= 1.0e-15:
+        return numpy.ones(1, dtype=numpy.float64)
+
+    radius = int(GAUSS_TRUNCATE * sigma + 0.5)
+    x = numpy.arange(-radius, radius+1, dtype=numpy.float64)
+    kernel = numpy.exp(-0.5 * (x / sigma)**2)
+    return kernel / kernel.sum()
+
+def _wrap_kernel(kernel, npix):
+    """
+    Place a kernel with the center at index zero of a periodic array
+
+    @param kernel: the kernel, with the center in the middle
+    @type kernel: numpy array
+    @param npix: the length of the periodic array
+    @type npix: int
+
+    @return: the periodic kernel
+    @rtype: numpy array
+    """
+    radius = len(kernel) // 2
+    wrapped = numpy.zeros(npix, dtype=numpy.float64)
+    wrapped[:radius+1] = kernel[radius:]
+    if radius > 0:
+        wrapped[-radius:] = kernel[:radius]
+    return wrapped
+
+def get_psf_kernel(shape, sigma1, sigma2, c, smpfac):
+    """
+    Get the Fourier transform of a single or double gaussian PSF
+
+    The sigmas are given at the final sampling and scaled with
+    the sampling factor. The transforms are cached for each PSF,
+    sampling factor and image shape.
+
+    @param shape: the shape of the padded images
+    @type shape: (int, int)
+    @param sigma1: the sigma of the first gaussian
+    @type sigma1: float
+    @param sigma2: the sigma of the second gaussian (or None)
+    @type sigma2: float
+    @param c: the weight of the first gaussian
+    @type c: float
+    @param smpfac: the sampling factor
+    @type smpfac: float
+
+    @return: the transform for 'numpy.fft.rfft2()'
+    @rtype: numpy array
+    """
+    key = (shape, sigma1, sigma2, c, smpfac)
+    if key not in _psf_kernels:
+        if sigma2 == None:
+            components = [(sigma1, 1.0)]
+        else:
+            components = [(sigma1, c), (sigma2, 1.0-c)]
+
+        ftkernel = numpy.zeros((shape[0], shape[1]//2+1), dtype=numpy.complex128)
+        for sigma, weight in components:
+            kernel = gauss_kernel1d(sigma*smpfac)
+            fty = numpy.fft.fft(_wrap_kernel(kernel, shape[0]))
+            ftx = numpy.fft.rfft(_wrap_kernel(kernel, shape[1]))
+            ftkernel += weight * numpy.outer(fty, ftx)
+        _psf_kernels[key] = ftkernel
+
+    return _psf_kernels[key]
+
+def get_kernel_radius(sigma1, sigma2, smpfac):
+    """
+    Get the radius of the PSF kernel
+
+    @param sigma1: the sigma of the first gaussian
+    @type sigma1: float
+    @param sigma2: the sigma of the second gaussian (or None)
+    @type sigma2: float
+    @param smpfac: the sampling factor
+    @type smpfac: float
+
+    @return: the radius [pixel]
+    @rtype: int
+    """
+    radius = len(gauss_kernel1d(sigma1*smpfac)) // 2
+    if sigma2 != None:
+        radius = max(radius, len(gauss_kernel1d(sigma2*smpfac)) // 2)
+    return radius
+
+def convolve_stack(stack, sigma1, sigma2, c, smpfac):
+    """
+    Convolve a stack of thumbnails with the PSF
+
+    The convolution is done in the Fourier domain. The thumbnails
+    are padded with the edge values, such that the result is the
+    one of 'gaussian_filter()' with mode='nearest'.
+
+    @param stack: the thumbnails, along the first axis
+    @type stack: numpy array
+    @param sigma1: the sigma of the first gaussian
+    @type sigma1: float
+    @param sigma2: the sigma of the second gaussian (or None)
+    @type sigma2: float
+    @param c: the weight of the first gaussian
+    @type c: float
+    @param smpfac: the sampling factor
+    @type smpfac: float
+
+    @return: the convolved thumbnails
+    @rtype: numpy array
+    """
+    if sigma1 == None:
+        return stack
+
+    radius = get_kernel_radius(sigma1, sigma2, smpfac)
+    if radius < 1:
+        return stack
+
+    padded = numpy.pad(stack, ((0, 0), (radius, radius), (radius, radius)), mode='edge')
+    shape = padded.shape[1:]
+    ftkernel = get_psf_kernel(shape, sigma1, sigma2, c, smpfac)
+
+    conv = numpy.fft.irfft2(numpy.fft.rfft2(padded, axes=(1, 2)) * ftkernel, s=shape, axes=(1, 2))
+    return conv[:, radius:radius+stack.shape[1], radius:radius+stack.shape[2]]
+
+def get_resample_matrix(npix, smpfac):
+    """
+    Get the matrix to resample along one axis
+
+    The quintic interpolating spline used in 'resample()' is a
+    tensor product of one dimensional splines, and the resampling
+    is a linear operation along each axis. The matrix is computed
+    once for each length and sampling factor. As in 'resample()'
+    the new positions are limited to the range of the old pixels.
+
+    @param npix: the number of pixels
+    @type npix: int
+    @param smpfac: the sampling factor
+    @type smpfac: float
+
+    @return: the matrix (new pixels, old pixels)
+    @rtype: numpy array
+    """
+    key = (npix, smpfac)
+    if key not in _resample_matrices:
+        x = numpy.arange(npix, dtype=numpy.float64)
+        xnew = numpy.clip(numpy.arange(0, npix, smpfac), 0.0, float(npix-1))
+
+        matrix = numpy.empty((len(xnew), npix), dtype=numpy.float64)
+        unit = numpy.zeros(npix, dtype=numpy.float64)
+        for index in range(npix):
+            unit[:] = 0.0
+            unit[index] = 1.0
+            tck = interpolate.splrep(x, unit, k=5, s=0)
+            matrix[:, index] = interpolate.splev(xnew, tck)
+        _resample_matrices[key] = matrix
+
+    return _resample_matrices[key]
+
+def resample_stack(stack, smpfac):
+    """
+    Resample a stack of thumbnails to the pixel scale of the image
+
+    The resampled thumbnails are normalized.
+
+    @param stack: the thumbnails, along the first axis
+    @type stack: numpy array
+    @param smpfac: the sampling factor
+    @type smpfac: float
+
+    @return: the resampled thumbnails
+    @rtype: numpy array
+    """
+    if smpfac > 1.0-1.0e-10 and smpfac < 1.0+1.0e-10:
+        return stack
+
+    ymatrix = get_resample_matrix(stack.shape[1], smpfac)
+    xmatrix = get_resample_matrix(stack.shape[2], smpfac)
+
+    # along x, then along y
+    rstack = numpy.dot(stack, xmatrix.T)
+    rstack = numpy.tensordot(rstack, ymatrix, axes=([1], [1])).transpose(0, 2, 1)
+    norm = rstack.reshape(len(rstack), -1).sum(axis=1)
+    return rstack / norm[:, numpy.newaxis, numpy.newaxis]
+
+def _prep_chunk(args):
+    """
+    Convolve and resample one chunk of thumbnails
+
+    @param args: (stack, sigma1, sigma2, c, smpfac)
+    @type args: tuple
+
+    @return: the processed thumbnails
+    @rtype: numpy array
+    """
+    (stack, sigma1, sigma2, c, smpfac) = args
+    return resample_stack(convolve_stack(stack, sigma1, sigma2, c, smpfac), smpfac)
+
+def prep_thumbnails(thumbs, smpfacs, sigma1, sigma2=None, c=None, nproc=1):
+    """
+    Convolve a list of thumbnails with the PSF and resample them
+
+    The thumbnails are grouped by shape and sampling factor, each
+    group is processed in chunks of stacked thumbnails. The chunks
+    can be distributed over several processes.
+
+    @param thumbs: the thumbnails
+    @type thumbs: list of numpy array
+    @param smpfacs: the sampling factor of each thumbnail
+    @type smpfacs: list of float
+    @param sigma1: the sigma of the first gaussian (no convolution if None)
+    @type sigma1: float
+    @param sigma2: the sigma of the second gaussian
+    @type sigma2: float
+    @param c: the weight of the first gaussian
+    @type c: float
+    @param nproc: number of processes (0 for all cores)
+    @type nproc: int
+
+    @return: the processed thumbnails, in the input order
+    @rtype: list of numpy array
+    """
+    if len(thumbs) != len(smpfacs):
+        error_message = 'Number of thumbnails and sampling factors differ: %i, %i' % (len(thumbs), len(smpfacs))
+        raise aXeSIMError(error_message)
+
+    # group the thumbnails
+    groups = {}
+    for index in range(len(thumbs)):
+        groups.setdefault((thumbs[index].shape, smpfacs[index]), []).append(index)
+
+    # stack them in chunks
+    chunks = []
+    tasks = []
+    for key in sorted(groups.keys()):
+        indices = groups[key]
+        for start in range(0, len(indices), CHUNK_SIZE):
+            chunk = indices[start:start+CHUNK_SIZE]
+            stack = numpy.array([thumbs[index] for index in chunk], dtype=numpy.float64)
+            chunks.append(chunk)
+            tasks.append((stack, sigma1, sigma2, c, key[1]))
+
+    # daemonic processes, e.g. the workers
+    # of a simulation, can not have children
+    if nproc != 1 and len(tasks) > 1 and not multiprocessing.current_process().daemon:
+        pool = multiprocessing.Pool(nproc if nproc > 0 else None)
+        try:
+            results = pool.map(_prep_chunk, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_prep_chunk(task) for task in tasks]
+
+    # back in the input order
+    prepped = [None] * len(thumbs)
+    for chunk, result in zip(chunks, results):
+        for pos, index in enumerate(chunk):
+            prepped[index] = result[pos]
+
+    return prepped
+
+def pack_thumbnails(thumbs, smpfacs, ids):
+    """
+    Pack a list of thumbnails into one HDU list
+
+    All pixels are stored in one flat image extension 'THUMBS', the
+    table extension 'THMINDEX' gives for each thumbnail its offset
+    in the pixel array, its shape and its sampling factor.
+
+    @param thumbs: the thumbnails
+    @type thumbs: list of numpy array
+    @param smpfacs: the sampling factor of each thumbnail (None for 1.0)
+    @type smpfacs: list of float
+    @param ids: the identifier of each thumbnail
+    @type ids: numpy array
+
+    @return: the packed thumbnails
+    @rtype: pyfits HDUList
+    """
+    if len(thumbs) != len(smpfacs) or len(thumbs) != len(ids):
+        error_message = 'Number of thumbnails, sampling factors and identifiers differ: %i, %i, %i' % (len(thumbs), len(smpfacs), len(ids))
+        raise aXeSIMError(error_message)
+
+    nthumbs = len(thumbs)
+    shapes = numpy.array([numpy.shape(thumb) for thumb in thumbs], dtype=numpy.int64).reshape(nthumbs, 2)
+    npix = shapes[:,0] * shapes[:,1]
+    offset = numpy.zeros(nthumbs, dtype=numpy.int64)
+    offset[1:] = numpy.cumsum(npix)[:-1]
+    smpfac = numpy.array([1.0 if fac == None else fac for fac in smpfacs], dtype=numpy.float64)
+    if nthumbs > 0:
+        pixels = numpy.concatenate([numpy.ravel(thumb) for thumb in thumbs])
+    else:
+        pixels = numpy.zeros(0, dtype=numpy.float32)
+
+    outthm = pyfits.HDUList(pyfits.PrimaryHDU())
+    outthm[0].header.update(THM_PACK_KEY, True, 'all thumbnails packed in one image')
+    outthm[0].header.update('NTHUMBS', nthumbs)
+    c1=pyfits.Column(name='NUMBER', format='J', array=numpy.arange(1, nthumbs+1))
+    c2=pyfits.Column(name='ID', format='K', array=numpy.asarray(ids, dtype=numpy.int64))
+    c3=pyfits.Column(name='OFFSET', format='K', array=offset)
+    c4=pyfits.Column(name='NX', format='J', array=shapes[:,1])
+    c5=pyfits.Column(name='NY', format='J', array=shapes[:,0])
+    c6=pyfits.Column(name='SMPFAC', format='D', array=smpfac)
+    outthm.append(pyfits.new_table([c1,c2,c3,c4,c5,c6]))
+    outthm[-1].header.update('EXTNAME', 'THMINDEX')
+    outthm.append(pyfits.ImageHDU(pixels))
+    outthm[-1].header.update('EXTNAME', 'THUMBS')
+    return outthm
+
+def read_thumbnails(inthm):
+    """
+    Read the thumbnails and their sampling factors
+
+    Both the packed format (see 'pack_thumbnails()') and the
+    format with one image extension per thumbnail are read.
+
+    @param inthm: the opened thumbnail file
+    @type inthm: pyfits HDUList
+
+    @return: the thumbnails and their sampling factors
+    @rtype: (list of numpy array, list of float)
+    """
+    thumbs = []
+    smpfacs = []
+    if inthm[0].header.get(THM_PACK_KEY, False):
+        index = inthm['THMINDEX'].data
+        pixels = numpy.asarray(inthm['THUMBS'].data).ravel()
+        for (offset, nx, ny, smpfac) in zip(index.field('OFFSET').tolist(), index.field('NX').tolist(),
+                                           index.field('NY').tolist(), index.field('SMPFAC').tolist()):
+            if offset < 0 or offset + nx*ny > len(pixels):
+                error_message = 'Thumbnail outside of the packed pixels: offset %i, shape %ix%i' % (offset, nx, ny)
+                raise aXeSIMError(error_message)
+            thumbs.append(pixels[offset:offset+nx*ny].reshape(ny, nx))
+            smpfacs.append(float(smpfac))
+    else:
+        for i in xrange(1, len(inthm)):
+            thumbs.append(numpy.asarray(inthm[i].data))
+            try:
+                smpfacs.append(float(inthm[i].header['SMPFAC']))
+            except (KeyError, ValueError):
+                smpfacs.append(1.0)
+
+    for smpfac in smpfacs:
+        if smpfac <= 0.0:
+            error_message = 'Sampling factor must be positive: %f' % smpfac
+            raise aXeSIMError(error_message)
+    return (thumbs, smpfacs)
@@ -16,6 +16,8 @@ import numpy
 import copy
 
 from axesim import *
+from axesim import realworld
+from axesim import thumbnails
 from tipserror import *
 from tipsinstrument import *
 from tipssky import *
@@ -31,6 +33,63 @@ Error: %s alredy exist and is not a directory!
   else:
       os.mkdir(dir)
 
+def selectSources(skySrc, spectroModel):
+        """
+        Function to select the sources of the sky model seen by a spectro image,
+        including the sources outside the detector with spectra on it.
+
+        param skySrc: sky model
+        type skySrc: SkySources
+        param spectroModel: spectro image
+        type spectroModel: Spectrometer
+
+        return: the catalog rows, the detector positions of the selected sources and the wcs used
+        rtype: tuple (numpy array, numpy array, numpy array, WCSObject)
+        """
+
+        # set box limit (not optimal, could be smaller in taking into account the spectra angle)
+        b = spectroModel.grism.beams[0]
+        d = spectroModel.detector
+        xmin = -b.xoff-b.xend
+        xmax = d.nx-b.xstart-b.xoff
+        ymin = -b.yoff-b.xend
+        ymax = d.ny-b.xstart-b.yoff
+        if len(spectroModel.grism.beams)>1:
+          for b in spectroModel.grism.beams[1:]:
+            if xmin>(-b.xoff-b.xend):
+              xmin = -b.xoff-b.xend
+            if xmax<(d.nx-b.xstart-b.xoff):
+              xmax = d.nx-b.xstart-b.xoff
+            if ymin>(-b.yoff-b.xend):
+              ymin = -b.yoff-b.xend
+            if ymax<(d.ny-b.xstart-b.yoff):
+              ymax = d.ny-b.xstart-b.yoff
+              
+        # get wcs data
+        wcs = copy.copy(spectroModel.wcs)
+        if spectroModel.rot90:
+            wcs.rotateCD(90.0, centered=True)
+            if spectroModel.dlim != None and spectroModel.dlim > xmin:
+                xmin = spectroModel.dlim
+            if spectroModel.ulim != None and spectroModel.ulim < xmax:
+                xmax = spectroModel.ulim    
+        else:
+            if spectroModel.llim != None and spectroModel.llim > xmin:
+                xmin = spectroModel.llim
+            if spectroModel.rlim != None and spectroModel.rlim < xmax:
+                xmax = spectroModel.rlim    
+        
+        # get the candidate sources from the sky index: the cone around
+        # the reference position which contains the whole box
+        rows = skySrc.getConeIndexes(wcs.crval1, wcs.crval2, wcs.getBoxRadius(xmin, xmax, ymin, ymax))
+        
+        (x_img, y_img) = wcs.rd2xy(skySrc.getCatCol('RA')[rows], skySrc.getCatCol('DEC')[rows])
+        
+        # select sources in the detector field
+        xysel = (x_img>=xmin)&(x_img<=xmax)&(y_img>=ymin)&(y_img<=ymax)
+        
+        return (rows[xysel], x_img[xysel], y_img[xysel], wcs)
+
 class Simulation:
         """
         Class to simulate grism image with aXeSIM
@@ -58,6 +117,11 @@ class Simulation:
                 mkdir(self.workDir+'/OUTSIM')
                 mkdir(self.workDir+'/SIMDATA')
                 mkdir(self.workDir+'/DRIZZLE')
+
+                # aXe directories of this simulation
+                self.paths = AxePaths(image_path=self.workDir+'/DATA/', config_path=self.workDir+'/CONF/',
+                                      output_path=self.workDir+'/OUTPUT/', simdata_path=self.workDir+'/SIMDATA/',
+                                      outsim_path=self.workDir+'/OUTSIM/', drizzle_path=self.workDir+'/DRIZZLE/')
                 
                 self.bck = None
                 self.motName = None
@@ -67,6 +131,9 @@ class Simulation:
                 self.outImgName = None
                 self.ngal = 0
                 
+                # the model images convolved with the PSF, made once per detector
+                self.modImgCache = ModImgCache()
+                
                 self.silent = silent
                 self.debug = False
                 
@@ -177,9 +244,12 @@ class Simulation:
                                         error_message = 'Error: Only constante sky background is implemented for now.'
                                         raise TIPSError(error_message)
         
-        def importSrc(self, skySrc, spectroModel):
+        def importSrc(self, skySrc, spectroModel, spcStore=None):
                 """
                 Method to set the Model Object Table for aXeSIM
+                
+                param spcStore: shared model spectra (if None the spectra are stored for this detector)
+                type spcStore: SpectraStore
                 """
                 
                 if spectroModel.skyAbs!=None:
@@ -198,121 +268,62 @@ class Simulation:
                 if skySrc.inThmDir != None or skySrc.inThmForm=='Split':
                     self.modImgName = self.motName.replace('.cat','.thm.fits')
                 
-                # set box limit (not optimal, could be smaller in taking into account the spectra angle)
-                b = spectroModel.grism.beams[0]
                 d = spectroModel.detector
-                xmin = -b.xoff-b.xend
-                xmax = d.nx-b.xstart-b.xoff
-                ymin = -b.yoff-b.xend
-                ymax = d.ny-b.xstart-b.yoff
-                if len(spectroModel.grism.beams)>1:
-                  for b in spectroModel.grism.beams[1:]:
-                    if xmin>(-b.xoff-b.xend):
-                      xmin = -b.xoff-b.xend
-                    if xmax<(d.nx-b.xstart-b.xoff):
-                      xmax = d.nx-b.xstart-b.xoff
-                    if ymin>(-b.yoff-b.xend):
-                      ymin = -b.yoff-b.xend
-                    if ymax<(d.ny-b.xstart-b.yoff):
-                      ymax = d.ny-b.xstart-b.yoff
-                      
-                # get wcs data
-                wcs = copy.copy(spectroModel.wcs)
-                if spectroModel.rot90:
-                    wcs.rotateCD(90.0, centered=True)
-                    if spectroModel.dlim != None and spectroModel.dlim > xmin:
-                        xmin = spectroModel.dlim
-                    if spectroModel.ulim != None and spectroModel.ulim < xmax:
-                        xmax = spectroModel.ulim    
-                else:
-                    if spectroModel.llim != None and spectroModel.llim > xmin:
-                        xmin = spectroModel.llim
-                    if spectroModel.rlim != None and spectroModel.rlim < xmax:
-                        xmax = spectroModel.rlim    
                 
                 # make aXeSIM MOT
-                ra = skySrc.getCatCol('RA')
-                dec = skySrc.getCatCol('DEC')
-                
-                (x_img, y_img) = wcs.rd2xy(ra, dec)
-
-                # Note: A_IMAGE and B_IMAGE (approximation, no sky curve)
-                a_img = skySrc.getCatCol('A_SKY')/d.scale
-                b_img = skySrc.getCatCol('B_SKY')/d.scale
-                t_img = skySrc.getCatCol('THETA_SKY')+wcs.orient
-                
-                ids = skySrc.getCatCol('NUMBER')
+                (rows, x_img, y_img, wcs) = selectSources(skySrc, spectroModel)
                 
-                # select sources in the detector field
-                xysel = (x_img>=xmin)&(x_img<=xmax)&(y_img>=ymin)&(y_img<=ymax)
-                ids = ids[xysel]
-                self.ngal = len(ids)
+                self.ngal = len(rows)
                 if self.ngal > 0:
                         #print "Prepare aXeSIM input sources: %d" % len(ids)
-                        x_img = x_img[xysel]
-                        y_img = y_img[xysel]
-                        a_img = a_img[xysel]
-                        b_img = b_img[xysel]
-                        t_img = t_img[xysel]
+                        ids = skySrc.getCatCol('NUMBER')[rows]
+                        
+                        # Note: A_IMAGE and B_IMAGE (approximation, no sky curve)
+                        a_img = skySrc.getCatCol('A_SKY')[rows]/d.scale
+                        b_img = skySrc.getCatCol('B_SKY')[rows]/d.scale
+                        t_img = skySrc.getCatCol('THETA_SKY')[rows]+wcs.orient
                         
                         # make a dummy mag col (useless but needed by axesim)
                         mag = numpy.ones(len(ids))*22.0
                         
-                        # write MOT to axesim path
-                        outcat = asciidata.createSEx(10,len(ids))
-                        outcat[0].rename('NUMBER')
-                        outcat[1].rename('X_IMAGE')
-                        outcat[2].rename('Y_IMAGE')
-                        outcat[3].rename('A_IMAGE')
-                        outcat[4].rename('B_IMAGE')
-                        outcat[5].rename('THETA_IMAGE')
-                        outcat[6].rename('MODSPEC')
-                        outcat[7].rename('MODIMAGE')
-                        outcat[8].rename('MAG_J1220')
-                        outcat[9].rename('ID')
-                        outspc = pyfits.HDUList(pyfits.PrimaryHDU())
-                        if self.modImgName != None:
-                            outthm = pyfits.HDUList(pyfits.PrimaryHDU())
+                        # model spectra: the shared store or a store for this detector only
+                        if spcStore == None:
+                            spcStore = SpectraStore(self.workDir+'/DATA/'+self.modSpecName, skySrc, rows)
+                        else:
+                            self.modSpecName = os.path.relpath(spcStore.fileName, os.path.abspath(self.workDir+'/DATA'))
                         
-                        for i in range(len(ids)):
-                                #sys.stdout.write('%i / %i \r' % (i+1,len(ids)))
-                                #sys.stdout.flush()
-                                outcat['NUMBER'][i] = i+1
-                                outcat['ID'][i] = ids[i]
-                                outcat['X_IMAGE'][i] = x_img[i]
-                                outcat['Y_IMAGE'][i] = y_img[i]
-                                outcat['A_IMAGE'][i] = a_img[i]
-                                outcat['B_IMAGE'][i] = b_img[i]
-                                outcat['THETA_IMAGE'][i] = t_img[i]
-                                outcat['MODSPEC'][i] = i+1
-                                outcat['MODIMAGE'][i] = 0
-                                outcat['MAG_J1220'][i] = mag[i]
-                                
-                                (wave,flux) = skySrc.getSpcIdent(ids[i])
-                                c1=pyfits.Column(name='WAV_NM', format='E', array=(wave/10.))
-                                c2=pyfits.Column(name='FLUX', format='E', array=(flux))
-                                outspc.append(pyfits.new_table([c1,c2]))
-                                outspc[-1].header.update('ID', ids[i])
-                                outspc[-1].header.update('NUMBER', i+1)
-                                
-                                if self.modImgName != None:
-                                    (modimg, smpfac) = skySrc.getThmIdent(ids[i], pixscl=d.scale)
-                                    outcat['MODIMAGE'][i] = i+1
-                                    outthm.append(pyfits.ImageHDU(modimg))
-                                    outthm[-1].header.update('ID', ids[i])
-                                    outthm[-1].header.update('NUMBER', i+1)
-                                    if smpfac != None:
-                                        outthm[-1].header.update('SMPFAC', smpfac)
-                                    
-                        #print '%i / %i \r' % (i+1,len(ids))
+                        # MOT columns (MODSPEC is the row in the packed spectra index);
+                        # the integer columns (e.g. large IDs) are not converted to float
+                        mot = numpy.zeros(self.ngal, dtype=[('NUMBER', numpy.int64), ('X_IMAGE', numpy.float64), ('Y_IMAGE', numpy.float64),
+                                                            ('A_IMAGE', numpy.float64), ('B_IMAGE', numpy.float64), ('THETA_IMAGE', numpy.float64),
+                                                            ('MODSPEC', numpy.int64), ('MODIMAGE', numpy.int64), ('MAG_J1220', numpy.float64),
+                                                            ('ID', numpy.int64)])
+                        mot['NUMBER'] = numpy.arange(1, self.ngal+1)
+                        mot['X_IMAGE'] = x_img
+                        mot['Y_IMAGE'] = y_img
+                        mot['A_IMAGE'] = a_img
+                        mot['B_IMAGE'] = b_img
+                        mot['THETA_IMAGE'] = t_img
+                        mot['MODSPEC'] = spcStore.getModSpec(rows)
+                        mot['MAG_J1220'] = mag
+                        mot['ID'] = ids
+                        
+                        # pack the thumbnails (MODIMAGE is the row in the thumbnail index)
+                        if self.modImgName != None:
+                            thms = skySrc.getThmIdents(ids, pixscl=d.scale)
+                            outthm = thumbnails.pack_thumbnails([thm[0] for thm in thms], [thm[1] for thm in thms], ids)
+                            mot['MODIMAGE'] = mot['NUMBER']
+                            del thms
                         
-                        outcat.writeto(self.workDir+'/DATA/'+self.motName)
+                        # write MOT to axesim path
+                        motFmt = ['%d', '%.6f', '%.6f', '%.6f', '%.6f', '%.6f', '%d', '%d', '%.4f', '%d']
+                        outcat = open(self.workDir+'/DATA/'+self.motName, 'w')
+                        for (i, colName) in enumerate(mot.dtype.names):
+                                outcat.write('# %2d %s\n' % (i+1, colName))
+                        numpy.savetxt(outcat, mot, fmt=motFmt)
+                        outcat.close()
                         del outcat
-                        if os.path.exists(self.workDir+'/DATA/'+self.modSpecName):
-                                os.unlink(self.workDir+'/DATA/'+self.modSpecName)
-                        outspc.writeto(self.workDir+'/DATA/'+self.modSpecName)
-                        outspc.close()
-                        del outspc
+                        del mot
                         if self.modImgName != None:
                             if os.path.exists(self.workDir+'/DATA/'+self.modImgName):
                                 os.unlink(self.workDir+'/DATA/'+self.modImgName)
@@ -320,34 +331,40 @@ class Simulation:
                             outthm.close()
                             del outthm
                         del mag
+                        del a_img
+                        del b_img
+                        del t_img
+                        del ids
 
                 else:
                         if not self.silent:
                             warning_message = 'Number of sources is %d !' % self.ngal
                             print TIPSWarning(warning_message)
                 
-                del ra
-                del dec
                 del x_img
                 del y_img
-                del a_img
-                del b_img
-                del t_img
-                del ids
-                del xysel
+                del rows
 
-        def prepSky(self, skySrc, spectroModel):
+        def prepSky(self, skySrc, spectroModel, spcStore=None):
                 """
                 Method to prepare aXeSIM sky inputs
+                
+                param spcStore: shared model spectra (if None the spectra are stored for this detector)
+                type spcStore: SpectraStore
                 """
 
                 self.importBck(spectroModel.skyBck)
                 if skySrc.inCat != None:
-                    self.importSrc(skySrc, spectroModel)
+                    self.importSrc(skySrc, spectroModel, spcStore)
         
-        def run(self, spectroModel, outImgName=None, norm=False):
+        def run(self, spectroModel, outImgName=None, norm=False, seed=None, keep_signal=False):
                 """
                 Method to run aXeSIM sky inputs
+                
+                param seed: seed of the noise (random if None)
+                type seed: integer or list of integer
+                param keep_signal: keep the noiseless image for renoise()
+                type keep_signal: bool
                 """
                 
                 # set out image name
@@ -360,14 +377,6 @@ class Simulation:
                 else:
                         self.outImgName = outImgName
                 
-                # set environnement variable (needed by aXeSIM)
-                os.environ['AXE_IMAGE_PATH'] = self.workDir+'/DATA/'
-                os.environ['AXE_CONFIG_PATH']  = self.workDir+'/CONF/'
-                os.environ['AXE_OUTPUT_PATH']  = self.workDir+'/OUTPUT/'
-                os.environ['AXE_OUTSIM_PATH']  = self.workDir+'/OUTSIM/'
-                os.environ['AXE_SIMDATA_PATH'] = self.workDir+'/SIMDATA/'
-                os.environ['AXE_DRIZZLE_PATH'] = self.workDir+'/DRIZZLE/'
-                
                 if self.ngal==0:
                     if not self.silent:
                         warning_message = 'No source in the simulated field : '+spectroModel.idientier+'_'+spectroModel.grism.idientier+'_'+str(spectroModel.detector.idientier)+end
@@ -376,22 +385,106 @@ class Simulation:
                     self.modSpecName = None
                     self.modImgName = None
 
+                if keep_signal:
+                        signalName = self.getSignalName()
+                else:
+                        signalName = None
+
                 # run the simulation
                 simdispim(incat=self.motName, config=self.confName, dispim_name=self.outImgName,
                           model_spectra=self.modSpecName, bck_flux=self.bck, exptime=spectroModel.exptime,
-                          model_images=self.modImgName, debug=self.debug, norm=norm, silent=self.silent)
+                          model_images=self.modImgName, debug=self.debug, norm=norm, silent=self.silent,
+                          paths=self.paths, seed=seed, signal_name=signalName,
+                          finish=lambda img: self.finishHDU(spectroModel, img, self.outImgName, seed),
+                          mod_cache=self.modImgCache)
+
+        def getSignalName(self):
+                """
+                Method to get the name of the noiseless image kept by run()
+                
+                return: the image name (in the OUTSIM directory)
+                rtype: string
+                """
+                return self.outImgName.replace('.fits', '_SIGNAL.fits')
+
+        def renoise(self, spectroModel, nreal=1, seed=None, norm=False, **params):
+                """
+                Method to make new noise realisations of the last image run()
+                with keep_signal=True, without running aXeSIM again.
+                
+                The realisation i is written to the name of the image with
+                the suffix _R<i> (e.g. ..._IMG_R000.fits).
+                
+                param spectroModel: spectro model
+                type spectroModel: Spectrometer
+                param nreal: number of realisations
+                type nreal: integer
+                param seed: seed of the noise (random if None)
+                type seed: integer or list of integer
+                param norm: normalize the images with the exposure time
+                type norm: bool
+                param params: parameters of the noise model to change (e.g. exptime, rdmode, cmap)
+                type params: dict
+                
+                return: the names of the images (in the OUTSIM directory)
+                rtype: list of string
+                """
+                
+                if self.outImgName == None or not os.path.isfile(self.paths.putOUTSIM(self.getSignalName())):
+                        error_message = 'No noiseless image, run the simulation with keep_signal=True first.'
+                        raise TIPSError(error_message)
+                
+                outNames = [self.outImgName.replace('.fits', '_R%03d.fits' % i) for i in range(nreal)]
+                realworld.renoise(self.paths.putOUTSIM(self.getSignalName()),
+                                  [self.paths.putOUTSIM(outName) for outName in outNames],
+                                  seed=seed, paths=self.paths, norm=norm, **params)
+                
+                for outName in outNames:
+                        self.finishImage(spectroModel, outName, seed)
+                
+                return outNames
 
-                img = pyfits.open(self.workDir+'/OUTSIM/'+self.outImgName, mode='update')
+        def finishImage(self, spectroModel, imgName, seed=None):
+                """
+                Method to rotate a simulated image if needed and set its headers
+                
+                param spectroModel: spectro model
+                type spectroModel: Spectrometer
+                param imgName: image name (in the OUTSIM directory)
+                type imgName: string
+                param seed: seed of the noise
+                type seed: integer or list of integer
+                """
+                
+                img = pyfits.open(self.workDir+'/OUTSIM/'+imgName, mode='update')
+                self.finishHDU(spectroModel, img, imgName, seed)
+                img.flush()
+                img.close()
+                del img
+
+        def finishHDU(self, spectroModel, img, imgName, seed=None):
+                """
+                Method to rotate a simulated image in memory if needed and set its headers
+                
+                param spectroModel: spectro model
+                type spectroModel: Spectrometer
+                param img: the image
+                type img: pyfits.HDUList
+                param imgName: image name (in the OUTSIM directory)
+                type imgName: string
+                param seed: seed of the noise
+                type seed: integer or list of integer
+                """
+                
                 # rotate image if needed
                 if spectroModel.rot90:
                     if self.debug:
-                        shutil.copy(self.workDir+'/OUTSIM/'+self.outImgName, self.workDir+'/OUTSIM/'+self.outImgName.replace('.fits', '_norot.fits'))
-                    sci = img['SCI'].data
-                    err = img['ERR'].data
-                    dq = img['DQ'].data
-                    img['SCI'].data = numpy.copy(numpy.rot90(sci))
-                    img['ERR'].data = numpy.copy(numpy.rot90(err))
-                    img['DQ'].data = numpy.copy(numpy.rot90(dq))
+                        norotName = self.workDir+'/OUTSIM/'+imgName.replace('.fits', '_norot.fits')
+                        if os.path.isfile(norotName):
+                            os.unlink(norotName)
+                        img.writeto(norotName)
+                    for ext in ['SCI','ERR','DQ']:
+                        img[ext].data = numpy.copy(numpy.rot90(img[ext].data))
                 # set the headers
                 for ext in ['SCI','ERR','DQ']:
                     img[ext].header.update('WCSAXES', 2)
@@ -415,19 +508,13 @@ class Simulation:
                     img[ext].header.update('PA_APER', spectroModel.wcs.orient)
                     img[ext].header.update('VAFACTOR', 1.0)
                     img[ext].header.update('EXPNAME', spectroModel.version+spectroModel.model+spectroModel.date)
-                
-                img.flush()
-                img.close()
-                                    
-                del img
-                if spectroModel.rot90:
-                    del sci
-                    del err
-                    del dq
+                    if seed != None:
+                        img[ext].header.update('NSEED', ' '.join([str(one) for one in numpy.atleast_1d(seed)]), 'seed of the noise')
 
         def close(self):
                 del self.workDir
                 del self.dataDir                
+                del self.paths
                 del self.bck
                 del self.motName
                 del self.modSpecName
@@ -435,5 +522,7 @@ class Simulation:
                 del self.confName
                 del self.outImgName
                 del self.ngal
+                self.modImgCache.close()
+                del self.modImgCache
                 del self
                 
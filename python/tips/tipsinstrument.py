@@ -508,6 +508,11 @@ class Spectrometer:
     self.exptime = 0.0
     self.expname = None
     
+    # position in the focal plan: exposure
+    # and detector numbers (start at 0)
+    self.expnum = 0
+    self.detnum = 0
+    
     self.wcs = None    
     self.llim = None
     self.rlim = None
@@ -774,6 +779,8 @@ class Spectrometer:
     del self.idientier
     del self.telarea
     del self.exptime
+    del self.expnum
+    del self.detnum
     if self.skyBck != None:
         try: 
             test=float(self.skyBck)
@@ -912,6 +919,19 @@ class WCSObject:
         return ra,dec
 
 
+    def getBoxRadius(self, xmin, xmax, ymin, ymax):
+        """
+        This method computes the angular distance (in deg) from the reference
+        position (CRVAL) to the farthest corner of a pixel box. Every position
+        projected into the box is closer to the reference position.
+        """
+        x = numpy.array([xmin, xmin, xmax, xmax]) - self.crpix1
+        y = numpy.array([ymin, ymax, ymin, ymax]) - self.crpix2
+        xi = self._deg2rad(self.cd11 * x + self.cd12 * y)
+        eta = self._deg2rad(self.cd21 * x + self.cd22 * y)
+
+        return self._rad2deg(numpy.arctan(numpy.sqrt(xi**2 + eta**2).max()))
+
     def rd2xy(self,ra_deg, dec_deg):
         """
         This method would use the WCS keywords to compute the XY position
@@ -1072,6 +1092,7 @@ class FocalPlan:
         else:
           error_message = 'Can not load grism: '+grism
           raise TIPSError(error_message)
+        self.spectros[index].detnum = index
         
         index += 1
         
@@ -1095,6 +1116,9 @@ class FocalPlan:
     wcs0 = WCSObject()
     wcs0.updateWCS(pixel_scale=pixscale, orient=orient,refpos=[x0, y0],refval=[ra0,dec0], size=[npixx, npixy])
     
+    # the exposures are loaded one after the other
+    expnum = len(self.spectros) / (self.ndetx*self.ndety)
+    
     for i in range(self.ndetx):
       for j in range(self.ndety):
         self.spectros.append(Spectrometer())
@@ -1108,6 +1132,8 @@ class FocalPlan:
         wcs.updateWCS(refval=[raref,decref])
         
         self.spectros[-1].loadFromConf(conf, hconf=hconf, detId=did, wcs=wcs, exptime=exptime)
+        self.spectros[-1].expnum = expnum
+        self.spectros[-1].detnum = i*self.ndety + j
         if self.fovlim != None:
             if i==0:
                 self.spectros[-1].llim = -self.fovlim
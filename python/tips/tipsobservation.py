@@ -7,6 +7,10 @@
 TIPS classes to manage observation objects.
 """
 import os
+import shutil
+import tempfile
+import multiprocessing
+import numpy
 import pyfits
 import tips
 
@@ -16,18 +20,99 @@ from tipssky import *
 
 tipsDataDir = tips.__path__[0]+'/data/'
 
-## define simulation function separatly to able parallel computing with pp
-#def pp_run_single(workDir, dataDir, spectro, skySrc, skyBck, exptime, debug, norm):
-#       simulation = tips.tipsaxesim.Simulation(workDir, dataDir)
-#       simulation.prepInstrument(spectro)
-#       simulation.prepSky(skySrc, spectro, skyBck)
-#       
-#       # close model spectra to avoid memory leak
-#       skySrc.closeSpc()
-#
-#       simulation.run(exptime, spectro, debug, norm)
-#
-#       simulation.close()
+def noise_seed(seed, spectro):
+        """
+        Function to derive the seed of the noise of a spectro image.
+
+        The base seed, the exposure number and the detector number initialize
+        an independent random stream for each (exposure, detector), which does
+        not depend on the order or on the process the detectors are simulated in.
+        A single detector is thus simulated again with the base seed alone.
+
+        param seed: base seed (random stream from the system if None)
+        type seed: integer
+        param spectro: spectro image
+        type spectro: Spectrometer
+
+        return: the seed of the random stream of the detector
+        rtype: list of integer
+        """
+        if seed == None:
+                return None
+        return [int(seed), int(spectro.expnum), int(spectro.detnum)]
+
+## define simulation function separatly to able parallel computing with multiprocessing
+def run_single(args):
+        """
+        Function to run a single detector simulation in a worker process.
+
+        The simulation is run in a private aXe directory tree created in workDir,
+        the products are then moved in the shared directories of workDir.
+
+        param args: (workDir, dataDir, confDir, srcArgs, spectro, debug, norm, silent, seed, spcStore),
+                    seed is the base seed of the observation
+        type args: tuple
+        """
+        (workDir, dataDir, confDir, srcArgs, spectro, debug, norm, silent, seed, spcStore) = args
+
+        jobDir = tempfile.mkdtemp(prefix='JOB_', dir=workDir)
+
+        skySrc = None
+        simulation = None
+        try:
+                # each worker load its own sky model (open files can not be shared)
+                skySrc = SkySources(*srcArgs)
+
+                simulation = tips.tipsaxesim.Simulation(jobDir, dataDir, confDir, debug=debug, silent=silent)
+                simulation.prepInstrument(spectro)
+                simulation.prepSky(skySrc, spectro, spcStore)
+                # close model spectra to avoid memory leak
+                skySrc.closeSpc()
+
+                simulation.run(spectro, norm=norm, seed=noise_seed(seed, spectro))
+
+                simulation.close()
+                simulation = None
+                skySrc.close()
+                skySrc = None
+
+                # move the products in the shared directories
+                move_products(jobDir, workDir)
+        finally:
+                # the private tree is removed also if the simulation failed
+                if simulation != None:
+                        simulation.close()
+                if skySrc != None:
+                        skySrc.close()
+                shutil.rmtree(jobDir, ignore_errors=True)
+
+def move_products(srcDir, dstDir):
+        """
+        Function to move the products of a private aXe directory tree
+        in the shared one, keeping the relative paths.
+
+        Missing directories are created; the files are moved with
+        shutil.move(), which also works across file systems.
+
+        param srcDir: the private directory
+        type srcDir: string
+        param dstDir: the shared directory
+        type dstDir: string
+        """
+        for name in os.listdir(srcDir):
+                srcPath = os.path.join(srcDir, name)
+                dstPath = os.path.join(dstDir, name)
+                if os.path.isdir(srcPath) and not os.path.islink(srcPath):
+                        if not os.path.isdir(dstPath):
+                                try:
+                                        os.makedirs(dstPath)
+                                except OSError:
+                                        # created by another worker
+                                        if not os.path.isdir(dstPath):
+                                                raise
+                        move_products(srcPath, dstPath)
+                else:
+                        shutil.move(srcPath, dstPath)
 
 class Observation:
         """
@@ -42,6 +127,8 @@ class Observation:
                 
                 # init sky model
                 self.skySrc = SkySources(inCatDir, inSpcDir, inCatForm, inSpcForm, inThmDir, inThmForm, silent)
+                # keep the sky model parameters to reload it in the worker processes
+                self.srcArgs = (inCatDir, inSpcDir, inCatForm, inSpcForm, inThmDir, inThmForm, silent)
                 
                 # init instrument model
                 self.instrument = None
@@ -54,6 +141,9 @@ class Observation:
                 self.confDir = None
                 
                 self.nexpo = 0
+                
+                # base seed of the last simulation
+                self.seed = None
 
         def loadEUCLIDDefault(self, grismName='Gblue0', exptime=560.0, ra0=0.0, dec0 = 0.0, orient=0.0, x0=0.0, y0=0.0):
                 """
@@ -163,46 +253,112 @@ class Observation:
                     else:
                         return rList
                  
-        def runOneSim(self, spectro, workDir='./'):
+        def runOneSim(self, spectro, workDir='./', seed=None, spcStore=None):
                 """
                 Method to run a single detector simulation
+
+                param spectro: spectro image to simulate
+                type spectro: Spectrometer
+                param workDir: path where aXeSIM will be run
+                type workDir: string
+                param seed: base seed of the noise (random if None), see noise_seed()
+                type seed: integer
+                param spcStore: shared model spectra (if None the spectra are stored for this detector)
+                type spcStore: SpectraStore
                 """
                 simulation = tips.tipsaxesim.Simulation(workDir, self.dataDir, self.confDir, debug=self.debug, silent=self.silent)
                 simulation.prepInstrument(spectro)
-                simulation.prepSky(self.skySrc, spectro)
+                simulation.prepSky(self.skySrc, spectro, spcStore)
                 # close model spectra to avoid memory leak
                 self.skySrc.closeSpc()
 
-                simulation.run(spectro, norm=self.norm)
+                simulation.run(spectro, norm=self.norm, seed=noise_seed(seed, spectro))
 
                 simulation.close()      
 
-        def runSimulation(self, workDir='./', ncpu = 0):
-                if ncpu>1:
-                        warning_message = "Because of some troubles with pp module, parallel coputation is disable for now. Computation will be run on one cpu."
-                        print warning_message
-                        #try:
-                        #       import pp
-                        #       ppservers=("*",)
-                        #       job_server = pp.Server(ncpu, ppservers=ppservers, secret='TIPS')
-                        #       jobs=[]
-                        #       # init directory before to avoid some bug
-                        #       simulation = tips.tipsaxesim.Simulation(workDir, self.dataDir)
-                        #       simulation.close()
-                        #       del simulation
-                        #       for spectro in self.instrument.spectros:
-                        #               jobs.append(job_server.submit(pp_run_single, (workDir, self.dataDir, spectro, self.skySrc, self.skyBck, self.exptime, self.debug, self.norm), (), ('numpy', 'scipy', 'tips', 'axesim')))
-                        #       #for job in jobs:
-                        #       #       print job()
-                        #       # wait all job finish to avoid some bug
-                        #       job_server.wait()
-                        #except ImportError:
-                        #       error_message = 'ImportError: No module named pp.'
-                        #       raise TIPSError(error_message)
-                #else:
-                
-                for spectro in self.instrument.spectros:
-                        self.runOneSim(spectro, workDir)
+        def runSimulation(self, workDir='./', ncpu=0, seed=None, spectros=None):
+                """
+                Method to run the simulation of all the spectro images
+
+                If ncpu > 1, the detectors are simulated in parallel in ncpu processes,
+                each one running in its own aXe directory tree.
+                The noise of each (exposure, detector) is drawn from its own random
+                stream derived from the base seed (see noise_seed()), so the results
+                do not depend on ncpu, and a single detector can be simulated again
+                with the same base seed. If seed is None, a base seed is drawn and
+                kept in self.seed.
+                The model spectra of all the sources are read once and written in a
+                single store shared by all the detector simulations.
+
+                param workDir: path where aXeSIM will be run
+                type workDir: string
+                param ncpu: number of processes
+                type ncpu: integer
+                param seed: base seed of the noise (drawn if None)
+                type seed: integer
+                param spectros: spectro images to simulate (all if None)
+                type spectros: list of Spectrometer
+                """
+                if spectros == None:
+                        spectros = self.instrument.spectros
+                if seed == None:
+                        seed = numpy.random.RandomState().randint(0, 2**31-1)
+                self.seed = seed
+
+                # init directories before to write the shared spectra
+                simulation = tips.tipsaxesim.Simulation(workDir, self.dataDir, self.confDir)
+                simulation.close()
+                del simulation
+
+                spcStore = self.prepSpcStore(workDir, spectros)
+
+                if ncpu > 1:
+                        jobs = []
+                        for i in range(len(spectros)):
+                                jobs.append((workDir, self.dataDir, self.confDir, self.srcArgs, spectros[i], self.debug, self.norm, self.silent, seed, spcStore))
+
+                        # one process per detector to avoid memory leak
+                        pool = multiprocessing.Pool(ncpu, maxtasksperchild=1)
+                        try:
+                                pool.map(run_single, jobs, chunksize=1)
+                        finally:
+                                pool.close()
+                                pool.join()
+                else:
+                        for i in range(len(spectros)):
+                                self.runOneSim(spectros[i], workDir, seed, spcStore)
+
+                if spcStore != None:
+                        spcStore.close()
+
+        def prepSpcStore(self, workDir, spectros):
+                """
+                Method to write the model spectra of all the sources seen by a list
+                of spectro images in a single store (DATA/<catalog>.spc.fits)
+
+                param workDir: path where aXeSIM will be run
+                type workDir: string
+                param spectros: spectro images
+                type spectros: list of Spectrometer
+
+                return: the store, None if there is no source
+                rtype: SpectraStore
+                """
+                if self.skySrc.inCat == None:
+                        return None
+
+                rows = [tips.tipsaxesim.selectSources(self.skySrc, spectro)[0] for spectro in spectros]
+                rows = numpy.unique(numpy.concatenate(rows))
+                if len(rows) == 0:
+                        return None
+
+                catname = self.skySrc.inCatDir.split("/")[-1]
+                catroot = '.'.join(catname.split(".")[:-1])
+                spcStore = SpectraStore(workDir+'/DATA/'+catroot+'.spc.fits', self.skySrc, rows)
+                # close model spectra to avoid memory leak
+                self.skySrc.closeSpc()
+
+                return spcStore
 
         def close(self):
 
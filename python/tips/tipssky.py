@@ -13,9 +13,16 @@ import asciidata
 import pyfits
 import numpy
 import shutil
+import tempfile
 
 from tipserror import *
 
+# k-d tree for the spatial index of the catalog
+# (query_ball_point is only in cKDTree since scipy 0.12)
+from scipy.spatial import cKDTree as KDTree
+if not hasattr(KDTree, 'query_ball_point'):
+        from scipy.spatial import KDTree
+
 class SkySources:
         """
         Class to store the sky source model
@@ -51,6 +58,9 @@ class SkySources:
                 self.inThmForm = inThmForm
                 self.inThmType = 'fits'
                 self.silent = silent
+                self.colCache = {}
+                self.idIndex = None
+                self.skyTree = None
                 
                 self.checkInput()
 
@@ -59,19 +69,111 @@ class SkySources:
                 Method to load an input sources catalog.
                 """
 
+                # column cache, id and spatial index are built again for the new catalog
+                self.colCache = {}
+                self.idIndex = None
+                self.skyTree = None
+
                 try:
                         self.inCat = pyfits.open(self.inCatDir)
                         self.inCatType = 'fits'
                         self.nSources = self.inCat[1].data.shape[0]
                 except IOError:
                         try:
-                                self.inCat = asciidata.open(self.inCatDir)
+                                self.inCat = self.loadAsciiCat(self.inCatDir)
                                 self.inCatType = 'ascii'
-                                self.nSources = len(self.inCat[0])
+                                self.nSources = len(self.inCat)
                         except:
                                 error_message = 'Can not load input sources catalog file:' + self.inCatDir
                                 raise TIPSError(error_message)
 
+        def loadAsciiCat(self, catPath):
+                """
+                Method to load an ascii sources catalog into a typed column store.
+                The catalog is parsed once and stored in a numpy file next to it
+                (catPath+'.npy'), which is memory mapped by later loads as long as
+                the modification time and size of the catalog stored in the cache
+                match the ones of the catalog.
+
+                @param catPath: ascii catalog path (with a sextractor header)
+                @type catPath: string
+                
+                @return: the catalog
+                @rtype: numpy structured array
+                """
+
+                cachePath = catPath+'.npy'
+                catStat = os.stat(catPath)
+                catStamp = numpy.array([catStat.st_mtime, catStat.st_size], dtype=numpy.float64)
+                if os.path.isfile(cachePath):
+                        try:
+                                cat = self.loadCatCache(cachePath, catStamp)
+                        except (IOError, ValueError):
+                                cat = None
+                        if cat is not None:
+                                return cat
+
+                # parse the ascii catalog
+                inCat = asciidata.open(catPath)
+                cols = []
+                for i in range(inCat.ncols):
+                        col = numpy.asarray(inCat[i].tonumpy())
+                        if col.dtype.kind == 'O':
+                                col = col.astype(str)
+                        cols.append((inCat[i].get_name(), col))
+                del inCat
+                cat = numpy.zeros(len(cols[0][1]), dtype=[(name, col.dtype) for (name, col) in cols])
+                for (name, col) in cols:
+                        cat[name] = col
+
+                # store the cache (write and rename to be safe with parallel runs),
+                # a read only catalog directory simply means no cache
+                try:
+                        (fd, tmpPath) = tempfile.mkstemp(prefix='.tmp', dir=os.path.dirname(os.path.abspath(catPath)))
+                        tmpFile = os.fdopen(fd, 'wb')
+                        numpy.save(tmpFile, catStamp)
+                        numpy.save(tmpFile, cat)
+                        tmpFile.close()
+                        os.rename(tmpPath, cachePath)
+                except (IOError, OSError):
+                        if not self.silent:
+                                warning_message = 'Can not write the catalog cache:' + cachePath
+                                print TIPSWarning(warning_message)
+
+                return cat
+
+        def loadCatCache(self, cachePath, catStamp):
+                """
+                Method to memory map the catalog cache written by loadAsciiCat().
+                The cache holds the modification time and size of the catalog
+                (a first array) followed by the catalog.
+
+                @param cachePath: path of the cache
+                @type cachePath: string
+                @param catStamp: modification time and size of the catalog
+                @type catStamp: numpy array
+
+                @return: the catalog, None if the cache is outdated
+                @rtype: numpy memmap
+                """
+
+                cacheFile = open(cachePath, 'rb')
+                try:
+                        stamp = numpy.load(cacheFile)
+                        if stamp.dtype != catStamp.dtype or stamp.shape != catStamp.shape or (stamp != catStamp).any():
+                                return None
+                        version = numpy.lib.format.read_magic(cacheFile)
+                        if version == (1, 0):
+                                (shape, fortran, dtype) = numpy.lib.format.read_array_header_1_0(cacheFile)
+                        else:
+                                (shape, fortran, dtype) = numpy.lib.format.read_array_header_2_0(cacheFile)
+                        offset = cacheFile.tell()
+                finally:
+                        cacheFile.close()
+
+                return numpy.memmap(cachePath, dtype=dtype, mode='r', offset=offset, shape=shape,
+                                    order='F' if fortran else 'C')
+
         def checkInput(self):
                 """
                 Method to check inputs
@@ -140,10 +242,13 @@ class SkySources:
                 @param colId: column name
                 @type colId: string
                 
-                @return: the column named colId
+                @return: the column named colId (cached, do not modify it in place)
                 @rtype: numpy array
                 """
 
+                if colId in self.colCache:
+                        return self.colCache[colId]
+
                 try:
                         iCol = self.colDict.index(colId)
                 except ValueError:
@@ -153,11 +258,10 @@ class SkySources:
                 jCol = self.inColDict[iCol]
                 
                 if self.inCatType == 'ascii':
-                        kCol = self.inCat.find(jCol)
-                        if kCol < 0:
+                        if jCol not in self.inCat.dtype.names:
                                 error_message = 'Can not find the column in CMC catalog (ascii):'+jCol
                                 raise TIPSError(error_message)
-                        col = self.inCat[jCol].tonumpy()
+                        col = self.inCat[jCol]
                 elif self.inCatType == 'fits':
                         try:
                                 col = self.inCat[1].data.field(jCol)
@@ -168,10 +272,104 @@ class SkySources:
                 # in the CMC A_IMAGE and B_IMAGE are in pixels with 1 pixel = 0.03 arcsec
                 # convert A_IMAGE and B_IMAGE in arcsec
                 if self.inCatForm == 'CMC' and (jCol == "A_IMAGE" or jCol == "B_IMAGE"):
-                        col *= 0.03
+                        col = col*0.03
                 
+                self.colCache[colId] = col
                 return col
 
+        def getIdIndex(self):
+                """
+                Method to get the index from the object id number to the catalog row
+                (built once per catalog load)
+                
+                @return: the catalog row of each identifier
+                @rtype: dictionary
+                """
+
+                if self.idIndex == None:
+                        ids = self.getCatCol("NUMBER")
+                        # fill backward to keep the first row of duplicated identifiers
+                        rows = range(len(ids)-1, -1, -1)
+                        self.idIndex = dict(zip(ids[::-1].tolist(), rows))
+                return self.idIndex
+
+        def getIndex(self, ident):
+                """
+                Method to get the catalog row from the object id number.
+                
+                @param ident: identifier of the object
+                @type ident: integer
+                
+                @return: the catalog row of the object
+                @rtype: integer
+                """
+
+                try:
+                        return self.getIdIndex()[ident]
+                except KeyError:
+                        error_message = 'Object ID %d could not be found' % (ident)
+                        raise TIPSError(error_message)
+
+        def getIndexes(self, idents):
+                """
+                Method to get the catalog rows from a list of object id numbers.
+                
+                @param idents: identifiers of the objects
+                @type idents: list of integer
+                
+                @return: the catalog rows of the objects
+                @rtype: list of integer
+                """
+
+                idIndex = self.getIdIndex()
+                try:
+                        return [idIndex[ident] for ident in numpy.asarray(idents).tolist()]
+                except KeyError, ident:
+                        error_message = 'Object ID %d could not be found' % (ident.args[0])
+                        raise TIPSError(error_message)
+
+        def getSkyTree(self):
+                """
+                Method to get the spatial index of the input catalog: a k-d tree
+                on the unit vectors of the sources (built once per catalog load)
+                
+                @return: the k-d tree of the sources
+                @rtype: scipy.spatial KDTree
+                """
+
+                if self.skyTree == None:
+                        ra = numpy.radians(self.getCatCol("RA"))
+                        dec = numpy.radians(self.getCatCol("DEC"))
+                        xyz = numpy.column_stack((numpy.cos(dec)*numpy.cos(ra), numpy.cos(dec)*numpy.sin(ra), numpy.sin(dec)))
+                        self.skyTree = KDTree(xyz)
+                return self.skyTree
+
+        def getConeIndexes(self, ra, dec, radius):
+                """
+                Method to get the catalog rows of the sources in a cone.
+                
+                @param ra: right ascension of the cone center (deg)
+                @type ra: float
+                @param dec: declination of the cone center (deg)
+                @type dec: float
+                @param radius: radius of the cone (deg)
+                @type radius: float
+                
+                @return: the sorted catalog rows of the sources in the cone
+                @rtype: numpy array
+                """
+
+                if self.nSources == 0:
+                        return numpy.zeros(0, dtype=int)
+
+                ra = numpy.radians(ra)
+                dec = numpy.radians(dec)
+                center = [numpy.cos(dec)*numpy.cos(ra), numpy.cos(dec)*numpy.sin(ra), numpy.sin(dec)]
+                # chord length of the radius, slightly enlarged against rounding
+                chord = 2.0*numpy.sin(numpy.radians(min(radius, 180.0))/2.0)*(1.0+1e-9)+1e-12
+                rows = self.getSkyTree().query_ball_point(center, chord)
+                return numpy.sort(numpy.asarray(rows, dtype=int))
+
         def loadSpcFile(self, index=0):
                 """
                 Method to load an input spectra catalog.
@@ -251,14 +449,20 @@ class SkySources:
                 @rtype: numpy array tuple ([float],[float])
                 """
 
-                ids = self.getCatCol("NUMBER")
-                s = (ids==ident)
-                if len(s.nonzero()[0])>0:
-                        index=s.nonzero()[0][0]
-                        return self.getSpcIndex(index)
-                else:
-                        error_message = 'Object ID %d could not be found' % (ident)
-                        raise TIPSError(error_message)
+                return self.getSpcIndex(self.getIndex(ident))
+
+        def getSpcIdents(self, idents):
+                """
+                Method to get the spectra of a list of objects from their id numbers.
+                
+                @param idents: identifiers of the objects
+                @type idents: list of integer
+                
+                @return: the spectra of the objects (wave in A, flux in erg/s/cm2/A)
+                @rtype: list of numpy array tuple ([float],[float])
+                """
+
+                return [self.getSpcIndex(index) for index in self.getIndexes(idents)]
  
         def loadThmFile(self, index=0):
                 """
@@ -344,14 +548,20 @@ class SkySources:
                 @rtype: numpy array tuple ([float],float)
                 """
 
-                ids = self.getCatCol("NUMBER")
-                s = (ids==ident)
-                if len(s.nonzero()[0])>0:
-                        index=s.nonzero()[0][0]
-                        return self.getThmIndex(index, pixscl)
-                else:
-                        error_message = 'Object ID %d could not be found' % (ident)
-                        raise TIPSError(error_message)
+                return self.getThmIndex(self.getIndex(ident), pixscl)
+
+        def getThmIdents(self, idents, pixscl=None):
+                """
+                Method to get the thumbnails of a list of objects from their id numbers.
+                
+                @param idents: identifiers of the objects
+                @type idents: list of integer
+                
+                @return: the thumbnails and the scale factors of the objects
+                @rtype: list of numpy array tuple ([float],float)
+                """
+
+                return [self.getThmIndex(index, pixscl) for index in self.getIndexes(idents)]
 
         def reset(self, newCatDir=None, newSpcDir=None, newCatForm=None, newSpcForm=None, newThmDir=None, newThmForm=None):
                 """
@@ -466,6 +676,87 @@ class SkySources:
                 del self.inSpcType
                 del self.inThmType
                 del self.colDict
+                del self.colCache
+                del self.idIndex
+                del self.skyTree
+                del self
+
+class SpectraStore:
+        """
+        Class to store model spectra in the aXeSIM packed format (an index
+        table and a single table with all the spectra), so they are read and
+        written once and shared by all the simulations referencing the store.
+        """
+
+        def __init__(self, fileName, skySrc, rows):
+                """
+                Constructor: write the store
+                
+                @param fileName: path of the store (fits)
+                @type fileName: string
+                @param skySrc: sky model
+                @type skySrc: SkySources
+                @param rows: catalog rows of the sources to store
+                @type rows: numpy array
+                """
+
+                self.fileName = os.path.abspath(fileName)
+                self.rows = numpy.unique(numpy.asarray(rows, dtype=int))
+                self.nModels = len(self.rows)
+
+                ids = skySrc.getCatCol("NUMBER")[self.rows]
+                spcs = [skySrc.getSpcIndex(index) for index in self.rows]
+                npoints = numpy.array([len(spc[0]) for spc in spcs])
+                offset = numpy.cumsum(npoints)-npoints
+                wave = numpy.concatenate([spc[0] for spc in spcs])/10.
+                flux = numpy.concatenate([spc[1] for spc in spcs])
+                del spcs
+
+                outspc = pyfits.HDUList(pyfits.PrimaryHDU())
+                outspc[0].header.update('SPCPACK', True, 'all spectra packed in one table')
+                outspc[0].header.update('NMODELS', self.nModels)
+                c1=pyfits.Column(name='NUMBER', format='J', array=numpy.arange(1, self.nModels+1))
+                c2=pyfits.Column(name='ID', format='K', array=ids)
+                c3=pyfits.Column(name='OFFSET', format='K', array=offset)
+                c4=pyfits.Column(name='NPOINTS', format='J', array=npoints)
+                outspc.append(pyfits.new_table([c1,c2,c3,c4]))
+                outspc[-1].header.update('EXTNAME', 'SPCINDEX')
+                c1=pyfits.Column(name='WAV_NM', format='E', array=wave)
+                c2=pyfits.Column(name='FLUX', format='E', array=flux)
+                outspc.append(pyfits.new_table([c1,c2]))
+                outspc[-1].header.update('EXTNAME', 'SPECTRA')
+                del wave
+                del flux
+
+                if os.path.exists(self.fileName):
+                        os.unlink(self.fileName)
+                outspc.writeto(self.fileName)
+                outspc.close()
+                del outspc
+
+        def getModSpec(self, rows):
+                """
+                Method to get the model numbers (row in the index, starting at 1)
+                of catalog rows.
+                
+                @param rows: catalog rows of the sources
+                @type rows: numpy array
+                
+                @return: the model numbers
+                @rtype: numpy array
+                """
+
+                rows = numpy.asarray(rows, dtype=int)
+                modspec = numpy.searchsorted(self.rows, rows)
+                if len(rows) > 0 and (modspec.max() >= self.nModels or (self.rows[modspec] != rows).any()):
+                        error_message = 'Some sources are not in the spectra store:' + self.fileName
+                        raise TIPSError(error_message)
+                return modspec+1
+
+        def close(self):
+                del self.fileName
+                del self.rows
+                del self.nModels
                 del self
 
 class SkyNoise:
@@ -56,6 +56,7 @@ main (int argc, char *argv[])
 
   int index;
   double lambda_psf=0.0;
+  int nthreads=1;
 
   observation *obs;
 
@@ -68,9 +69,12 @@ main (int argc, char *argv[])
     		  "Options:\n"
     		  "      -in_AF=[string]         - overwrite the automatically generated name\n"
     		  "                                of the input aperture file\n"
+    		  "                                (binary or text)\n"
     		  "      -model_spectra=[string] - input model spectra"
     		  "      -model_images=[string]  - input model images"
     		  "      -lambda_psf=[float]     - lambda at which psf was measured"
+    		  "      -nthreads=[int]         - number of threads to model the objects;\n"
+    		  "                                0 uses all available cores (default: 1)"
     		  "\n",RELEASE);
       exit (1);
     }
@@ -109,6 +113,12 @@ main (int argc, char *argv[])
   else
     lambda_psf = 800.0;
 
+  // determine the number of threads
+  if ((opt = get_online_option ("nthreads", argc, argv)))
+    nthreads = atoi(opt);
+  else
+    nthreads = 1;
+
   // check whether a name for the spectral
   // models file is given
   if ((opt = get_online_option ("model_spectra", argc, argv)))
@@ -142,12 +152,13 @@ main (int argc, char *argv[])
   fprintf (stdout, "aXe_DISPIMAGE: Using spectral models in table: %s\n", specmod_file_path);
   fprintf (stdout, "aXe_DISPIMAGE: Using direct emission objects in image: %s\n", objmod_file_path);
   fprintf (stdout, "aXe_DISPIMAGE: Object parameters determined at %fnm\n", lambda_psf);
+  fprintf (stdout, "aXe_DISPIMAGE: Number of threads: %i\n", nthreads);
 
   fprintf (stdout, "aXe_DISPIMAGE: ");
   obs = load_sci_image (grism_file_path, conf->science_numext);
 
   compute_disp(grism_file_path, aper_file_path, conf_file_path,
-		       specmod_file_path,  objmod_file_path, lambda_psf, obs);
+		       specmod_file_path,  objmod_file_path, lambda_psf, obs, nthreads);
 
   free_observation(obs);
   free_aperture_conf(conf);
@@ -68,6 +68,7 @@ main (int argc, char *argv[])
   char ext[MAXCHAR];
   double lambda_mark=0.0;
   int bck_mode=0;
+  int text_AF=0;
 
   aperture_conf *conf;
   SexObject **os;
@@ -84,8 +85,10 @@ main (int argc, char *argv[])
                "            input Sextractor Grism Object List (GOL).\n"
                "            The AF files contain information about each object (aperture)\n"
                "            and information about the various beams (orders) in each of \n"
-               "            these apertures. These are simple text files which can be\n"
-               "            edited by hand. The IGNORE keywords can be set to 1 if a\n"
+               "            these apertures. By default the AF is written in a compact\n"
+               "            binary format which is read directly by the aXe tasks. With\n"
+               "            the -text_AF option it is written as a simple text file which\n"
+               "            can be edited by hand. The IGNORE keywords can be set to 1 if a\n"
                "            particular beam (order) is to be ignored during the extraction\n"
                "            process. The MMAG_EXTRACT and MMAG_MARK keyword of each beam\n"
                "            listed in the aXe configuration file determine if a particluar\n "
@@ -120,6 +123,8 @@ main (int argc, char *argv[])
                "                                   extraction only).\n"
                "             -dmag=[float]       - A number to add to the MMAG_EXTRACT and\n"
                "                                   MMAG_MARK values.\n"
+               "             -text_AF            - write the aperture file as text\n"
+               "                                   (e.g. for debugging or editing by hand).\n"
                "\n"
                "Example: ./aXe_GOL2AF slim_grism.fits -bck -dmag=2 -mfwhm=2\n"
                "\n",RELEASE);
@@ -266,6 +271,16 @@ main (int argc, char *argv[])
       build_path (AXE_OUTPUT_PATH, sex_catalog, sex_catalog_path);
     }
 
+  /* Set the option to write a text aperture file */
+  if ((opt = get_online_option ("text_AF", argc, argv)))
+    {
+      text_AF = 1;
+    }
+  else
+    {
+      text_AF = 0;
+    }
+
    if ((opt = get_online_option ("lambda_mark", argc, argv)))
     {
       lambda_mark = atof(opt);
@@ -298,6 +313,9 @@ main (int argc, char *argv[])
   fprintf (stdout,
            "aXe_GOL2AF: Output aperture file name:       %s\n",
            aper_file_path);
+  fprintf (stdout,
+           "aXe_GOL2AF: Output aperture file format:     %s\n",
+           text_AF ? "text" : "binary");
   fprintf (stdout,
            "aXe_GOL2AF: FWHM multiplicative factor:      %f\n",
            mfwhm);
@@ -360,7 +378,10 @@ main (int argc, char *argv[])
   fprintf (stdout, "Done.\n");fflush(stdout);
 
   fprintf (stdout, "aXe_GOL2AF: Writing aperture file...");fflush(stdout);
-  num = object_list_to_file (oblist, aper_file_path, leaveout_ignored);
+  if (text_AF)
+    num = object_list_to_file (oblist, aper_file_path, leaveout_ignored);
+  else
+    num = object_list_to_binfile (oblist, aper_file_path, leaveout_ignored);
   fprintf (stdout, "%d beams written.\n", num);
 
   free_SexObjects (os);
@@ -72,6 +72,8 @@ get_aperture_descriptor (char *filename)
     {"IPIXFUNCTION",NULL},
     {"POBJSIZE",NULL},
     {"SMFACTOR",NULL},
+    /* emission kernel cache */
+    {"EKERNEL_TOL",NULL},
 
     {NULL, NULL},
     {NULL, NULL}                /* array terminator. REQUIRED !!! */
@@ -121,8 +123,9 @@ get_aperture_descriptor (char *filename)
   config->rdnoise    = 0.0;
   config->pobjsize   = -1.0;
   config->smfactor   = -1.0;
+  config->ekernel_tol = 0.0;
 
-  for (ix = 0; ix < 26; ix++)
+  for (ix = 0; ix < 27; ix++)
     {
 
       /* Name of the instrument */
@@ -343,6 +346,16 @@ get_aperture_descriptor (char *filename)
             }
         }
 
+      // read in the quantization tolerance of the
+      // emission kernels, negative values disable the cache
+      if (!strcmp (AperConfig[ix].name, "EKERNEL_TOL"))
+        {
+          if (AperConfig[ix].data != NULL)
+            {
+              config->ekernel_tol = atof(AperConfig[ix].data);
+            }
+        }
+
 
     }
 
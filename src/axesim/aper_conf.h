@@ -71,6 +71,8 @@ typedef struct
   double pobjsize;
   double smfactor;
 
+  double ekernel_tol;        /* quantization tolerance of the emission kernels */
+
 }
 aperture_conf;
 
@@ -0,0 +1,142 @@
+/**
+ *  File: axe_engine.c
+ *  In-process engine for the dispersed image simulation.
+ *  The function runs the chain aXe_SEX2GOL -> aXe_GOL2AF ->
+ *  aXe_DISPIMAGE in memory, without writing the intermediate
+ *  GOL and OAF files, and returns the model image in a buffer
+ *  given by the caller. It is meant to be called from Python
+ *  through the shared library.
+ *
+ * @author  Martin Kuemmel, Julien Zoubian
+ * @package axe_engine
+ * @version $Revision: 1.0 $
+ * @date    $Date: 2010/05/20 10:35:43 $
+ */
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <math.h>
+#include <gsl/gsl_matrix.h>
+#include "aXe_grism.h"
+#include "aXe_utils.h"
+#include "aXe_errors.h"
+#include "aper_conf.h"
+#include "inout_aper.h"
+#include "spc_CD.h"
+#include "spc_sex.h"
+#include "disp_utils.h"
+#include "axe_engine.h"
+
+/**
+ * Function: dispimage_engine
+ * The function computes the dispersed model image of a model object
+ * table. The image coordinates are computed on the grism image as in
+ * aXe_SEX2GOL, the apertures are set up as in aXe_GOL2AF (slitless
+ * geometry, no faint objects excluded) and the objects are modelled
+ * as in aXe_DISPIMAGE. All file names must be complete paths.
+ * The model image is copied into the buffer 'image', which has
+ * 'ny' rows and 'nx' columns in C-order.
+ *
+ * Parameters:
+ * @param grism_file   - the (dummy) grism image
+ * @param conf_file    - the aXe configuration file
+ * @param config_path  - the directory of the sensitivity tables
+ * @param incat_file   - the model object table
+ * @param specmod_file - the model spectra (empty string for none)
+ * @param objmod_file  - the model images (empty string for none)
+ * @param lambda_psf   - wavelength the object parameters were determined at
+ * @param image        - the output buffer
+ * @param nx           - number of columns of the output buffer
+ * @param ny           - number of rows of the output buffer
+ * @param nthreads     - number of threads (all cores for < 1)
+ *
+ * Returns:
+ * @return nobjects - the number of objects modelled, -1 on an error
+ */
+int
+dispimage_engine(char grism_file[], char conf_file[], char config_path[],
+		 char incat_file[], const char specmod_file[], const char objmod_file[],
+		 const double lambda_psf, double *image, const int nx, const int ny,
+		 const int nthreads)
+{
+	aperture_conf *conf;
+	struct WorldCoor *g_wcs;
+	SexObject **sobjs;
+	object **oblist;
+	observation *obs;
+
+	int nobjects=0;
+	int ix, iy;
+
+	// the slitless geometry as used
+	// in aXe_GOL2AF in the simulations
+	int auto_reorient=1;
+
+	// load the configuration file
+	conf = get_aperture_descriptor (conf_file);
+	get_extension_numbers(grism_file, conf, conf->optkey1, conf->optval1);
+	if (!check_conf_for_slitlessgeom(conf, auto_reorient))
+	{
+		aXe_message(aXe_M_ERROR, __FILE__, __LINE__,
+			"dispimage_engine: the configuration file %s does not contain\n"
+			"the necessary keywords for the slitless geometry!\n", conf_file);
+		free_aperture_conf(conf);
+		return -1;
+	}
+
+	// get the WCS of the grism image
+	g_wcs = get_wcs (grism_file, conf->science_numext);
+	if (g_wcs == NULL)
+	{
+		aXe_message(aXe_M_ERROR, __FILE__, __LINE__,
+			"dispimage_engine: no WCS in image %s\n", grism_file);
+		free_aperture_conf(conf);
+		return -1;
+	}
+
+	// load the image to model into
+	obs = load_sci_image (grism_file, conf->science_numext);
+	if ((int)obs->grism->size1 != nx || (int)obs->grism->size2 != ny)
+	{
+		aXe_message(aXe_M_ERROR, __FILE__, __LINE__,
+			"dispimage_engine: image %s has dimensions (%i,%i), not (%i,%i)\n",
+			grism_file, (int)obs->grism->size1, (int)obs->grism->size2, nx, ny);
+		free_observation(obs);
+		wcsfree(g_wcs);
+		free_aperture_conf(conf);
+		return -1;
+	}
+
+	// load the objects with image coordinates
+	// on the grism image
+	fprintf (stdout, "dispimage_engine: Loading object list...");
+	sobjs = get_SexObject_from_catalog_nodim (incat_file, g_wcs, 800.0);
+	fprintf (stdout, "Done.\n");
+
+	// generate the aperture list
+	fprintf (stdout, "dispimage_engine: Generating aperture list...");
+	oblist = SexObjects_to_oblistII(sobjs, obs, conf, conf_file, 1.0, 0.0, auto_reorient, 0);
+	// as after writing and reading the aperture file
+	convert_oblist_aorient(oblist);
+	fprintf (stdout, "Done.\n");
+	nobjects = object_list_size(oblist);
+
+	// model the objects
+	compute_disp_oblist(grism_file, oblist, conf_file, config_path, specmod_file, objmod_file, lambda_psf, obs, nthreads);
+
+	// copy the model image to the output;
+	// the first matrix index is x
+	for (iy=0; iy < ny; iy++)
+		for (ix=0; ix < nx; ix++)
+			image[iy*nx + ix] = gsl_matrix_get(obs->grism, ix, iy);
+
+	if (oblist != NULL)
+		free_oblist (oblist);
+	free_SexObjects (sobjs);
+	free_observation(obs);
+	wcsfree(g_wcs);
+	free_aperture_conf(conf);
+
+	return nobjects;
+}
@@ -0,0 +1,24 @@
+/**
+ *  File: axe_engine.h
+ *  In-process engine for the dispersed image simulation
+ *
+ * @author  Martin Kuemmel, Julien Zoubian
+ * @package axe_engine
+ * @version $Revision: 1.0 $
+ * @date    $Date: 2010/05/20 10:35:43 $
+ */
+#ifndef _AXE_ENGINE_H
+#define _AXE_ENGINE_H
+
+#include "aXe_grism.h"
+#include "aper_conf.h"
+#include "spc_sex.h"
+#include "disp_utils.h"
+
+extern int
+dispimage_engine(char grism_file[], char conf_file[], char config_path[],
+		 char incat_file[], const char specmod_file[], const char objmod_file[],
+		 const double lambda_psf, double *image, const int nx, const int ny,
+		 const int nthreads);
+
+#endif
@@ -0,0 +1,225 @@
+/*
+    bench_gaussvalues
+    Benchmark of the wavelength dependent gaussian emission model
+
+    The program compares the former implementation of 'fill_gaussvalues()',
+    which evaluated the emission for every trace point but kept only the
+    value at the last one, with the current implementation based on a
+    psf table. Both are run over the pixels of a model object with the
+    PSF parameters of a given aXe configuration file (e.g. the NISP test
+    configurations 'test/data/axesim_d?_PSF.conf'). The current values
+    are checked against 'get_sub_emodel_value()' at each trace point.
+
+    Usage:
+      bench_gaussvalues configuration_file [npoints] [npix] [nrepeat]
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; either version 2 of the License, or
+    (at your option) any later version.
+*/
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <math.h>
+#include <time.h>
+#include <gsl/gsl_vector.h>
+#include "aXe_grism.h"
+#include "aXe_utils.h"
+#include "aper_conf.h"
+#include "model_utils.h"
+
+/*
+ * Function: fill_gaussvalues_v0
+ * The former implementation of 'fill_gaussvalues()', kept
+ * for comparison. For each trace point the whole gvalue vector
+ * is overwritten, such that all points get the emission
+ * value at the last wavelength.
+ */
+static void
+fill_gaussvalues_v0(const d_point dpixel, const beam actbeam,
+                    const dirobject *actdir, const double lambda_ref,
+                    const aperture_conf *conf, const double psf_offset,
+                    tracedata *acttrace)
+{
+  beam new_beam;
+
+  double dpsf=0.0;
+  double lambda=0.0;
+
+  int i=0;
+
+  if (conf->psfrange && conf->psfcoeffs)
+    {
+      for (i=0; i < acttrace->npoints; i++)
+        {
+          lambda   = gsl_vector_get(acttrace->lambda, i)/10.0;
+          dpsf     = psf_offset + get_dpsf(lambda_ref, lambda, conf, actbeam);
+          new_beam = get_newbeam(actbeam,dpsf);
+          gsl_vector_set_all(acttrace->gvalue, get_sub_emodel_value(dpixel, new_beam, actdir->drzscale));
+        }
+    }
+  else
+    {
+      new_beam = get_newbeam(actbeam,psf_offset);
+      gsl_vector_set_all(acttrace->gvalue, get_sub_emodel_value(dpixel, new_beam, actdir->drzscale));
+    }
+}
+
+static double
+elapsed(const clock_t start)
+{
+  return (double)(clock() - start) / (double)CLOCKS_PER_SEC;
+}
+
+int
+main (int argc, char *argv[])
+{
+  aperture_conf *conf;
+
+  tracedata *acttrace;
+  psf_table *ptable;
+  dirobject  actdir;
+  beam       actbeam;
+
+  d_point dpixel;
+
+  double lambda_ref=0.0;
+  double lmin=0.0;
+  double lmax=0.0;
+  double psf_offset=0.0;
+  double sval=0.0;
+  double maxdiff=0.0;
+  double t_old=0.0;
+  double t_new=0.0;
+
+  int npoints=500;
+  int npix=21;
+  int nrepeat=5;
+  int nx, ny;
+  int i, irep;
+
+  clock_t start;
+
+  if (argc < 2)
+    {
+      fprintf (stdout,
+               "Usage:\n"
+               "      bench_gaussvalues configuration_file [npoints] [npix] [nrepeat]\n"
+               "\n");
+      exit (1);
+    }
+  if (argc > 2)
+    npoints = atoi(argv[2]);
+  if (argc > 3)
+    npix = atoi(argv[3]);
+  if (argc > 4)
+    nrepeat = atoi(argv[4]);
+
+  conf = get_aperture_descriptor (argv[1]);
+
+  // the reference wavelength as in simdispim:
+  // the center of the PSFRANGE
+  if (conf->psfrange && conf->psfcoeffs)
+    {
+      lmin = gsl_vector_get(conf->psfrange, 0);
+      lmax = gsl_vector_get(conf->psfrange, 1);
+      lambda_ref = 0.5 * (lmin + lmax);
+    }
+  psf_offset = conf->beam[0].psf_offset;
+  if (lmax <= lmin)
+    {
+      lmin = 1200.0;
+      lmax = 1850.0;
+    }
+
+  // a trace over the wavelength range in [AA]
+  acttrace = (tracedata *) malloc(sizeof(tracedata));
+  acttrace->npoints = npoints;
+  acttrace->dx      = gsl_vector_alloc(npoints);
+  acttrace->dy      = gsl_vector_alloc(npoints);
+  acttrace->xi      = gsl_vector_alloc(npoints);
+  acttrace->lambda  = gsl_vector_alloc(npoints);
+  acttrace->dlambda = gsl_vector_alloc(npoints);
+  acttrace->flux    = gsl_vector_alloc(npoints);
+  acttrace->gvalue  = gsl_vector_alloc(npoints);
+  for (i=0; i < npoints; i++)
+    gsl_vector_set(acttrace->lambda, i,
+                   10.0 * (lmin + (lmax - lmin) * (double)i / (double)(npoints > 1 ? npoints-1 : 1)));
+
+  // a model object
+  memset(&actdir, 0, sizeof(dirobject));
+  actdir.ID         = 1;
+  actdir.drzscale.x = 1.0;
+  actdir.drzscale.y = 1.0;
+
+  memset(&actbeam, 0, sizeof(beam));
+  actbeam.ID         = 0;
+  actbeam.refpoint.x = (double)(npix/2);
+  actbeam.refpoint.y = (double)(npix/2);
+  actbeam.awidth     = 2.5;
+  actbeam.bwidth     = 1.5;
+  actbeam.aorient    = 0.4;
+
+  fprintf (stdout, "bench_gaussvalues: configuration file: %s\n", argv[1]);
+  fprintf (stdout, "bench_gaussvalues: %i trace points, %ix%i pixels, %i repetitions\n",
+           npoints, npix, npix, nrepeat);
+
+  // the former implementation
+  start = clock();
+  for (irep=0; irep < nrepeat; irep++)
+    for (nx=0; nx < npix; nx++)
+      for (ny=0; ny < npix; ny++)
+        {
+          dpixel.x = (double)nx;
+          dpixel.y = (double)ny;
+          fill_gaussvalues_v0(dpixel, actbeam, &actdir, lambda_ref, conf, psf_offset, acttrace);
+        }
+  t_old = elapsed(start);
+
+  // the current implementation,
+  // including the set up of the table
+  start = clock();
+  for (irep=0; irep < nrepeat; irep++)
+    {
+      ptable = compute_psf_table(actbeam, &actdir, lambda_ref, conf, psf_offset, acttrace);
+      if (ptable == NULL)
+        {
+          fprintf (stdout, "bench_gaussvalues: no wavelength dependent PSF in %s\n", argv[1]);
+          exit (1);
+        }
+      for (nx=0; nx < npix; nx++)
+        for (ny=0; ny < npix; ny++)
+          {
+            dpixel.x = (double)nx;
+            dpixel.y = (double)ny;
+            fill_gaussvalues(dpixel, ptable, acttrace);
+          }
+      if (irep < nrepeat-1)
+        free_psf_table(ptable);
+    }
+  t_new = elapsed(start);
+
+  // check the values at the last pixel against
+  // the emission model at each wavelength
+  for (i=0; i < npoints; i++)
+    {
+      actbeam.awidth = ptable->amod[i];
+      actbeam.bwidth = ptable->bmod[i];
+      sval = get_sub_emodel_value(dpixel, actbeam, actdir.drzscale);
+      if (fabs(sval - gsl_vector_get(acttrace->gvalue, i)) > maxdiff)
+        maxdiff = fabs(sval - gsl_vector_get(acttrace->gvalue, i));
+    }
+  free_psf_table(ptable);
+
+  fprintf (stdout, "bench_gaussvalues: former implementation:  %10.4fs\n", t_old);
+  fprintf (stdout, "bench_gaussvalues: current implementation: %10.4fs\n", t_new);
+  if (t_new > 0.0)
+    fprintf (stdout, "bench_gaussvalues: speedup:                %10.1f\n", t_old / t_new);
+  fprintf (stdout, "bench_gaussvalues: max. deviation from get_sub_emodel_value: %e\n", maxdiff);
+
+  free_tracedata(acttrace);
+  free_aperture_conf(conf);
+  exit (0);
+}
@@ -0,0 +1,486 @@
+/*
+    bench_kernels
+    Benchmark of the inner kernels of the spectral modelling
+
+    The program compares the former implementations of the kernels
+    'fill_pixel_in_speed()', 'diffuse_spectrumII()', 'make_model_image()'
+    and 'add2image()', which accessed the matrices and vectors through
+    'gsl_matrix_get/set()' and 'gsl_vector_get()' with a bounds check
+    for every pixel, with the current implementations working on the
+    rows of the data with the bounds checked once per stamp. All
+    kernels are run on synthetic data with the dimensions of a NISP
+    detector and first order beams; the results of the former and the
+    current implementations are compared.
+
+    Usage:
+      bench_kernels [npix] [nbeams] [nrepeat]
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; either version 2 of the License, or
+    (at your option) any later version.
+*/
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <math.h>
+#include <time.h>
+#include <unistd.h>
+#include <fcntl.h>
+#include <gsl/gsl_vector.h>
+#include <gsl/gsl_matrix.h>
+#include "aXe_grism.h"
+#include "aXe_utils.h"
+#include "spc_spc.h"
+#include "spc_wl_calib.h"
+#include "fringe_conf.h"
+#include "spc_resp.h"
+#include "aper_conf.h"
+#include "specmodel_utils.h"
+#include "model_utils.h"
+#include "spc_fluxcube.h"
+#include "spc_model.h"
+#include "disp_utils.h"
+
+// the number of trace points, i.e. the length
+// of a first order beam, and the cross dispersion
+// extent of the beam stamps
+#define TRACE_LEN  520
+#define STAMP_Y    40
+
+// the size of the direct objects
+#define OBJ_SIZE   12
+
+/*
+ * Function: diffuse_spectrumII_v0
+ * The former implementation of 'diffuse_spectrumII()'.
+ */
+static int
+diffuse_spectrumII_v0(double ddx, double ddy, double cps, beamspec *actspec)
+{
+  int ix, iy, ix_rem, iy_rem;
+  double p, q, p_rem, q_rem;
+  double d_incr, oldvalue;
+
+  ix     = (int)floor(ddx);
+  iy     = (int)floor(ddy);
+  ix_rem = ix + 1;
+  iy_rem = iy + 1;
+
+  p_rem = ddx - floor(ddx);
+  q_rem = ddy - floor(ddy);
+  p     = 1.0 - p_rem;
+  q     = 1.0 - q_rem;
+
+  if ( ! (ix < 0 || iy < 0 || ix > (actspec->model->size1-1) || iy > (actspec->model->size2-1)))
+    {
+      d_incr = p * q;
+      oldvalue = gsl_matrix_get(actspec->model, ix, iy);
+      gsl_matrix_set(actspec->model, ix, iy, oldvalue + d_incr*cps);
+    }
+  if ( ! (ix < 0 || iy_rem < 0 || ix > (actspec->model->size1-1) || iy_rem > (actspec->model->size2-1)))
+    {
+      d_incr = p * q_rem;
+      oldvalue = gsl_matrix_get(actspec->model, ix, iy_rem);
+      gsl_matrix_set(actspec->model, ix, iy_rem, oldvalue + d_incr*cps);
+    }
+  if ( ! (ix_rem < 0 || iy < 0 || ix_rem > (actspec->model->size1-1) || iy > (actspec->model->size2-1)))
+    {
+      d_incr = p_rem * q;
+      oldvalue = gsl_matrix_get(actspec->model, ix_rem, iy);
+      gsl_matrix_set(actspec->model, ix_rem, iy, oldvalue + d_incr*cps);
+    }
+  if ( ! (ix_rem < 0 || iy_rem < 0 || ix_rem > (actspec->model->size1-1) || iy_rem > (actspec->model->size2-1)))
+    {
+      d_incr = p_rem * q_rem;
+      oldvalue = gsl_matrix_get(actspec->model, ix_rem, iy_rem);
+      gsl_matrix_set(actspec->model, ix_rem, iy_rem, oldvalue + d_incr*cps);
+    }
+
+  return 1;
+}
+
+/*
+ * Function: fill_pixel_in_speed_v0
+ * The former implementation of 'fill_pixel_in_speed()'.
+ */
+static int
+fill_pixel_in_speed_v0(const dirobject *actdir, const tracedata *acttrace,
+                       const d_point dpixel, const spectrum *resp,
+                       beamspec *actspec)
+{
+  double dx, sens, fval, tmp1;
+  double ddx, ddy;
+  int ix, iy;
+  int xstart, xend, xact;
+  int ipos;
+  int nguess=0;
+
+  xstart = actspec->model_ref.x;
+  xend   = actspec->model_ref.x + actspec->model->size1;
+
+  for (xact = xstart; xact <  xend; xact++)
+    {
+      dx = xact-dpixel.x;
+      ipos = get_index_for_tracepoint(acttrace, dx);
+      if (ipos <0)
+        continue;
+
+      iy = (int)(gsl_vector_get(acttrace->dy,ipos) + actdir->xy_off[actspec->beamID].y + 0.5) + (int)dpixel.y - actspec->model_ref.y;
+      ddy = gsl_vector_get(acttrace->dy,ipos) + actdir->xy_off[actspec->beamID].y + dpixel.y - actspec->model_ref.y;
+      if (iy < 0 || iy > actspec->model->size2-1)
+        continue;
+
+      if (gsl_vector_get(acttrace->lambda, ipos) < resp->lambdamin || gsl_vector_get(acttrace->lambda, ipos) > resp->lambdamax)
+        continue;
+
+      ix = (int)(gsl_vector_get(acttrace->dx,ipos) + actdir->xy_off[actspec->beamID].x) + (int)dpixel.x - actspec->model_ref.x;
+      ddx = gsl_vector_get(acttrace->dx,ipos) + actdir->xy_off[actspec->beamID].x + dpixel.x - actspec->model_ref.x;
+
+      fval = gsl_vector_get(acttrace->gvalue, ipos) * gsl_vector_get(acttrace->flux, ipos);
+      sens = get_response_value_plus(resp, gsl_vector_get(acttrace->lambda, ipos), &nguess);
+      tmp1 = fval * sens * gsl_vector_get(acttrace->dlambda,ipos);
+
+      if (ix < 0 || iy < 0 || ix > (actspec->model->size1-1) || iy > (actspec->model->size2-1))
+        fprintf(stdout, "xval: %i, yval: %i, size1: %i, size2: %i\n",ix, iy, (int)actspec->model->size1, (int)actspec->model->size2);
+      else
+        diffuse_spectrumII_v0(ddx, ddy, tmp1, actspec);
+    }
+
+  return 1;
+}
+
+/*
+ * Function: make_model_image_v0
+ * The former implementation of 'make_model_image()',
+ * without the progress messages.
+ */
+static void
+make_model_image_v0(const px_point npixels, gsl_matrix *all_models, beamspec **speclist)
+{
+  const beamspec *actspec;
+  double oldval, addval;
+  int i=0;
+  int ix, iy, xact, yact;
+
+  gsl_matrix_set_all(all_models,0.0);
+  while (speclist[i] != NULL)
+    {
+      actspec = speclist[i];
+      for (xact=0; xact < actspec->model->size1; xact++)
+        for (yact=0; yact < actspec->model->size2; yact++)
+          {
+            ix = (int)actspec->model_ref.x + xact;
+            iy = (int)actspec->model_ref.y + yact;
+            if (ix < 0 || iy < 0 || ix > npixels.x-1 || iy > npixels.y-1)
+              fprintf(stdout, "This should not happen!\n");
+            else
+              {
+                addval = gsl_matrix_get(actspec->model, xact, yact);
+                oldval = gsl_matrix_get(all_models, ix, iy);
+                gsl_matrix_set(all_models, ix, iy, oldval+addval);
+              }
+          }
+      i++;
+    }
+}
+
+/*
+ * Function: add2image_v0
+ * The former implementation of 'add2image()'.
+ */
+static void
+add2image_v0(const px_point npixels, observation *obs, beamspec *spec)
+{
+  double y, t;
+  int xact, yact;
+  int ix, iy;
+
+  for (xact=0; xact < spec->model->size1; xact++)
+    for (yact=0; yact < spec->model->size2; yact++)
+      {
+        ix = (int)spec->model_ref.x + xact;
+        iy = (int)spec->model_ref.y + yact;
+        if (ix < 0 || iy < 0 || ix > (npixels.x-1) || iy > (npixels.y-1))
+          fprintf(stderr, "bench_kernels: pixel %i,%i is outside the image\n", xact, yact);
+        else
+          {
+            y = gsl_matrix_get(spec->model, xact, yact) - gsl_matrix_get(obs->pixerrs, ix, iy);
+            t = gsl_matrix_get(obs->grism, ix, iy) + y;
+            gsl_matrix_set(obs->pixerrs, ix, iy, (t-gsl_matrix_get(obs->grism, ix, iy))-y);
+            gsl_matrix_set(obs->grism, ix, iy, t);
+          }
+      }
+}
+
+static double
+elapsed(const clock_t start)
+{
+  return (double)(clock() - start) / (double)CLOCKS_PER_SEC;
+}
+
+static double
+max_deviation(const gsl_matrix *a, const gsl_matrix *b)
+{
+  double maxdiff=0.0;
+  size_t i, j;
+
+  for (i=0; i < a->size1; i++)
+    for (j=0; j < a->size2; j++)
+      if (fabs(gsl_matrix_get(a, i, j) - gsl_matrix_get(b, i, j)) > maxdiff)
+        maxdiff = fabs(gsl_matrix_get(a, i, j) - gsl_matrix_get(b, i, j));
+  return maxdiff;
+}
+
+static void
+report(const char *kernel, const double t_old, const double t_new, const double maxdiff)
+{
+  fprintf (stdout, "bench_kernels: %-20s former: %9.4fs  current: %9.4fs", kernel, t_old, t_new);
+  if (t_new > 0.0)
+    fprintf (stdout, "  speedup: %6.1f", t_old / t_new);
+  fprintf (stdout, "  max. deviation: %e\n", maxdiff);
+}
+
+/*
+ * The current 'make_model_image()' reports each beam on
+ * stdout; the messages are suppressed during the timing.
+ */
+static int
+quiet_stdout(void)
+{
+  int fd;
+  int devnull;
+
+  fflush(stdout);
+  fd = dup(STDOUT_FILENO);
+  devnull = open("/dev/null", O_WRONLY);
+  dup2(devnull, STDOUT_FILENO);
+  close(devnull);
+  return fd;
+}
+
+static void
+restore_stdout(const int fd)
+{
+  fflush(stdout);
+  dup2(fd, STDOUT_FILENO);
+  close(fd);
+}
+
+int
+main (int argc, char *argv[])
+{
+  tracedata *acttrace;
+  spectrum  *resp;
+  dirobject  actdir;
+  beamspec   spec_old, spec_new;
+  beamspec **speclist;
+  observation obs_old, obs_new;
+
+  px_point npixels;
+  d_point  dpixel;
+
+  double t_old=0.0;
+  double t_new=0.0;
+  double maxdiff=0.0;
+  double ddx, ddy;
+
+  int npix=2040;
+  int nbeams=400;
+  int nrepeat=5;
+  int nx, ny;
+  int i, irep;
+  int fd;
+
+  clock_t start;
+
+  if (argc > 1 && (!strcmp(argv[1], "-h") || !strcmp(argv[1], "--help")))
+    {
+      fprintf (stdout,
+               "Usage:\n"
+               "      bench_kernels [npix] [nbeams] [nrepeat]\n"
+               "\n");
+      exit (1);
+    }
+  if (argc > 1)
+    npix = atoi(argv[1]);
+  if (argc > 2)
+    nbeams = atoi(argv[2]);
+  if (argc > 3)
+    nrepeat = atoi(argv[3]);
+  if (npix < TRACE_LEN + OBJ_SIZE + STAMP_Y)
+    {
+      fprintf (stdout, "bench_kernels: the image must have at least %i pixels\n",
+               TRACE_LEN + OBJ_SIZE + STAMP_Y);
+      exit (1);
+    }
+  srand(1);
+
+  // a first order trace in the NISP red grism
+  // wavelength range, with the wavelengths in [AA]
+  acttrace = (tracedata *) malloc(sizeof(tracedata));
+  acttrace->npoints  = TRACE_LEN;
+  acttrace->dx_start = 0.0;
+  acttrace->dx       = gsl_vector_alloc(TRACE_LEN);
+  acttrace->dy       = gsl_vector_alloc(TRACE_LEN);
+  acttrace->xi       = gsl_vector_alloc(TRACE_LEN);
+  acttrace->lambda   = gsl_vector_alloc(TRACE_LEN);
+  acttrace->dlambda  = gsl_vector_alloc(TRACE_LEN);
+  acttrace->flux     = gsl_vector_alloc(TRACE_LEN);
+  acttrace->gvalue   = gsl_vector_alloc(TRACE_LEN);
+  for (i=0; i < TRACE_LEN; i++)
+    {
+      gsl_vector_set(acttrace->dx, i, (double)i);
+      gsl_vector_set(acttrace->dy, i, 0.013 * (double)i + 0.3);
+      gsl_vector_set(acttrace->xi, i, (double)i);
+      gsl_vector_set(acttrace->lambda, i, 12500.0 + 13.4 * (double)i);
+      gsl_vector_set(acttrace->dlambda, i, 13.4);
+      gsl_vector_set(acttrace->flux, i, 1.0e-17 * (1.0 + 0.5 * sin((double)i / 40.0)));
+      gsl_vector_set(acttrace->gvalue, i, 0.01);
+    }
+
+  // a smooth sensitivity curve covering the trace
+  resp = allocate_spectrum(TRACE_LEN + 2);
+  for (i=0; i < TRACE_LEN + 2; i++)
+    {
+      resp->spec[i].lambda_mean = 12500.0 + 13.4 * (double)(i-1);
+      resp->spec[i].flux        = 1.0e17 * (0.5 + 0.4 * cos((double)i / 100.0));
+    }
+  resp->lambdamin = resp->spec[0].lambda_mean;
+  resp->lambdamax = resp->spec[TRACE_LEN + 1].lambda_mean;
+
+  memset(&actdir, 0, sizeof(dirobject));
+  actdir.ID = 1;
+
+  // the beam stamp of a direct object with OBJ_SIZE x OBJ_SIZE pixels
+  spec_old.objectID   = 1;
+  spec_old.beamID     = 0;
+  spec_old.model_ref.x = 0.0;
+  spec_old.model_ref.y = 0.0;
+  spec_old.model      = gsl_matrix_alloc(TRACE_LEN + OBJ_SIZE, STAMP_Y);
+  spec_new = spec_old;
+  spec_new.model      = gsl_matrix_alloc(TRACE_LEN + OBJ_SIZE, STAMP_Y);
+  gsl_matrix_set_all(spec_old.model, 0.0);
+  gsl_matrix_set_all(spec_new.model, 0.0);
+
+  fprintf (stdout, "bench_kernels: %ix%i pixels, %i beams of %ix%i pixels, %i repetitions\n",
+           npix, npix, nbeams, TRACE_LEN + OBJ_SIZE, STAMP_Y, nrepeat);
+
+  // fill_pixel_in_speed, for all pixels of the direct object
+  start = clock();
+  for (irep=0; irep < nrepeat; irep++)
+    for (nx=0; nx < OBJ_SIZE; nx++)
+      for (ny=0; ny < OBJ_SIZE; ny++)
+        {
+          dpixel.x = (double)nx;
+          dpixel.y = (double)(ny + (STAMP_Y - OBJ_SIZE) / 2 - 4);
+          fill_pixel_in_speed_v0(&actdir, acttrace, dpixel, resp, &spec_old);
+        }
+  t_old = elapsed(start);
+
+  start = clock();
+  for (irep=0; irep < nrepeat; irep++)
+    for (nx=0; nx < OBJ_SIZE; nx++)
+      for (ny=0; ny < OBJ_SIZE; ny++)
+        {
+          dpixel.x = (double)nx;
+          dpixel.y = (double)(ny + (STAMP_Y - OBJ_SIZE) / 2 - 4);
+          fill_pixel_in_speed(&actdir, acttrace, dpixel, resp, &spec_new, NULL);
+        }
+  t_new = elapsed(start);
+  report("fill_pixel_in_speed", t_old, t_new, max_deviation(spec_old.model, spec_new.model));
+
+  // diffuse_spectrumII, for sub-pixel positions
+  // all over the stamp and partly outside
+  start = clock();
+  for (irep=0; irep < nrepeat * 100; irep++)
+    for (i=0; i < TRACE_LEN + OBJ_SIZE; i++)
+      {
+        ddx = (double)i - 0.5 + 0.37 * (double)irep / (double)(nrepeat * 100);
+        ddy = 0.07 * (double)(irep % STAMP_Y) + 0.021 * (double)i - 1.5;
+        diffuse_spectrumII_v0(ddx, ddy, 1.0, &spec_old);
+      }
+  t_old = elapsed(start);
+
+  start = clock();
+  for (irep=0; irep < nrepeat * 100; irep++)
+    for (i=0; i < TRACE_LEN + OBJ_SIZE; i++)
+      {
+        ddx = (double)i - 0.5 + 0.37 * (double)irep / (double)(nrepeat * 100);
+        ddy = 0.07 * (double)(irep % STAMP_Y) + 0.021 * (double)i - 1.5;
+        diffuse_spectrumII(ddx, ddy, 1.0, &spec_new);
+      }
+  t_new = elapsed(start);
+  report("diffuse_spectrumII", t_old, t_new, max_deviation(spec_old.model, spec_new.model));
+
+  // the beams at random positions in the image,
+  // all sharing the model stamp
+  npixels.x = npix;
+  npixels.y = npix;
+  speclist = (beamspec **) malloc((nbeams+1) * sizeof(beamspec *));
+  for (i=0; i < nbeams; i++)
+    {
+      speclist[i]  = (beamspec *) malloc(sizeof(beamspec));
+      *speclist[i] = spec_new;
+      speclist[i]->objectID    = i+1;
+      speclist[i]->model_ref.x = (double)(rand() % (npix - (int)spec_new.model->size1 + 1));
+      speclist[i]->model_ref.y = (double)(rand() % (npix - (int)spec_new.model->size2 + 1));
+    }
+  speclist[nbeams] = NULL;
+
+  obs_old.grism   = gsl_matrix_alloc(npix, npix);
+  obs_old.pixerrs = gsl_matrix_alloc(npix, npix);
+  obs_old.dq      = NULL;
+  obs_new.grism   = gsl_matrix_alloc(npix, npix);
+  obs_new.pixerrs = gsl_matrix_alloc(npix, npix);
+  obs_new.dq      = NULL;
+
+  // make_model_image
+  start = clock();
+  for (irep=0; irep < nrepeat; irep++)
+    make_model_image_v0(npixels, obs_old.grism, speclist);
+  t_old = elapsed(start);
+
+  fd = quiet_stdout();
+  start = clock();
+  for (irep=0; irep < nrepeat; irep++)
+    make_model_image(npixels, &obs_new, speclist);
+  t_new = elapsed(start);
+  restore_stdout(fd);
+  report("make_model_image", t_old, t_new, max_deviation(obs_old.grism, obs_new.grism));
+
+  // add2image, with the compensated summation
+  gsl_matrix_set_all(obs_old.grism, 0.0);
+  gsl_matrix_set_all(obs_old.pixerrs, 0.0);
+  gsl_matrix_set_all(obs_new.grism, 0.0);
+  gsl_matrix_set_all(obs_new.pixerrs, 0.0);
+  start = clock();
+  for (irep=0; irep < nrepeat; irep++)
+    for (i=0; i < nbeams; i++)
+      add2image_v0(npixels, &obs_old, speclist[i]);
+  t_old = elapsed(start);
+
+  start = clock();
+  for (irep=0; irep < nrepeat; irep++)
+    for (i=0; i < nbeams; i++)
+      add2image(npixels, &obs_new, speclist[i]);
+  t_new = elapsed(start);
+  maxdiff = max_deviation(obs_old.grism, obs_new.grism);
+  if (max_deviation(obs_old.pixerrs, obs_new.pixerrs) > maxdiff)
+    maxdiff = max_deviation(obs_old.pixerrs, obs_new.pixerrs);
+  report("add2image", t_old, t_new, maxdiff);
+
+  for (i=0; i < nbeams; i++)
+    free(speclist[i]);
+  free(speclist);
+  gsl_matrix_free(obs_old.grism);
+  gsl_matrix_free(obs_old.pixerrs);
+  gsl_matrix_free(obs_new.grism);
+  gsl_matrix_free(obs_new.pixerrs);
+  gsl_matrix_free(spec_old.model);
+  gsl_matrix_free(spec_new.model);
+  free_spectrum(resp);
+  free_tracedata(acttrace);
+  exit (0);
+}
@@ -19,6 +19,9 @@
 #include <string.h>
 #include <fitsio.h>
 #include <unistd.h>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
 #include "aXe_utils.h"
 #include "inout_aper.h"
 #include "aXe_grism.h"
@@ -39,54 +42,271 @@
 #include "disp_utils.h"
 #include "spc_FITScards.h"
 
+#define MAX(x,y) (((x)>(y))?(x):(y))
+#define MIN(x,y) (((x)<(y))?(x):(y))
+
 /**
  * Function: compute_disp
  * The function computes the grism image.
  */
 int
 compute_disp(char grism_file[], char OAF_file[], char CONF_file[],
-		const char specmod_file[],  const char objmod_file[], const double lambda_psf, observation *obs)
+		const char specmod_file[],  const char objmod_file[], const double lambda_psf,
+		observation *obs, const int nthreads)
 {
 	object **oblist;
 
-	beamspec *spec;
+	aperture_conf *conf;
 
-	fits_access *spectrum_access;
-	fits_access *modim_access;
+	FITScards *gcards;
+
+	// load the object list
+	fprintf (stdout, "aXe_DISPIMAGE: Loading object aperture list...");
+	oblist = file_to_object_list_seq (OAF_file, obs);
+	fprintf (stdout,"%d objects loaded.\n",object_list_size(oblist));
+
+	// save the fits header
+	conf = get_aperture_descriptor (CONF_file);
+	get_extension_numbers(grism_file, conf, conf->optkey1, conf->optval1);
+	gcards = get_FITS_cards(grism_file, conf->science_numext);
+
+	// model the objects
+	compute_disp_oblist(grism_file, oblist, CONF_file, NULL, specmod_file, objmod_file, lambda_psf, obs, nthreads);
+
+	// write grism image and copy the FITS header
+	gsl_to_FITSimage(obs->grism, grism_file, 1, "SCI");
+	put_FITS_cards(grism_file, 2, gcards);
+
+	if (oblist !=NULL)
+		free_oblist (oblist);
+	free_FITScards(gcards);
+	free_aperture_conf(conf);
+
+	return 1;
+}
+
+/**
+ * Function: model_object_beams
+ * The function models all beams of one object. The beam models
+ * are returned in a list with one entry per beam, which is NULL
+ * for beams that are not modelled. Reading from the model files
+ * and from the beam cache is serialized, such that the function
+ * can be called from several threads.
+ */
+static beamspec **
+model_object_beams(object *actobject, object **oblist, const id_index *obidx,
+		const px_point npixels, gsl_matrix *drzcoeffs, const int max_offs,
+		aperture_conf *conf, fits_access *spectrum_access, fits_access *modim_access,
+		beam_cache *bcache, ekernel_cache *kcache, const double lambda_psf)
+{
+	beamspec **ospecs;
+	beamspec *spec;
 
-	px_point npixels;
-	gsl_matrix *drzcoeffs;
-	int nobjects=0;
-	int i=0;
 	int j=0;
 	int beamID;
-	int max_offs;
 
 	calib_function *wl_calibration;
 	double psf_offset=0;
-	spectrum *resp;
-
-	aperture_conf *conf;
+	const spectrum *resp;
 
 	beam actbeam;
 
 	int nx, ny;
+	int nx_stamp, ny_stamp;
 	d_point dpixel;
 	double sval;
-
-	int f_status = 0;
+	double *dstamp;
 
 	dirobject *actdir;
 	tracedata *acttrace;
+	psf_table *ptable;
+	const emission_kernel *kernel;
+	trace_lsf *lsf;
 
-	FITScards *gcards;
+	ospecs = (beamspec **) malloc(actobject->nbeams * sizeof(beamspec *));
+	if (ospecs == NULL)
+		aXe_message (aXe_M_FATAL, __FILE__, __LINE__,
+				"model_object_beams: Could not allocate memory for %i beams",
+				actobject->nbeams);
 
-	char ID[60];
+#pragma omp critical (axe_model_files)
+	{
+		//---
+		//new way to get the direct image
+		if (has_aper_dirim(modim_access, actobject))
+			actdir = load_dirobj_img(actobject, modim_access);
+		else
+			actdir = fill_dirobject(actobject, npixels, drzcoeffs, 5, max_offs);
+		//---
+
+		// load the spectral values into the dirobject
+		load_spectrum(actobject, actdir, spectrum_access, 1);
+	}
 
-	// load the object list
-	fprintf (stdout, "aXe_DISPIMAGE: Loading object aperture list...");
-	oblist = file_to_object_list_seq (OAF_file, obs);
-	fprintf (stdout,"%d objects loaded.\n",object_list_size(oblist));
+	for (beamID=0; beamID < conf->nbeams; beamID++) {
+		actdir->xy_off[beamID].x = 0.0;
+		actdir->xy_off[beamID].y = 0.0;
+	}
+
+	// for each beam
+	for (j=0; j < actobject->nbeams; j++) {
+		ospecs[j] = NULL;
+		spec=dimension_beamspec(actdir, actobject, npixels, conf, j);
+
+		if (spec == NULL) {
+			fprintf(stderr, "aXe_DISPIMAGE: function compute_disp\n\
+		beamspec is NULL\n\
+		skipping object %i beam %c ...", actobject->ID, BEAM(j));
+			continue;
+		}
+
+		actbeam = get_beam_for_beamspec_index(oblist, obidx, spec);
+		if (actbeam.ignore == 1)
+		{
+			gsl_matrix_free (spec->model);
+			free(spec);
+			continue;
+		}
+
+		psf_offset = get_psf_offset(conf, actbeam);
+#pragma omp critical (axe_beam_cache)
+		{
+			wl_calibration = get_calib_function_cached(bcache, spec, actdir, conf);
+			resp = get_throughput_spec_cached(bcache, spec);
+		}
+		acttrace = compute_short_tracedata(conf, actbeam, actdir, wl_calibration, spec);
+
+		if (acttrace->npoints < 1)
+		{
+			fprintf(stderr, "aXe_DISPIMAGE: function compute_disp\n\
+		trace is empty\n\
+		skipping object %i beam %c ...", spec->objectID, BEAM(spec->beamID));
+			gsl_matrix_free (spec->model);
+			free(spec);
+		}
+		else {
+
+			// fill the flux information into the tracedata
+			fill_fluxfrom_SED(actdir, acttrace);
+			fprintf(stdout, "aXe_DISPIMAGE: modelling object %i beam %c ...", spec->objectID, BEAM(spec->beamID));
+
+			// the widths of the emission model along the trace
+			ptable = NULL;
+			if (!actdir->dirim)
+				ptable = compute_psf_table(actbeam, actdir, lambda_psf, conf, psf_offset, acttrace);
+
+			// the emission stamp for wavelength independent models
+			kernel = NULL;
+			if (!actdir->dirim && !ptable && kcache)
+				kernel = get_emission_kernel(kcache, actbeam, actdir);
+
+			// the emission of a model image on the
+			// whole direct object area
+			dstamp   = NULL;
+			nx_stamp = actdir->ix_max - actdir->ix_min + 1;
+			ny_stamp = actdir->iy_max - actdir->iy_min + 1;
+			if (actdir->dirim && nx_stamp > 0 && ny_stamp > 0)
+				dstamp = compute_diremission_stamp(actdir->dirim, actdir->ix_min, actdir->iy_min,
+						nx_stamp, ny_stamp, actbeam.refpoint);
+
+			// the contribution along the trace,
+			// identical for all pixels up to a shift
+			lsf = compute_trace_lsf(actdir, acttrace, resp, spec);
+
+			// iterate over the direct image area
+			for (nx=actdir->ix_min; nx<=actdir->ix_max; nx++) {
+				for (ny=actdir->iy_min; ny<=actdir->iy_max; ny++) {
+
+					// fill the dpixel structure
+					dpixel.x = (double)nx;
+					dpixel.y = (double)ny;
+
+					if (actdir->dirim)
+					{
+						sval = dstamp[(nx - actdir->ix_min)*ny_stamp + (ny - actdir->iy_min)];
+						gsl_vector_set_all (acttrace->gvalue, sval);
+					}
+					else {
+						// check whether a wavelength-dependent
+						// emission profile is given
+						if (ptable) {
+							// fill in the wavelength dependend
+							// emission values
+							fill_gaussvalues(dpixel, ptable, acttrace);
+						}
+						else {
+							// do a subsampling over the pixel
+							// to get a more appropriate value for the
+							// emission val
+							if (kernel)
+								sval = get_kernel_emission(kernel, dpixel, actbeam, actdir->drzscale);
+							else
+								sval = get_sub_emodel_value(dpixel, actbeam, actdir->drzscale);
+							gsl_vector_set_all (acttrace->gvalue, sval);
+						}
+					}
+
+					// transfer the pixel contribution to the beam spectrum
+					fill_pixel_from_lsf(lsf, acttrace, dpixel, spec);
+				}
+			}
+
+			free_psf_table(ptable);
+			free_trace_lsf(lsf);
+			if (dstamp)
+				free(dstamp);
+
+			// keep the beam spectrum for the simulation
+			ospecs[j] = spec;
+		}
+
+		// release the memory for the various structures
+		fprintf(stdout, " Done\n");
+		free_calib(wl_calibration);
+		free_tracedata(acttrace);
+	}
+	// free the entire direct image
+	free_dirobject (actdir);
+
+	return ospecs;
+}
+
+/**
+ * Function: compute_disp_oblist
+ * The function models the objects of an object list into
+ * the grism image of the observation structure. Nothing
+ * is written to disk, such that the function can be used
+ * both from aXe_DISPIMAGE and from the in-process engine.
+ * With OpenMP the objects are modelled by 'nthreads' threads
+ * (all available cores for nthreads < 1). The beam models
+ * are added to the image in the order of the object list,
+ * hence the result does not depend on the number of threads.
+ * The sensitivity tables are looked for in 'config_path',
+ * or in $AXE_CONFIG_PATH for NULL or an empty string.
+ */
+int
+compute_disp_oblist(char grism_file[], object **oblist, char CONF_file[],
+		const char config_path[], const char specmod_file[],  const char objmod_file[],
+		const double lambda_psf, observation *obs, const int nthreads)
+{
+	beamspec **ospecs;
+
+	fits_access *spectrum_access;
+	fits_access *modim_access;
+
+	px_point npixels;
+	gsl_matrix *drzcoeffs;
+	int nobjects=0;
+	int i=0;
+	int j=0;
+	int max_offs;
+	int nthr=1;
+
+	aperture_conf *conf;
+
+	id_index *obidx;
+	beam_cache *bcache;
+	ekernel_cache *kcache;
 
 	// check whether highres spectra are given are available
 	if (strlen(specmod_file) > 0) {
@@ -125,8 +345,6 @@ compute_disp(char grism_file[], char OAF_file[], char CONF_file[],
 
 	conf = get_aperture_descriptor (CONF_file);
 	get_extension_numbers(grism_file, conf, conf->optkey1, conf->optval1);
-	// save the fits header
-	gcards = get_FITS_cards(grism_file, conf->science_numext);
 
 	// get the  matrix with the drizzle coefficients
 	drzcoeffs = get_crossdisp_matrix(grism_file, conf->science_numext);
@@ -140,122 +358,62 @@ compute_disp(char grism_file[], char OAF_file[], char CONF_file[],
 	// determine the number of objects in the object list
 	nobjects = object_list_size(oblist);
 
-	// for each object
-	for (i = 0; i < nobjects; i++)
-	{
-		if (oblist[i]->nbeams > 0) {
-			//---
-			//new way to get the direct image
-			if (has_aper_dirim(modim_access, oblist[i]))
-				actdir = load_dirobj_img(oblist[i], modim_access);
-			else
-				actdir = fill_dirobject(oblist[i], npixels, drzcoeffs, 5, max_offs);
-			//---
-
-			// load the spectral values into the dirobject
-			load_spectrum(oblist[i], actdir, spectrum_access, 1);
-
-			for (beamID=0; beamID < conf->nbeams; beamID++) {
-				actdir->xy_off[beamID].x = 0.0;
-				actdir->xy_off[beamID].y = 0.0;
-			}
+	// index the object list for the beam lookup
+	obidx = index_oblist(oblist);
 
-			// for each beam
-			for (j=0; j < oblist[i]->nbeams; j++) {
-				spec=dimension_beamspec(actdir, oblist[i], npixels, conf, j);
+	// the dispersion solutions and sensitivities,
+	// loaded once per beam
+	bcache = alloc_beam_cache(CONF_file, config_path);
 
-				if (spec == NULL) {
-					fprintf(stderr, "aXe_DISPIMAGE: function compute_disp\n\
-				beamspec is NULL\n\
-				skipping object %i beam %c ...", oblist[i]->ID, BEAM(j));
-				}
-				else {
-					actbeam = get_beam_for_beamspec(oblist, nobjects, spec);
-					if (actbeam.ignore != 1)
-					{
-						psf_offset = get_psf_offset(conf, actbeam);
-						wl_calibration = get_calib_function(spec, actdir, CONF_file, conf);
-						resp = get_throughput_spec(spec, CONF_file);
-						acttrace = compute_short_tracedata(conf, actbeam, actdir, wl_calibration, spec);
-
-						if (acttrace->npoints < 1)
-						{
-							fprintf(stderr, "aXe_DISPIMAGE: function compute_disp\n\
-					trace is empty\n\
-					skipping object %i beam %c ...", spec->objectID, BEAM(spec->beamID));
-						}
-						else {
+	// the emission kernels of the gaussian models
+	kcache = NULL;
+	if (conf->ekernel_tol >= 0.0)
+		kcache = alloc_ekernel_cache(conf->ekernel_tol);
 
-							// fill the flux information into the tracedata
-							fill_fluxfrom_SED(actdir, acttrace);
-							fprintf(stdout, "aXe_DISPIMAGE: modelling object %i beam %c ...", spec->objectID, BEAM(spec->beamID));
-
-							// iterate over the direct image area
-							for (nx=actdir->ix_min; nx<=actdir->ix_max; nx++) {
-								for (ny=actdir->iy_min; ny<=actdir->iy_max; ny++) {
-
-									// fill the dpixel structure
-									dpixel.x = (double)nx;
-									dpixel.y = (double)ny;
-
-									if (actdir->dirim)
-									{
-										sval = get_diremission_value(actdir->dirim, dpixel.x - actbeam.refpoint.x, dpixel.y - actbeam.refpoint.y);
-										gsl_vector_set_all (acttrace->gvalue, sval);
-									}
-									else {
-										// check whether a wavelength-dependent
-										// emission profile is given
-										if ((conf->psfcoeffs && conf->psfrange) || psf_offset) {
-											// fill in the wavelength dependend
-											// emission values
-											fill_gaussvalues(dpixel, actbeam, actdir, lambda_psf, conf, psf_offset, acttrace);
-										}
-										else {
-											// do a subsampling over the pixel
-											// to get a more appropriate value for the
-											// emission val
-											sval = get_sub_emodel_value(dpixel, actbeam, actdir->drzscale);
-											gsl_vector_set_all (acttrace->gvalue, sval);
-										}
-									}
-
-									// transfer the pixel contribution to the beam spectrum
-									fill_pixel_in_speed(actdir, acttrace, dpixel, resp, spec, wl_calibration);
-								}
-							}
-
-							// add the beam spectrum to the simulation
-							add2image(npixels, obs, spec);
-						}
+	// determine the number of threads
+#ifdef _OPENMP
+	nthr = nthreads > 0 ? nthreads : omp_get_max_threads();
+#endif
+	fprintf (stdout, "aXe_DISPIMAGE: Modelling with %i thread(s).\n", nthr);
 
-						// release the memory for the various structures
-						fprintf(stdout, " Done\n");
-						free_calib(wl_calibration);
-						free_spectrum(resp);
-						free_tracedata(acttrace);
-						gsl_matrix_free (spec->model);
-						free(spec);
+	// for each object
+#pragma omp parallel for ordered schedule(dynamic) num_threads(nthr) private(ospecs, j)
+	for (i = 0; i < nobjects; i++)
+	{
+		ospecs = NULL;
+		if (oblist[i]->nbeams > 0)
+			ospecs = model_object_beams(oblist[i], oblist, obidx, npixels, drzcoeffs, max_offs,
+					conf, spectrum_access, modim_access, bcache, kcache, lambda_psf);
+
+		// add the beam spectra to the simulation
+		// in the order of the object list
+#pragma omp ordered
+		{
+			if (ospecs != NULL) {
+				for (j=0; j < oblist[i]->nbeams; j++) {
+					if (ospecs[j] != NULL) {
+						add2image(npixels, obs, ospecs[j]);
+						gsl_matrix_free (ospecs[j]->model);
+						free(ospecs[j]);
 					}
 				}
+				free(ospecs);
 			}
-			// free the entire direct image
-			free_dirobject (actdir);
 		}
 	}
 
-	// write grism image and copy the FITS header
-	gsl_to_FITSimage(obs->grism, grism_file, 1, "SCI");
-	put_FITS_cards(grism_file, 2, gcards);
-
-	if (oblist !=NULL)
-		free_oblist (oblist);
 	if (spectrum_access != NULL)
 		free_fits_access(spectrum_access);
 	if (modim_access!=NULL)
 		free_fits_access(modim_access);
 	gsl_matrix_free(drzcoeffs);
-	free_FITScards(gcards);
+	free_id_index(obidx);
+	print_beam_cache_stats(bcache, "aXe_DISPIMAGE");
+	free_beam_cache(bcache);
+	if (kcache != NULL) {
+		print_ekernel_cache_stats(kcache, "aXe_DISPIMAGE");
+		free_ekernel_cache(kcache);
+	}
 	free_aperture_conf(conf);
 
 	return 1;
@@ -271,33 +429,46 @@ compute_disp(char grism_file[], char OAF_file[], char CONF_file[],
  */
 int add2image(const px_point npixels, observation *obs, beamspec *spec)
 {
+	const float *mrow;	// gsl_matrix is gsl_matrix_float (aXe_grism.h)
+	float *grow;
+	float *erow;
 	double y, t;
 	int xact, yact;
-	int ix, iy;
+	int iy;
+	int xref, yref;
+	int xmin, xmax, ymin, ymax;
+	int nout;
+
+	// the part of the beam model inside the image,
+	// checked once for the beam
+	xref = (int)spec->model_ref.x;
+	yref = (int)spec->model_ref.y;
+	xmin = MAX(0, -xref);
+	ymin = MAX(0, -yref);
+	xmax = MIN((int)spec->model->size1, npixels.x - xref);
+	ymax = MIN((int)spec->model->size2, npixels.y - yref);
+	nout = (int)(spec->model->size1*spec->model->size2) - MAX(xmax-xmin, 0)*MAX(ymax-ymin, 0);
+	if (nout > 0)
+	{
+		fprintf(stderr, "aXe_DISPIMAGE: function add2image\n\
+		       object %i beam %c: %i pixels are outside the image\n\
+		       This should not happend!!!", spec->objectID, BEAM(spec->beamID), nout);
+	}
 
 	// go over each pixel in the array of the beam model
-	for (xact=0; xact < spec->model->size1; xact++)
+	for (xact=xmin; xact < xmax; xact++)
 	{
-		for (yact=0; yact < spec->model->size2; yact++)
+		mrow = spec->model->data + (size_t)xact*spec->model->tda;
+		grow = obs->grism->data + (size_t)(xref + xact)*obs->grism->tda;
+		erow = obs->pixerrs->data + (size_t)(xref + xact)*obs->pixerrs->tda;
+		for (yact=ymin; yact < ymax; yact++)
 		{
-			// find the coordinates of the pixels in the whole image model
-			ix = (int)spec->model_ref.x + xact;
-			iy = (int)spec->model_ref.y + yact;
-
-			// check for safety reasons whether the coordinates are inside
-			if (ix < 0 || iy < 0 || ix > (npixels.x-1) || iy > (npixels.y-1))
-			{
-				fprintf(stderr, "aXe_DISPIMAGE: function add2image\n\
-		       object %i beam %c pixel %i,%i is outside the image\n\
-		       This should not happend!!!", spec->objectID, BEAM(spec->beamID), xact, yact);
-			}
-			else {
-				// sum up the pixels
-				y = gsl_matrix_get(spec->model, xact, yact) - gsl_matrix_get(obs->pixerrs, ix, iy);
-				t = gsl_matrix_get(obs->grism, ix, iy) + y;
-				gsl_matrix_set(obs->pixerrs, ix, iy, (t-gsl_matrix_get(obs->grism, ix, iy))-y);
-				gsl_matrix_set(obs->grism, ix, iy, t);
-			}
+			// sum up the pixels
+			iy = yref + yact;
+			y = mrow[yact] - erow[iy];
+			t = grow[iy] + y;
+			erow[iy] = (t-grow[iy])-y;
+			grow[iy] = t;
 		}
 	}
 
@@ -35,7 +35,13 @@
 
 extern int
 compute_disp(char grism_file[], char OAF_file[], char CONF_file[],
-	     const char specmod_file[],  const char objmod_file[], const double lambda_psf, observation *obs);
+	     const char specmod_file[],  const char objmod_file[], const double lambda_psf,
+	     observation *obs, const int nthreads);
+
+extern int
+compute_disp_oblist(char grism_file[], object **oblist, char CONF_file[],
+	     const char config_path[], const char specmod_file[],  const char objmod_file[],
+	     const double lambda_psf, observation *obs, const int nthreads);
 
 extern int
 add2image(const px_point npixels, observation *obs, beamspec *spec);
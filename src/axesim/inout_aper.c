@@ -8,6 +8,10 @@
  * @date    $Date: 2009/09/21 12:46:16 $
  */
 
+#include        <fcntl.h>
+#include        <unistd.h>
+#include        <sys/mman.h>
+#include        <sys/stat.h>
 #include        "inout_aper.h"
 
 /**
@@ -216,6 +220,430 @@ object_list_to_file (object * const *oblist, char *filename,
 }
 
 
+/**
+ * Function: sex_to_aper_angle
+ * Convert an angle from the SExtractor reference frame [deg]
+ * to the aXe reference frame [rad] in the same way as it is
+ * done when reading an Aperture File.
+ *
+ * Parameters:
+ * @param angle - the angle in the SExtractor frame [deg]
+ *
+ * Returns:
+ * @return aangle - the angle in the aXe frame [rad]
+ */
+static double
+sex_to_aper_angle(const double angle)
+{
+  double aangle;
+
+  aangle = (180 + angle) / 180. * M_PI;
+  while (aangle > M_PI)
+    aangle = aangle - M_PI;
+
+  return aangle;
+}
+
+
+/**
+ * Function: beam_to_bin_record
+ * Fill a record of the binary aperture file with the data of a beam.
+ * The record contains the beam as it is after reading the text
+ * Aperture File, however without the loss of precision.
+ *
+ * Parameters:
+ * @param b       - the beam
+ * @param oid     - the aperture ID
+ * @param beamID  - the beam ID
+ * @param voffset - offset of the beam values in the value block
+ * @param rec     - the record to fill
+ */
+static void
+beam_to_bin_record(const beam *b, const int oid, const int beamID,
+                   const int voffset, aper_bin_record *rec)
+{
+  int i;
+
+  memset(rec, 0, sizeof(aper_bin_record));
+
+  rec->objID       = oid;
+  rec->beamID      = beamID;
+  rec->ignore      = b->ignore;
+  rec->modspec     = b->modspec > -1 ? b->modspec : -1;
+  rec->modimage    = b->modimage > -1 ? b->modimage : -1;
+  rec->refpoint[0] = b->refpoint.x;
+  rec->refpoint[1] = b->refpoint.y;
+  for (i=0; i < 4; i++)
+    {
+      rec->corners[2*i]   = b->corners[i].x;
+      rec->corners[2*i+1] = b->corners[i].y;
+    }
+  rec->width  = b->width;
+  rec->orient = b->orient;
+  while (rec->orient > M_PI)
+    rec->orient = rec->orient - M_PI;
+
+  // the slit geometry is only valid
+  // for a first value > -1
+  if (b->slitgeom[0] > -1.0)
+    for (i=0; i < 4; i++)
+      rec->slitgeom[i] = b->slitgeom[i];
+  else
+    for (i=0; i < 4; i++)
+      rec->slitgeom[i] = -1.0;
+
+  // the shape and the fluxes
+  // exist for a positive width only
+  if (b->awidth > 0.0)
+    {
+      rec->awidth  = b->awidth;
+      rec->bwidth  = b->bwidth;
+      rec->aorient = sex_to_aper_angle(b->aorient);
+      rec->nflux   = b->flux != NULL ? b->flux->size : 0;
+    }
+  else
+    {
+      rec->awidth  = -1.0;
+      rec->bwidth  = -1.0;
+      rec->aorient = b->aorient;
+      rec->nflux   = 0;
+    }
+
+  rec->ntrace  = b->spec_trace->type + 1;
+  rec->voffset = voffset;
+}
+
+
+/**
+ * Function: object_list_to_binfile
+ * Dump an object aperture list into a binary aperture file.
+ * The file contains the same information as the text Aperture File
+ * written by 'object_list_to_file()' in fixed-size records, such that
+ * it can be read back without parsing (see 'binfile_to_object_list()').
+ *
+ * Parameters:
+ * @param oblist           - a point to an object list
+ * @param filename         - name of the file to write output
+ * @param leaveout_ignored - if ignore=1 beams are left out of the aper file
+ *
+ * Returns:
+ * @return num - number of beams written to the aperture file
+ */
+int
+object_list_to_binfile (object * const *oblist, char *filename,
+                        int leaveout_ignored)
+{
+  FILE *file;
+  object *const *obp;
+  const beam *b;
+
+  aper_bin_header header;
+  aper_bin_record *records;
+  double *values;
+
+  int nobjects=0;
+  int nbeams=0;
+  int nvalues=0;
+  int wrote_aper;
+  int i, ii;
+
+  // count the apertures, beams and values
+  for (obp = oblist; *obp; obp++)
+    {
+      wrote_aper = 0;
+      for (i = 0; i < (*obp)->nbeams; i++)
+        {
+          b = &((*obp)->beams[i]);
+          if ((leaveout_ignored) && (b->ignore == 1))
+            continue;
+
+          wrote_aper = 1;
+          nbeams++;
+          nvalues += b->spec_trace->type + 1;
+          if (b->awidth > 0.0 && b->flux != NULL)
+            nvalues += b->flux->size;
+        }
+      nobjects += wrote_aper;
+    }
+
+  // allocate the records and the values
+  records = (aper_bin_record *) malloc((nbeams > 0 ? nbeams : 1) * sizeof(aper_bin_record));
+  values  = (double *) malloc((nvalues > 0 ? nvalues : 1) * sizeof(double));
+  if (records == NULL || values == NULL)
+    aXe_message (aXe_M_FATAL, __FILE__, __LINE__,
+                 "object_list_to_binfile: Out of memory");
+
+  // fill the records and the values
+  nbeams  = 0;
+  nvalues = 0;
+  for (obp = oblist; *obp; obp++)
+    {
+      for (i = 0; i < (*obp)->nbeams; i++)
+        {
+          b = &((*obp)->beams[i]);
+          if ((leaveout_ignored) && (b->ignore == 1))
+            continue;
+
+          beam_to_bin_record(b, (*obp)->ID, i, nvalues, records + nbeams);
+
+          // the trace coefficients,
+          // followed by the flux values
+          for (ii=0; ii < records[nbeams].ntrace; ii++)
+            values[nvalues++] = ((double *)b->spec_trace->data)[ii+1];
+          for (ii=0; ii < records[nbeams].nflux; ii++)
+            values[nvalues++] = gsl_vector_get(b->flux, ii);
+
+          nbeams++;
+        }
+    }
+
+  // set up the header
+  memset(&header, 0, sizeof(aper_bin_header));
+  strncpy(header.magic, APER_BIN_MAGIC, sizeof(header.magic));
+  header.version  = APER_BIN_VERSION;
+  header.recsize  = sizeof(aper_bin_record);
+  header.nobjects = nobjects;
+  header.nbeams   = nbeams;
+  header.nvalues  = nvalues;
+
+  // open the output file;
+  // give error in case of problems
+  file = fopen (filename, "wb");
+  if (file==NULL)
+    {
+      aXe_message (aXe_M_FATAL, __FILE__, __LINE__, "Could not open %s", filename);
+    }
+
+  // write header, records and values
+  if (fwrite(&header, sizeof(aper_bin_header), 1, file) != 1
+      || fwrite(records, sizeof(aper_bin_record), nbeams, file) != (size_t)nbeams
+      || fwrite(values, sizeof(double), nvalues, file) != (size_t)nvalues)
+    aXe_message (aXe_M_FATAL, __FILE__, __LINE__,
+                 "Could not write to %s", filename);
+  fclose (file);
+
+  free(records);
+  free(values);
+
+  return nbeams;
+}
+
+
+/**
+ * Function: is_aper_binfile
+ * Checks whether a file is a binary aperture file
+ * as written by 'object_list_to_binfile()'.
+ *
+ * Parameters:
+ * @param filename - the name of the aperture file
+ *
+ * Returns:
+ * @return 1/0 - 1 for a binary aperture file, 0 otherwise
+ */
+int
+is_aper_binfile (char filename[])
+{
+  FILE *input;
+  char magic[8];
+  int is_bin=0;
+
+  input = fopen(filename, "rb");
+  if (input == NULL)
+    return 0;
+
+  // accept all binary identifiers, such that
+  // an unknown format is rejected on reading
+  if (fread(magic, sizeof(char), sizeof(magic), input) == sizeof(magic))
+    is_bin = !strncmp(magic, APER_BIN_PREFIX, strlen(APER_BIN_PREFIX));
+  fclose(input);
+
+  return is_bin;
+}
+
+
+/**
+ * Function: bin_record_to_beam
+ * Fill a beam structure with the content of a record
+ * from a binary aperture file.
+ *
+ * Parameters:
+ * @param rec    - the record
+ * @param values - the value block of the binary aperture file
+ * @param b      - the beam to fill
+ */
+static void
+bin_record_to_beam(const aper_bin_record *rec, const double *values, beam *b)
+{
+  gsl_vector *v;
+  int i;
+
+  b->ID         = rec->beamID;
+  b->ignore     = rec->ignore;
+  b->modspec    = rec->modspec;
+  b->modimage   = rec->modimage;
+  b->refpoint.x = rec->refpoint[0];
+  b->refpoint.y = rec->refpoint[1];
+  for (i=0; i < 4; i++)
+    {
+      b->corners[i].x = rec->corners[2*i];
+      b->corners[i].y = rec->corners[2*i+1];
+    }
+  b->width   = rec->width;
+  b->orient  = rec->orient;
+  b->awidth  = rec->awidth;
+  b->bwidth  = rec->bwidth;
+  b->aorient = rec->aorient;
+  for (i=0; i < 4; i++)
+    b->slitgeom[i] = rec->slitgeom[i];
+
+  // set up the trace
+  v = gsl_vector_alloc(rec->ntrace);
+  for (i=0; i < rec->ntrace; i++)
+    gsl_vector_set(v, i, values[rec->voffset + i]);
+  b->spec_trace = create_polyN(v);
+  gsl_vector_free(v);
+
+  // set up the flux values
+  b->flux = NULL;
+  if (rec->nflux > 0)
+    {
+      b->flux = gsl_vector_alloc(rec->nflux);
+      for (i=0; i < rec->nflux; i++)
+        gsl_vector_set(b->flux, i, values[rec->voffset + rec->ntrace + i]);
+    }
+
+  /* Set up the bounding box */
+  quad_to_bbox(b->corners, b->bbox, b->bbox + 1);
+}
+
+
+/**
+ * Function: binfile_to_object_list
+ * Read all apertures from a binary aperture file and return an array
+ * of object pointers. The file is memory-mapped, and the objects are
+ * set up directly from the beam records. The resulting object list
+ * is identical to the one read from the corresponding text Aperture
+ * File with 'file_to_object_list_seq()', apart from the precision
+ * lost when writing the text.
+ *
+ * Parameters:
+ * @param filename - the name of the binary aperture file.
+ * @param obs      - a pointer to an existing non NULL observation structure
+ *
+ * Returns:
+ * @return oblist - a newly allocated array of object pointers
+ */
+object **
+binfile_to_object_list (char filename[], observation * obs)
+{
+  const aper_bin_header *header;
+  const aper_bin_record *records;
+  const double *values;
+
+  object **oblist;
+  object *ob=NULL;
+
+  struct stat fstatus;
+  void *map;
+  size_t fsize;
+  int fd;
+  int i, nobjects=0;
+
+  // open and map the file
+  fd = open(filename, O_RDONLY);
+  if (fd < 0)
+    aXe_message(aXe_M_FATAL, __FILE__, __LINE__, "Could not open %s", filename);
+  if (fstat(fd, &fstatus) < 0 || fstatus.st_size < (off_t)sizeof(aper_bin_header))
+    aXe_message(aXe_M_FATAL, __FILE__, __LINE__,
+                "%s is not a binary aperture file", filename);
+  fsize = (size_t)fstatus.st_size;
+  map = mmap(NULL, fsize, PROT_READ, MAP_PRIVATE, fd, 0);
+  close(fd);
+  if (map == MAP_FAILED)
+    aXe_message(aXe_M_FATAL, __FILE__, __LINE__, "Could not map %s", filename);
+
+  // check the header against this build
+  header = (const aper_bin_header *) map;
+  if (strncmp(header->magic, APER_BIN_MAGIC, sizeof(header->magic))
+      || header->version != APER_BIN_VERSION
+      || header->recsize != (int)sizeof(aper_bin_record))
+    aXe_message(aXe_M_FATAL, __FILE__, __LINE__,
+                "The binary aperture file %s has an unknown format", filename);
+  if (fsize < sizeof(aper_bin_header)
+      + (size_t)header->nbeams * sizeof(aper_bin_record)
+      + (size_t)header->nvalues * sizeof(double))
+    aXe_message(aXe_M_FATAL, __FILE__, __LINE__,
+                "The binary aperture file %s is truncated", filename);
+
+  records = (const aper_bin_record *) (header + 1);
+  values  = (const double *) (records + header->nbeams);
+
+  // no aperture was found
+  if (header->nobjects < 1)
+    {
+      munmap(map, fsize);
+      return NULL;
+    }
+
+  /* Allocate memory for enough objects */
+  oblist = (object **) malloc((header->nobjects + 1) * sizeof(object *));
+
+  // the beams of an aperture
+  // are in consecutive records
+  for (i=0; i < header->nbeams; i++)
+    {
+      if (ob == NULL || records[i].objID != ob->ID)
+        {
+          if (nobjects >= header->nobjects)
+            aXe_message(aXe_M_FATAL, __FILE__, __LINE__,
+                        "The binary aperture file %s is corrupted", filename);
+          ob = malloc (sizeof (object));
+          ob->ID        = records[i].objID;
+          ob->nbeams    = 0;
+          ob->grism_obs = obs;
+          oblist[nobjects++] = ob;
+        }
+      if (ob->nbeams >= MAX_BEAMS)
+        aXe_message(aXe_M_FATAL, __FILE__, __LINE__,
+                    "The binary aperture file %s is corrupted", filename);
+      bin_record_to_beam(records + i, values, &(ob->beams[ob->nbeams++]));
+    }
+  oblist[nobjects] = NULL;
+
+  munmap(map, fsize);
+
+  // return the object list
+  return oblist;
+}
+
+
+/**
+ * Function: convert_oblist_aorient
+ * Convert the orientation of the maximum object width of all beams
+ * in an object list from the SExtractor reference frame to aXe's.
+ * This is the conversion done when writing and reading an Aperture
+ * File, and must be applied to object lists which are generated
+ * and used in memory.
+ *
+ * Parameters:
+ * @param oblist - the object list
+ */
+void
+convert_oblist_aorient (object **oblist)
+{
+  object **obp;
+  int i;
+
+  if (oblist == NULL)
+    return;
+
+  for (obp = oblist; *obp; obp++)
+    for (i = 0; i < (*obp)->nbeams; i++)
+      if ((*obp)->beams[i].awidth > 0.0)
+        (*obp)->beams[i].aorient = sex_to_aper_angle((*obp)->beams[i].aorient);
+}
+
+
 /**
  * Function: aper_file_apernum
  * A helper function which returns the number of time the keyword
@@ -913,6 +1341,8 @@ get_aperture_from_char_array (char **aper, int aperID)
  * keys in the Aperture File. It is faster than the more generic
  * file_to_object_list function. This function relies on the
  * from_char-array() functions.
+ * Binary aperture files are recognized and read
+ * with 'binfile_to_object_list()'.
  *
  * Parameters:
  * @param filename - the name of the aperture file.
@@ -928,6 +1358,10 @@ object ** file_to_object_list_seq(char filename[], observation * obs)
     int i, j, aperID;
     char **aper;
     FILE *input;
+    // read binary aperture files directly
+    if (is_aper_binfile(filename))
+      return binfile_to_object_list(filename, obs);
+
     l = aper_file_aperlist(filename);
     if (l==NULL)
       return NULL; // no aperture was found
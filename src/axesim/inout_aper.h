@@ -26,6 +26,53 @@
 
 #define APER_MAXLINE 14
 
+// identifier and version of the binary aperture file
+#define APER_BIN_MAGIC   "aXeOAFB"
+// leading part of the identifier, common to all binary formats
+#define APER_BIN_PREFIX  "aXeOAF"
+#define APER_BIN_VERSION 1
+
+/*
+ * The binary aperture file consists of the header, one fixed-size
+ * record per beam and a block of doubles with the trace coefficients
+ * and the flux values of all beams. All items are written in native
+ * byte order and are 8-byte aligned, such that the file can be
+ * memory-mapped and used without any parsing.
+ */
+typedef struct
+{
+  char magic[8];      // APER_BIN_MAGIC
+  int  version;       // APER_BIN_VERSION
+  int  recsize;       // size of one beam record
+  int  nobjects;      // number of apertures
+  int  nbeams;        // number of beam records
+  int  nvalues;       // number of doubles in the value block
+  int  reserved;      // keeps the records aligned
+}
+aper_bin_header;
+
+typedef struct
+{
+  double refpoint[2]; // reference point
+  double width;       // object width
+  double orient;      // object orientation [rad]
+  double awidth;      // maximum object width
+  double bwidth;      // minimum object width
+  double aorient;     // orientation of the maximum width [rad]
+  double slitgeom[4]; // slit geometry, angle in [rad]
+  int    objID;       // aperture ID
+  int    beamID;      // beam ID
+  int    ignore;      // ignore flag
+  int    modspec;     // index of the model spectrum
+  int    modimage;    // index of the model image
+  int    corners[8];  // corners of the aperture
+  int    ntrace;      // number of trace coefficients
+  int    nflux;       // number of flux values
+  int    voffset;     // offset of the trace coefficients and the
+                      // flux values in the value block
+}
+aper_bin_record;
+
 extern int
 nbeams_from_char_array2 (char **apers, int num);
 
@@ -36,6 +83,19 @@ extern int
 object_list_to_file (object * const *oblist, char *filename,
                      int leaveout_ignored);
 
+extern int
+object_list_to_binfile (object * const *oblist, char *filename,
+                        int leaveout_ignored);
+
+extern int
+is_aper_binfile (char filename[]);
+
+extern object **
+binfile_to_object_list (char filename[], observation * obs);
+
+extern void
+convert_oblist_aorient (object **oblist);
+
 extern int
 get_beam_from_aper_file (char *filename, int aperID, int beamID,beam * b);
 
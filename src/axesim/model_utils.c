@@ -9,6 +9,8 @@
  * @date    $Date: 2009/09/21 12:46:16 $
  */
 
+#include <stdlib.h>
+#include <string.h>
 #include <math.h>
 #include <fitsio.h>
 #include <gsl/gsl_matrix.h>
@@ -178,6 +180,551 @@ get_throughput_spec(beamspec *actspec, char CONF_file[])
   return resp;
 }
 
+/**
+ * Function: alloc_beam_cache
+ * The function allocates an empty cache for the
+ * dispersion solutions and sensitivity curves.
+ * The beams are loaded when first requested.
+ *
+ * The sensitivity tables are looked for in 'config_path';
+ * for NULL or an empty string the directory is taken
+ * from the environment variable AXE_CONFIG_PATH.
+ *
+ * Parameters:
+ * @param CONF_file   - the full filename of the configuration file
+ * @param config_path - the directory of the sensitivity tables
+ *
+ * Returns:
+ * @return cache    - the empty cache
+ */
+beam_cache *
+alloc_beam_cache(char CONF_file[], const char config_path[])
+{
+  beam_cache *cache;
+  int i;
+
+  cache = (beam_cache *)malloc(sizeof(beam_cache));
+  if (cache == NULL)
+    aXe_message (aXe_M_FATAL, __FILE__, __LINE__,
+                 "alloc_beam_cache:" " Could not allocate"
+                 " memory for a beam cache!");
+
+  strcpy(cache->CONF_file, CONF_file);
+  if (config_path != NULL)
+    strcpy(cache->config_path, config_path);
+  else
+    cache->config_path[0] = '\0';
+  for (i=0; i < MAX_BEAMS; i++)
+    {
+      cache->loaded[i]      = 0;
+      cache->for_grism[i]   = 0;
+      cache->n_order[i]     = 0;
+      cache->disp_coeffs[i] = NULL;
+      cache->pr_range[i]    = NULL;
+      cache->resp[i]        = NULL;
+    }
+  cache->n_loads = 0;
+  cache->n_calib = 0;
+  cache->n_resp  = 0;
+
+  return cache;
+}
+
+/**
+ * Function: load_beam_cache
+ * The function loads the dispersion solution and the
+ * sensitivity curve of a beam into the cache.
+ *
+ * Parameters:
+ * @param cache  - the cache
+ * @param beamID - the beam to load
+ */
+static void
+load_beam_cache(beam_cache *cache, const int beamID)
+{
+  char through_file[MAXCHAR];
+  char through_file_path[MAXCHAR];
+  gsl_vector *v;
+  float n;
+  int order;
+
+  if (beamID < 0 || beamID >= MAX_BEAMS)
+    aXe_message (aXe_M_FATAL, __FILE__, __LINE__,
+                 "load_beam_cache: beam ID %i out of range!", beamID);
+
+  // look whether we are for grisms or prisms
+  cache->for_grism[beamID] = check_for_grism (cache->CONF_file, beamID);
+
+  // load the 2D field dependent
+  // coefficients of all orders
+  cache->n_order[beamID] = get_beam_disp_norder (cache->CONF_file, beamID);
+  cache->disp_coeffs[beamID] = (gsl_vector **)malloc((cache->n_order[beamID]+1)*sizeof(gsl_vector *));
+  for (order=0; order < cache->n_order[beamID]+1; order++)
+    {
+      v = get_beam_disp_order (cache->CONF_file, cache->for_grism[beamID], beamID, order);
+      n = 0.5 * (-1.0 + sqrt (1 + 8 * v->size));
+      if ((floor (n) - n) != 0)
+        aXe_message (aXe_M_FATAL, __FILE__, __LINE__,
+                     "load_beam_cache: "
+                     "Order %d of Beam %d in %s does not contain a correct number of entries (i.e. "
+                     "1,3,6,10,15...,n^2/2+n/2", order, beamID, cache->CONF_file);
+      cache->disp_coeffs[beamID][order] = v;
+    }
+  if (!cache->for_grism[beamID])
+    cache->pr_range[beamID] = get_prange (cache->CONF_file, beamID);
+
+  // load the sensitivity curve
+  get_troughput_table_name(cache->CONF_file, beamID, through_file);
+  if (strlen(cache->config_path) > 0)
+    sprintf(through_file_path, "%s/%s", cache->config_path, through_file);
+  else
+    build_path (AXE_CONFIG_PATH, through_file, through_file_path);
+  cache->resp[beamID] = get_response_function_from_FITS(through_file_path,2);
+
+  cache->loaded[beamID] = 1;
+  cache->n_loads++;
+}
+
+/**
+ * Function: get_calib_function_cached
+ * Cached version of 'get_calib_function()'. The dispersion
+ * coefficients are evaluated at the object position with
+ * the same arithmetics as in 'get_disp_coeff_at_pos()'.
+ *
+ * Parameters:
+ * @param cache   - the cache
+ * @param actspec - the model spectrum this is done for
+ * @param actdir  - the direct object of the model spectrum
+ * @param conf    - the configuration structure
+ *
+ * Returns:
+ * @return wl_calibration - the wavelength calibration
+ */
+calib_function *
+get_calib_function_cached(beam_cache *cache, beamspec *actspec, dirobject *actdir,
+                          const aperture_conf * conf)
+{
+  calib_function *wl_calibration;
+  gsl_vector *pol;
+  gsl_vector *v;
+  d_point pixel;
+  float n, c, res;
+  int beamID;
+  int order, i, j, k;
+
+  beamID = actspec->beamID;
+  if (beamID < 0 || beamID >= MAX_BEAMS || !cache->loaded[beamID])
+    load_beam_cache(cache, beamID);
+  cache->n_calib++;
+
+  // get the reference point right
+  pixel.x = actdir->refpoint.x - conf->refx;
+  pixel.y = actdir->refpoint.y - conf->refy;
+
+  // evaluate the coefficients at the position
+  pol = gsl_vector_alloc (cache->n_order[beamID] + 1);
+  for (order=0; order < cache->n_order[beamID]+1; order++)
+    {
+      v = cache->disp_coeffs[beamID][order];
+      n = 0.5 * (-1.0 + sqrt (1 + 8 * v->size));
+      i = 0;
+      res = 0;
+      for (j = 0; j < n; j++)
+        {
+          for (k = 0; k < (j + 1); k++)
+            {
+              c = gsl_vector_get (v, i);
+              res = res + c * pow (pixel.x, (j - k)) * pow (pixel.y, k);
+              i++;
+            }
+        }
+      gsl_vector_set (pol, order, res);
+    }
+
+  // transform the coefficients into the
+  // wavelength calibration
+  wl_calibration = create_calib_from_gsl_vector(cache->for_grism[beamID], pol);
+  if (!cache->for_grism[beamID])
+    {
+      wl_calibration->pr_range = gsl_vector_alloc(cache->pr_range[beamID]->size);
+      gsl_vector_memcpy(wl_calibration->pr_range, cache->pr_range[beamID]);
+    }
+
+  gsl_vector_free(pol);
+
+  // return the wavelength calibration
+  return wl_calibration;
+}
+
+/**
+ * Function: get_throughput_spec_cached
+ * Cached version of 'get_throughput_spec()'. The
+ * sensitivity curve belongs to the cache and must
+ * not be released.
+ *
+ * Parameters:
+ * @param cache   - the cache
+ * @param actspec - the model spectrum this is done for
+ *
+ * Returns:
+ * @return resp   - the response function as a spectrum structure
+ */
+const spectrum *
+get_throughput_spec_cached(beam_cache *cache, beamspec *actspec)
+{
+  if (actspec->beamID < 0 || actspec->beamID >= MAX_BEAMS || !cache->loaded[actspec->beamID])
+    load_beam_cache(cache, actspec->beamID);
+  cache->n_resp++;
+
+  return cache->resp[actspec->beamID];
+}
+
+/**
+ * Function: print_beam_cache_stats
+ * The function reports the usage of the cache,
+ * i.e. how many loads of the configuration file
+ * and the sensitivity tables were avoided.
+ *
+ * Parameters:
+ * @param cache - the cache
+ * @param task  - the name of the task for the report
+ */
+void
+print_beam_cache_stats(const beam_cache *cache, const char *task)
+{
+  fprintf(stdout, "%s: beam cache: %li beams loaded, %li dispersion solutions "
+          "and %li sensitivity curves requested, %li loads avoided.\n",
+          task, cache->n_loads, cache->n_calib, cache->n_resp,
+          cache->n_calib + cache->n_resp - 2*cache->n_loads);
+}
+
+/**
+ * Function: free_beam_cache
+ * Releases the memory of a cache.
+ *
+ * Parameters:
+ * @param cache - the cache
+ */
+void
+free_beam_cache(beam_cache *cache)
+{
+  int i, order;
+
+  if (cache == NULL)
+    return;
+
+  for (i=0; i < MAX_BEAMS; i++)
+    {
+      if (!cache->loaded[i])
+        continue;
+      for (order=0; order < cache->n_order[i]+1; order++)
+        gsl_vector_free(cache->disp_coeffs[i][order]);
+      free(cache->disp_coeffs[i]);
+      if (cache->pr_range[i] != NULL)
+        gsl_vector_free(cache->pr_range[i]);
+      free_spectrum(cache->resp[i]);
+    }
+  free(cache);
+}
+
+/**
+ * Function: alloc_ekernel_cache
+ * The function allocates an empty cache for emission kernels.
+ * For a tolerance of 0.0 only objects with identical shape
+ * and sub-pixel phase share a kernel. Otherwise the widths
+ * and the phase are quantized in steps of 'tolerance' pixels,
+ * the orientation such that the shift at the major width
+ * is within the tolerance.
+ *
+ * Parameters:
+ * @param tolerance - the quantization tolerance [pixel]
+ *
+ * Returns:
+ * @return kcache   - the empty cache
+ */
+ekernel_cache *
+alloc_ekernel_cache(const double tolerance)
+{
+  ekernel_cache *kcache;
+  int i;
+
+  kcache = (ekernel_cache *)malloc(sizeof(ekernel_cache));
+  if (kcache == NULL)
+    aXe_message (aXe_M_FATAL, __FILE__, __LINE__,
+                 "alloc_ekernel_cache:" " Could not allocate"
+                 " memory for a kernel cache!");
+
+  kcache->tolerance = tolerance > 0.0 ? tolerance : 0.0;
+  for (i=0; i < EKERNEL_NBUCKETS; i++)
+    kcache->buckets[i] = NULL;
+  kcache->n_values  = 0;
+  kcache->n_kernels = 0;
+  kcache->n_hits    = 0;
+  kcache->n_full    = 0;
+
+  return kcache;
+}
+
+/**
+ * Function: quantize_value
+ * The function rounds a value to a multiple of a step.
+ * Nothing is done for a step of 0.0.
+ */
+static double
+quantize_value(const double value, const double step)
+{
+  if (step <= 0.0)
+    return value;
+  return floor(value / step + 0.5) * step;
+}
+
+/**
+ * Function: hash_ekernel_key
+ * The function computes the hash bucket for a kernel key.
+ */
+static int
+hash_ekernel_key(const double key[])
+{
+  unsigned long long bits;
+  unsigned long long hash=14695981039346656037ULL;
+  int i;
+
+  for (i=0; i < 5; i++)
+    {
+      memcpy(&bits, &key[i], sizeof(double));
+      hash = (hash ^ bits) * 1099511628211ULL;
+    }
+  return (int)((hash ^ (hash >> 32)) % EKERNEL_NBUCKETS);
+}
+
+/**
+ * Function: make_emission_kernel
+ * The function computes an emission kernel for the
+ * (quantized) shape parameters in the key.
+ *
+ * Parameters:
+ * @param key - widths, orientation and sub-pixel phase
+ * @param hx  - half size of the stamp in x
+ * @param hy  - half size of the stamp in y
+ *
+ * Returns:
+ * @return kernel - the emission kernel
+ */
+static emission_kernel *
+make_emission_kernel(const double key[], const int hx, const int hy)
+{
+  emission_kernel *kernel;
+  beam qbeam;
+  d_point dpixel;
+  d_point unit_scale;
+  int kx, ky;
+
+  kernel = (emission_kernel *)malloc(sizeof(emission_kernel));
+  if (kernel == NULL)
+    aXe_message (aXe_M_FATAL, __FILE__, __LINE__,
+                 "make_emission_kernel:" " Could not allocate"
+                 " memory for an emission kernel!");
+  kernel->values = (double *)malloc((2*hx+1) * (2*hy+1) * sizeof(double));
+  if (kernel->values == NULL)
+    aXe_message (aXe_M_FATAL, __FILE__, __LINE__,
+                 "make_emission_kernel:" " Could not allocate"
+                 " memory for an emission kernel of %ix%i pixels!", 2*hx+1, 2*hy+1);
+  memcpy(kernel->key, key, 5*sizeof(double));
+  kernel->hx   = hx;
+  kernel->hy   = hy;
+  kernel->next = NULL;
+
+  // the beam at the quantized parameters,
+  // located at the sub-pixel phase
+  qbeam.awidth     = key[0];
+  qbeam.bwidth     = key[1];
+  qbeam.aorient    = key[2];
+  qbeam.refpoint.x = key[3];
+  qbeam.refpoint.y = key[4];
+  unit_scale.x = 1.0;
+  unit_scale.y = 1.0;
+
+  for (ky=-hy; ky <= hy; ky++)
+    {
+      for (kx=-hx; kx <= hx; kx++)
+        {
+          dpixel.x = (double)kx;
+          dpixel.y = (double)ky;
+          kernel->values[(ky+hy)*(2*hx+1) + kx+hx] =
+            get_sub_emodel_value(dpixel, qbeam, unit_scale);
+        }
+    }
+
+  return kernel;
+}
+
+/**
+ * Function: get_emission_kernel
+ * The function returns the emission kernel for a beam
+ * of a direct object. The kernel is taken from the cache
+ * or computed and stored in the cache. The stamp covers
+ * the area of the direct object. NULL is returned if
+ * the cache is full, then the emission must be computed
+ * directly. Lookups and insertions are serialized, such that
+ * the cache can be shared among threads.
+ *
+ * Parameters:
+ * @param kcache  - the kernel cache
+ * @param actbeam - the beam
+ * @param actdir  - the direct object
+ *
+ * Returns:
+ * @return kernel - the emission kernel (owned by the cache)
+ */
+const emission_kernel *
+get_emission_kernel(ekernel_cache *kcache, const beam actbeam,
+                    const dirobject *actdir)
+{
+  emission_kernel *kernel=NULL;
+  double key[5];
+  double ix0, iy0;
+  int hx, hy;
+  int ibucket;
+  int store=1;
+
+  // the widths in the image, the orientation
+  // and the sub-pixel phase of the refpoint
+  ix0    = floor(actbeam.refpoint.x);
+  iy0    = floor(actbeam.refpoint.y);
+  key[0] = actbeam.awidth / actdir->drzscale.x;
+  key[1] = actbeam.bwidth / actdir->drzscale.y;
+  key[2] = actbeam.aorient;
+  key[3] = actbeam.refpoint.x - ix0;
+  key[4] = actbeam.refpoint.y - iy0;
+
+  // quantize the parameters
+  if (kcache->tolerance > 0.0)
+    {
+      key[0] = MAX(quantize_value(key[0], kcache->tolerance), kcache->tolerance);
+      key[1] = MAX(quantize_value(key[1], kcache->tolerance), kcache->tolerance);
+      key[2] = quantize_value(key[2], kcache->tolerance / MAX(key[0], key[1]));
+      key[3] = quantize_value(key[3], kcache->tolerance);
+      key[4] = quantize_value(key[4], kcache->tolerance);
+    }
+
+  // the stamp must cover the direct object
+  hx = (int)MAX(ix0 - (double)actdir->ix_min, (double)actdir->ix_max - ix0);
+  hy = (int)MAX(iy0 - (double)actdir->iy_min, (double)actdir->iy_max - iy0);
+  hx = MAX(hx, 0);
+  hy = MAX(hy, 0);
+
+  ibucket = hash_ekernel_key(key);
+
+#pragma omp critical (axe_ekernel_cache)
+  {
+    for (kernel=kcache->buckets[ibucket]; kernel != NULL; kernel=kernel->next)
+      if (!memcmp(kernel->key, key, 5*sizeof(double)) && kernel->hx >= hx && kernel->hy >= hy)
+        break;
+    if (kernel != NULL)
+      kcache->n_hits++;
+    else if (kcache->n_values + (long)(2*hx+1)*(long)(2*hy+1) > EKERNEL_MAXVALUES)
+      {
+        kcache->n_full++;
+        store=0;
+      }
+  }
+  if (kernel != NULL || !store)
+    return kernel;
+
+  // compute the kernel outside of the
+  // critical section and store it
+  kernel = make_emission_kernel(key, hx, hy);
+#pragma omp critical (axe_ekernel_cache)
+  {
+    kernel->next = kcache->buckets[ibucket];
+    kcache->buckets[ibucket] = kernel;
+    kcache->n_values += (long)(2*hx+1)*(long)(2*hy+1);
+    kcache->n_kernels++;
+  }
+
+  return kernel;
+}
+
+/**
+ * Function: get_kernel_emission
+ * The function returns the emission value at a pixel
+ * from an emission kernel. Outside of the stamp, the
+ * value is computed directly with 'get_sub_emodel_value()'.
+ *
+ * Parameters:
+ * @param kernel   - the emission kernel
+ * @param dpixel   - the pixel
+ * @param actbeam  - the beam
+ * @param drzscale - the relative pixelscale at the model position
+ *
+ * Returns:
+ * @return sval    - the value of the emission model
+ */
+double
+get_kernel_emission(const emission_kernel *kernel, const d_point dpixel,
+                    const beam actbeam, const d_point drzscale)
+{
+  int kx, ky;
+
+  kx = (int)floor(dpixel.x) - (int)floor(actbeam.refpoint.x);
+  ky = (int)floor(dpixel.y) - (int)floor(actbeam.refpoint.y);
+
+  if (kx < -kernel->hx || kx > kernel->hx || ky < -kernel->hy || ky > kernel->hy)
+    return get_sub_emodel_value(dpixel, actbeam, drzscale);
+
+  return kernel->values[(ky+kernel->hy)*(2*kernel->hx+1) + kx+kernel->hx];
+}
+
+/**
+ * Function: print_ekernel_cache_stats
+ * The function reports the usage of the kernel cache.
+ *
+ * Parameters:
+ * @param kcache - the kernel cache
+ * @param task   - the name of the task for the report
+ */
+void
+print_ekernel_cache_stats(const ekernel_cache *kcache, const char *task)
+{
+  long n_requests;
+
+  n_requests = kcache->n_kernels + kcache->n_hits + kcache->n_full;
+  fprintf(stdout, "%s: kernel cache: %li kernels requested, %li computed, "
+          "%li re-used (hit rate %.1f%%), %li not stored; tolerance %g pixel.\n",
+          task, n_requests, kcache->n_kernels, kcache->n_hits,
+          n_requests > 0 ? 100.0 * (double)kcache->n_hits / (double)n_requests : 0.0,
+          kcache->n_full, kcache->tolerance);
+}
+
+/**
+ * Function: free_ekernel_cache
+ * Releases the memory of a kernel cache.
+ *
+ * Parameters:
+ * @param kcache - the kernel cache
+ */
+void
+free_ekernel_cache(ekernel_cache *kcache)
+{
+  emission_kernel *kernel;
+  emission_kernel *next;
+  int i;
+
+  if (kcache == NULL)
+    return;
+
+  for (i=0; i < EKERNEL_NBUCKETS; i++)
+    {
+      for (kernel=kcache->buckets[i]; kernel != NULL; kernel=next)
+        {
+          next = kernel->next;
+          free(kernel->values);
+          free(kernel);
+        }
+    }
+  free(kcache);
+}
+
 /**
  * Function: compute_tracedata
  * The function creates a tracedata structure for a specific
@@ -1405,23 +1952,20 @@ get_dirobject_from_list(dirobject ** dirlist, const int ID)
 {
 
   //dirobject * actdir;
-  int i, ndirs = 0;
-
-  // count the number of dirobjects in the list
-  while (dirlist[ndirs] != NULL)
-    ndirs++;
+  int i = 0;
 
   // loop over all dirobject
-  for (i = 0; i < ndirs; i++)
+  while (dirlist[i] != NULL)
     {
       // try to identify a dirobject,
       // return it in case of a postitive identification
       if (dirlist[i]->ID == ID)
         return dirlist[i];
+      i++;
     }
 
   // return the NULL-dirobject at the end of the list
-  return dirlist[ndirs];
+  return dirlist[i];
 }
 
 /**
@@ -1504,6 +2048,279 @@ get_beam_for_beamspec(object **oblist, const int nobjects,
   return actbeam;
 }
 
+/**
+ * Function: compare_id_pos
+ * Comparison function for qsort to order
+ * ID-position pairs after ID and position.
+ */
+static int
+compare_id_pos(const void *a, const void *b)
+{
+  const int *pa = (const int *)a;
+  const int *pb = (const int *)b;
+
+  if (pa[0] != pb[0])
+    return pa[0] < pb[0] ? -1 : 1;
+  if (pa[1] != pb[1])
+    return pa[1] < pb[1] ? -1 : 1;
+  return 0;
+}
+
+/**
+ * Function: make_id_index
+ * The function creates an index from a vector
+ * of IDs given in list order.
+ *
+ * Parameters:
+ * @param  IDs - the IDs in list order
+ * @param  n   - the number of IDs
+ *
+ * Returns:
+ * @return idx - the index
+ */
+static id_index *
+make_id_index(const int *IDs, const int n)
+{
+  id_index *idx;
+  int *pairs;
+  int i;
+
+  idx = (id_index *) malloc(sizeof(id_index));
+  idx->IDs = (int *) malloc((n > 0 ? n : 1) * sizeof(int));
+  idx->pos = (int *) malloc((n > 0 ? n : 1) * sizeof(int));
+  pairs    = (int *) malloc((n > 0 ? 2*n : 1) * sizeof(int));
+  if (idx->IDs == NULL || idx->pos == NULL || pairs == NULL)
+    aXe_message (aXe_M_FATAL, __FILE__, __LINE__,
+                 "make_id_index: Could not allocate memory for %i IDs", n);
+  idx->n = n;
+
+  // sort the ID-position pairs; with identical
+  // IDs, the list order is preserved
+  for (i = 0; i < n; i++)
+    {
+      pairs[2*i]   = IDs[i];
+      pairs[2*i+1] = i;
+    }
+  qsort(pairs, n, 2*sizeof(int), compare_id_pos);
+
+  for (i = 0; i < n; i++)
+    {
+      idx->IDs[i] = pairs[2*i];
+      idx->pos[i] = pairs[2*i+1];
+    }
+
+  free(pairs);
+
+  return idx;
+}
+
+/**
+ * Function: index_oblist
+ * The function creates an ID index for an object list.
+ *
+ * Parameters:
+ * @param  oblist - the NULL terminated object list
+ *
+ * Returns:
+ * @return idx    - the index
+ */
+id_index *
+index_oblist(object **oblist)
+{
+  id_index *idx;
+  int *IDs;
+  int i, n = 0;
+
+  while (oblist != NULL && oblist[n] != NULL)
+    n++;
+
+  IDs = (int *) malloc((n > 0 ? n : 1) * sizeof(int));
+  for (i = 0; i < n; i++)
+    IDs[i] = oblist[i]->ID;
+
+  idx = make_id_index(IDs, n);
+  free(IDs);
+
+  return idx;
+}
+
+/**
+ * Function: index_dirlist
+ * The function creates an ID index for a dirobject list.
+ *
+ * Parameters:
+ * @param  dirlist - the NULL terminated dirobject list
+ *
+ * Returns:
+ * @return idx     - the index
+ */
+id_index *
+index_dirlist(dirobject **dirlist)
+{
+  id_index *idx;
+  int *IDs;
+  int i, n = 0;
+
+  while (dirlist[n] != NULL)
+    n++;
+
+  IDs = (int *) malloc((n > 0 ? n : 1) * sizeof(int));
+  for (i = 0; i < n; i++)
+    IDs[i] = dirlist[i]->ID;
+
+  idx = make_id_index(IDs, n);
+  free(IDs);
+
+  return idx;
+}
+
+/**
+ * Function: lower_bound_id
+ * The function finds by bisection the first
+ * index entry with an ID not smaller than
+ * the given ID.
+ *
+ * Parameters:
+ * @param  idx - the index
+ * @param  ID  - the ID to find
+ *
+ * Returns:
+ * @return lo  - the index entry
+ */
+static int
+lower_bound_id(const id_index *idx, const int ID)
+{
+  int lo = 0;
+  int hi = idx->n;
+  int mid;
+
+  while (lo < hi)
+    {
+      mid = lo + (hi - lo) / 2;
+      if (idx->IDs[mid] < ID)
+        lo = mid + 1;
+      else
+        hi = mid;
+    }
+
+  return lo;
+}
+
+/**
+ * Function: find_in_id_index
+ * The function finds an ID in an index.
+ * For IDs which occur several times the
+ * first list entry is returned, as in a
+ * linear search.
+ *
+ * Parameters:
+ * @param  idx - the index
+ * @param  ID  - the ID to find
+ *
+ * Returns:
+ * @return pos - the list position of the ID, -1 if not found
+ */
+int
+find_in_id_index(const id_index *idx, const int ID)
+{
+  int k;
+
+  k = lower_bound_id(idx, ID);
+  if (k < idx->n && idx->IDs[k] == ID)
+    return idx->pos[k];
+
+  return -1;
+}
+
+/**
+ * Function: free_id_index
+ * Releases the memory of an index.
+ *
+ * Parameters:
+ * @param  idx - the index
+ */
+void
+free_id_index(id_index *idx)
+{
+  if (idx == NULL)
+    return;
+  free(idx->IDs);
+  free(idx->pos);
+  free(idx);
+}
+
+/**
+ * Function: get_dirobject_from_index
+ * Indexed version of 'get_dirobject_from_list()'.
+ *
+ * Parameters:
+ * @param  dirlist   - the dirobject list
+ * @param  diridx    - the index of the dirobject list
+ * @param  ID        - the ID number to be identified
+ *
+ * Returns:
+ * @return dirobject - the identified dirobject or the 'NULL'-dirobject
+ */
+dirobject *
+get_dirobject_from_index(dirobject ** dirlist, const id_index *diridx, const int ID)
+{
+  int pos;
+
+  pos = find_in_id_index(diridx, ID);
+  if (pos < 0)
+    // return the NULL-dirobject at the end of the list
+    return dirlist[diridx->n];
+
+  return dirlist[pos];
+}
+
+/**
+ * Function: get_beam_for_beamspec_index
+ * Indexed version of 'get_beam_for_beamspec()'.
+ * As there, the last matching beam is returned
+ * if an object ID occurs several times.
+ *
+ * Parameters:
+ * @param oblist   - the object list to identify a beam from
+ * @param obidx    - the index of the object list
+ * @param actspec  - the model spectrum to identify a beam for
+ *
+ * @return actbeam - the identified beam
+ */
+beam
+get_beam_for_beamspec_index(object **oblist, const id_index *obidx,
+                            const beamspec *actspec)
+{
+  beam actbeam;
+
+  int i, j, k;
+
+  // set the beam ID to -1 to identify
+  // failed identification
+  actbeam.ID = -1;
+
+  // go over all objects with the ID,
+  // they are in list order in the index
+  for (k = lower_bound_id(obidx, actspec->objectID);
+       k < obidx->n && obidx->IDs[k] == actspec->objectID; k++)
+    {
+      i = obidx->pos[k];
+
+      // search for a matching beam ID
+      for (j=0; j < oblist[i]->nbeams; j++)
+        if (oblist[i]->beams[j].ID == actspec->beamID)
+          actbeam = oblist[i]->beams[j];
+    }
+
+  // report an error in case that the identification failed
+  if (actbeam.ID == -1)
+    aXe_message(aXe_M_FATAL, __FILE__, __LINE__,
+                "aXe_PETCONT: " "object ID %i, Beam %c not found\n", actspec->objectID, BEAM(actspec->beamID));
+
+  // return the identified beam
+  return actbeam;
+}
+
 /**
  * Function: get_beamspec_from_list
  * The functions extracts and returns a specific model beam
@@ -1952,117 +2769,199 @@ get_flambda_from_magab(double mag, double lambda)
 }
 
 /*
- * Function: fill_gaussvalues
- * The function determines the wavelength dependent emission
- * for a given object at a given point in the gaussian emission model.
- * The values are filled into the
- * according vector of the tracedata structure.
+ * Function: compute_psf_table
+ * The function computes the widths of the gaussian emission
+ * model at all points of a trace. The psf-modification with
+ * wavelength (PSFCOEFFS, PSFRANGE) and the psf-offset are
+ * evaluated only once per beam, and the table is then used
+ * for all pixels of the direct object in 'fill_gaussvalues()'.
+ * NULL is returned if the emission model does not depend
+ * on wavelength.
  *
  * Parameters:
- * @param dpixel      - the coordinates of the point
  * @param actbeam     - the beam to derive
  * @param actdir      - the direct object
  * @param lambda_ref  - the reference wavelength
  * @param conf        - the configuration structure
+ * @param psf_offset  - the psf-offset of the beam
  * @param acttrace    - the tracedata structure
  *
+ * Returns:
+ * @return ptable     - the table of widths
  */
-void
-fill_gaussvalues(const d_point dpixel, const beam actbeam,
-                 const dirobject *actdir, const double lambda_ref,
-                 const aperture_conf *conf, const double psf_offset,
-                 tracedata *acttrace)
+psf_table *
+compute_psf_table(const beam actbeam, const dirobject *actdir,
+                  const double lambda_ref, const aperture_conf *conf,
+                  const double psf_offset, const tracedata *acttrace)
 {
+  psf_table *ptable;
+
   beam new_beam;
 
   double dpsf=0.0;
-  //double gval=0.0;
   double lambda=0.0;
-  //double factor=0.0;
-  //double nom=0.0;
-  //double denom=0.0;
 
   int i=0;
   int minpsf_flagg=0;
 
-  // get the acurate emission value with subgridding
-  //gval   = get_sub_emodel_value(dpixel, actbeam, actdir->drzscale);
-  //fprintf(stdout, "gvalue: %e %f %f", gval, actdir->drzscale.x, actdir->drzscale.y);
+  // check whether the emission
+  // depends on wavelength at all
+  if (!((conf->psfcoeffs && conf->psfrange) || psf_offset))
+    return NULL;
+
+  // allocate the table
+  ptable = (psf_table *) malloc(sizeof(psf_table));
+  if (ptable == NULL)
+    aXe_message (aXe_M_FATAL, __FILE__, __LINE__,
+                 "compute_psf_table: Could not allocate memory!");
 
-  //  0: fastest scenario: fill the vector with
-  //     identical values: 34s
-  //  gsl_vector_set_all(acttrace->gvalue, i, gval);
+  ptable->npoints  = acttrace->npoints;
+  ptable->refpoint = actbeam.refpoint;
+  ptable->cosa     = cos(actbeam.aorient);
+  ptable->sina     = sin(actbeam.aorient);
 
+  ptable->amod = (double *) malloc(acttrace->npoints * sizeof(double));
+  ptable->bmod = (double *) malloc(acttrace->npoints * sizeof(double));
+  ptable->norm = (double *) malloc(acttrace->npoints * sizeof(double));
 
-  // 1: iterate over the vector and enter the same
-  //    value: 35s
-  if (conf->psfrange && conf->psfcoeffs)
+  // the subsampling grid of 'get_sub_emodel_value()'
+  ptable->nsub = 4 * (int)NSUB * (int)NSUB;
+  ptable->usub = (double *) malloc(ptable->nsub * sizeof(double));
+  ptable->vsub = (double *) malloc(ptable->nsub * sizeof(double));
+
+  if (!ptable->amod || !ptable->bmod || !ptable->norm || !ptable->usub || !ptable->vsub)
+    aXe_message (aXe_M_FATAL, __FILE__, __LINE__,
+                 "compute_psf_table: Could not allocate memory for %i points!",
+                 acttrace->npoints);
+
+  // go over all tracedata (that means wavelength) points
+  for (i=0; i < acttrace->npoints; i++)
     {
-      // go over all tracedata (that means wavelength) points
-      for (i=0; i < acttrace->npoints; i++)
+      // derive the correction of the psf at the wavelength
+      dpsf = psf_offset;
+      if (conf->psfrange && conf->psfcoeffs)
         {
-          // derive the wavelength
           lambda = gsl_vector_get(acttrace->lambda, i)/10.0;
-
-          // derive the correction of the psf at the wavelength
-
-          // 3: calculating the psf-offset: 90s
           dpsf   = psf_offset + get_dpsf(lambda_ref, lambda, conf, actbeam);
-          //      dpsf=0.0;
-          //fprintf(stdout, "dpsf: %f", dpsf);
-
-
-          // derive a beam with the correct widths at the wavelength
-
-          // 2: creating a new beam with a different size: 50s
-          new_beam = get_newbeam(actbeam,dpsf);
-
-          // transport the
-          if (new_beam.ID)
-            minpsf_flagg=1;
-
-          // derive the correction factor for the emission using the correct widths
-          // 4: computing the correction factor for the wavelength: 255s
-          //factor = get_emodel_value(dpixel,new_beam,actdir->drzscale)/get_emodel_value(dpixel,actbeam,actdir->drzscale);
-          //nom = get_emodel_value(dpixel,new_beam,actdir->drzscale);
-          //denom = get_emodel_value(dpixel,actbeam,actdir->drzscale);
-          //if (nom != 0.0 && denom != 0.0)
-          //  factor = nom / denom;
-          //else
-          //  factor = 1.0;
-          //fprintf(stdout, "factor: %f ", factor);
-
-          // store the emission value, taking into account the correction
-          //gsl_vector_set(acttrace->gvalue, i, gval*factor);
-          gsl_vector_set_all(acttrace->gvalue, get_sub_emodel_value(dpixel, new_beam, actdir->drzscale));
-          //fprintf(stdout, "gvalue * factor: %e ", gval*factor);
-          }
-    }
-  else
-    {
+        }
+
       // derive a beam with the correct widths at the wavelength
-      new_beam = get_newbeam(actbeam,psf_offset);
+      new_beam = get_newbeam(actbeam,dpsf);
       if (new_beam.ID)
         minpsf_flagg=1;
 
-      // derive the correction factor for the emission using the correct widths
-      //factor = get_emodel_value(dpixel,new_beam,actdir->drzscale)/get_emodel_value(dpixel,actbeam,actdir->drzscale);
-      //nom = get_emodel_value(dpixel,new_beam,actdir->drzscale);
-      //denom = get_emodel_value(dpixel,actbeam,actdir->drzscale);
-      //if (nom != 0.0 && denom != 0.0)
-      //  factor = nom / denom;
-      //else
-      //  factor = 1.0;
-
-      // store the emission value, taking into account the correction
-      //gsl_vector_set_all(acttrace->gvalue, gval*factor);
-      gsl_vector_set_all(acttrace->gvalue, get_sub_emodel_value(dpixel, new_beam, actdir->drzscale));
-
+      // store the widths and the normalization
+      // as used in 'get_emodel_value()'
+      ptable->amod[i] = new_beam.awidth / actdir->drzscale.x;
+      ptable->bmod[i] = new_beam.bwidth / actdir->drzscale.y;
+      ptable->norm[i] = 0.5/(ptable->amod[i]*ptable->bmod[i]*M_PI);
     }
+
   if (minpsf_flagg)
     aXe_message (aXe_M_WARN4, __FILE__, __LINE__,
                  "\naXe_PETCONT: points in PSF of object %i beam %c smaller than PSF_MIN=%f! Set to PSF_MIN\n", actdir->ID, BEAM(actbeam.ID), MINPSF);
 
+  return ptable;
+}
+
+/*
+ * Function: free_psf_table
+ * The function releases the memory of a psf table.
+ *
+ * Parameters:
+ * @param ptable - the table to be freed
+ */
+void
+free_psf_table(psf_table *ptable)
+{
+  if (ptable == NULL)
+    return;
+
+  free(ptable->amod);
+  free(ptable->bmod);
+  free(ptable->norm);
+  free(ptable->usub);
+  free(ptable->vsub);
+  free(ptable);
+}
+
+/*
+ * Function: fill_gaussvalues
+ * The function determines the wavelength dependent emission
+ * for a given object at a given point in the gaussian emission model.
+ * The values are filled into the
+ * according vector of the tracedata structure.
+ * The emission at each trace point is identical to
+ * 'get_sub_emodel_value()' for the beam with the widths
+ * at the wavelength of the point. The subsampling positions
+ * are rotated only once for all trace points, and points
+ * with the same widths as their predecessor re-use its value.
+ *
+ * Parameters:
+ * @param dpixel      - the coordinates of the point
+ * @param ptable      - the widths along the trace
+ * @param acttrace    - the tracedata structure
+ *
+ */
+void
+fill_gaussvalues(const d_point dpixel, psf_table *ptable,
+                 tracedata *acttrace)
+{
+  double sval   = 0.0;
+  double step   = 0.0;
+  double offset = 0.0;
+  double xrel, yrel;
+
+  int irange = 0;
+  int kk=0, ll=0;
+  int i=0, n=0;
+
+  // convert the number of steps to a local integer
+  irange = (int)NSUB;
+
+  // compute the step size
+  step = 1.0/(2.0*(double)NSUB);
+
+  // compute the initial offset
+  offset = step/2.0;
+
+  // determine the subsampling positions in
+  // the beam system, which are the same
+  // for all wavelengths
+  n = 0;
+  for (kk=-irange; kk < irange; kk++)
+    {
+      for (ll=-irange; ll < irange; ll++)
+        {
+          xrel = dpixel.x + (double)kk * step + offset - ptable->refpoint.x;
+          yrel = dpixel.y + (double)ll * step + offset - ptable->refpoint.y;
+
+          ptable->usub[n] =  xrel*ptable->cosa + yrel*ptable->sina;
+          ptable->vsub[n] = -xrel*ptable->sina + yrel*ptable->cosa;
+          n++;
+        }
+    }
+
+  // go over all tracedata (that means wavelength) points
+  for (i=0; i < ptable->npoints; i++)
+    {
+      // re-use the value for identical widths
+      if (i > 0 && ptable->amod[i] == ptable->amod[i-1]
+          && ptable->bmod[i] == ptable->bmod[i-1])
+        {
+          gsl_vector_set(acttrace->gvalue, i, gsl_vector_get(acttrace->gvalue, i-1));
+          continue;
+        }
+
+      // sum up the emission on the subsampling grid
+      sval = 0.0;
+      for (n=0; n < ptable->nsub; n++)
+        sval = sval + ptable->norm[i] *
+          exp(-0.5*(SQR(ptable->usub[n] / ptable->amod[i]) + SQR(ptable->vsub[n] / ptable->bmod[i])));
+
+      // normalize and store the result
+      gsl_vector_set(acttrace->gvalue, i, sval * step * step);
+    }
 }
 
 /*
@@ -41,6 +41,9 @@
 
 #define MINPSF 0.1
 
+#define EKERNEL_NBUCKETS 4096    // number of hash buckets in the kernel cache
+#define EKERNEL_MAXVALUES 16777216 // maximum number of values in the kernel cache
+
 
 /*
  * Struct: dirobject
@@ -102,6 +105,103 @@ typedef struct
 }
 tracedata;
 
+/*
+ * Struct: psf_table
+ * The widths of the gaussian emission model of a beam
+ * at all points of a trace. The table is computed once
+ * per beam and then used in 'fill_gaussvalues()' for
+ * all pixels of the direct object.
+ */
+typedef struct
+{
+  int npoints;          // the number of trace points
+
+  d_point refpoint;     // the refpoint of the beam
+  double cosa;          // cosine of the beam orientation
+  double sina;          // sine of the beam orientation
+
+  double *amod;         // major width at each trace point
+  double *bmod;         // minor width at each trace point
+  double *norm;         // normalization at each trace point
+
+  int nsub;             // number of subsampling positions
+  double *usub;         // the subsampling positions along
+  double *vsub;         // the major and minor axis
+}
+psf_table;
+
+/*
+ * Struct: beam_cache
+ * Per-run cache of the dispersion solutions and
+ * sensitivity curves of the beams, such that the
+ * configuration file and the sensitivity tables
+ * are read only once per beam
+ */
+typedef struct
+{
+  char CONF_file[MAXCHAR];      // the configuration file
+  char config_path[MAXCHAR];    // the configuration directory (environment if empty)
+
+  int loaded[MAX_BEAMS];        // flags the beams loaded
+  int for_grism[MAX_BEAMS];     // grism or prism
+  int n_order[MAX_BEAMS];       // order of the dispersion solution
+  gsl_vector **disp_coeffs[MAX_BEAMS]; // 2D coefficients for each order
+  gsl_vector *pr_range[MAX_BEAMS];     // the valid range for prisms
+  spectrum *resp[MAX_BEAMS];    // the sensitivity curves
+
+  long n_loads;                 // beams loaded from the files
+  long n_calib;                 // wavelength calibrations requested
+  long n_resp;                  // sensitivity curves requested
+}
+beam_cache;
+
+/*
+ * Struct: emission_kernel
+ * The emission of a gaussian model object, subsampled
+ * as in 'get_sub_emodel_value()', on a stamp of pixels
+ * around the reference point
+ */
+typedef struct emission_kernel
+{
+  double key[5];        // widths, orientation and sub-pixel phase
+  int hx;               // half size of the stamp in x
+  int hy;               // half size of the stamp in y
+  double *values;       // the stamp with (2*hx+1)*(2*hy+1) values
+  struct emission_kernel *next; // next kernel in the hash bucket
+}
+emission_kernel;
+
+/*
+ * Struct: ekernel_cache
+ * Per-run cache of emission kernels, keyed by the
+ * quantized shape parameters and sub-pixel phase
+ * of the objects
+ */
+typedef struct
+{
+  double tolerance;     // the quantization tolerance [pixel]
+  emission_kernel *buckets[EKERNEL_NBUCKETS]; // the hash table
+
+  long n_values;        // number of values stored
+  long n_kernels;       // kernels computed and stored
+  long n_hits;          // kernels re-used
+  long n_full;          // kernels not stored, cache full
+}
+ekernel_cache;
+
+/*
+ * Struct: id_index
+ * Index of an object or dirobject list,
+ * sorted by ID, for fast lookups
+ */
+typedef struct
+{
+  int  n;               // the number of entries in the list
+  int *IDs;             // the IDs in ascending order
+  int *pos;             // the list positions of the IDs
+}
+id_index;
+
 extern dirim_emission *
 model_gauss_dirim(dirobject *actdir, beam actbeam, aperture_conf *conf, double psf_offset);
 
@@ -111,6 +211,39 @@ get_calib_function(beamspec *actspec, dirobject *actdir, char CONF_file[], const
 extern spectrum *
 get_throughput_spec(beamspec *actspec, char CONF_file[]);
 
+extern beam_cache *
+alloc_beam_cache(char CONF_file[], const char config_path[]);
+
+extern calib_function *
+get_calib_function_cached(beam_cache *cache, beamspec *actspec, dirobject *actdir,
+			  const aperture_conf * conf);
+
+extern const spectrum *
+get_throughput_spec_cached(beam_cache *cache, beamspec *actspec);
+
+extern void
+print_beam_cache_stats(const beam_cache *cache, const char *task);
+
+extern void
+free_beam_cache(beam_cache *cache);
+
+extern ekernel_cache *
+alloc_ekernel_cache(const double tolerance);
+
+extern const emission_kernel *
+get_emission_kernel(ekernel_cache *kcache, const beam actbeam,
+		    const dirobject *actdir);
+
+extern double
+get_kernel_emission(const emission_kernel *kernel, const d_point dpixel,
+		    const beam actbeam, const d_point drzscale);
+
+extern void
+print_ekernel_cache_stats(const ekernel_cache *kcache, const char *task);
+
+extern void
+free_ekernel_cache(ekernel_cache *kcache);
+
 extern tracedata *
 compute_tracedata(const beam actbeam, const dirobject *actdir,
 		  const calib_function *wl_calibration, const beamspec *actspec);
@@ -175,6 +308,24 @@ get_dirobject_meanpos(dirobject *actdir);
 extern beam
 get_beam_for_beamspec(object **oblist, const int nobjects, const beamspec *actspec);
 
+extern id_index *
+index_oblist(object **oblist);
+
+extern id_index *
+index_dirlist(dirobject **dirlist);
+
+extern int
+find_in_id_index(const id_index *idx, const int ID);
+
+extern void
+free_id_index(id_index *idx);
+
+extern dirobject *
+get_dirobject_from_index(dirobject ** dirlist, const id_index *diridx, const int ID);
+
+extern beam
+get_beam_for_beamspec_index(object **oblist, const id_index *obidx, const beamspec *actspec);
+
 extern beamspec *
 get_beamspec_from_list(beamspec **speclist, const int aperID, const int beamID);
 
@@ -211,10 +362,16 @@ get_flambda_from_magab(double mag, double lambda);
 extern double
 get_aveflux_from_SED(const energy_distrib *sed, double in_wave, double int_wave);
 
+extern psf_table *
+compute_psf_table(const beam actbeam, const dirobject *actdir,
+		  const double lambda_ref, const aperture_conf *conf,
+		  const double psf_offset, const tracedata *acttrace);
+
+extern void
+free_psf_table(psf_table *ptable);
+
 extern void
-fill_gaussvalues(const d_point dpixel, const beam actbeam,
-		 const dirobject *actdir, const double lambda_ref,
-		 const aperture_conf * conf, const double psf_offset,
+fill_gaussvalues(const d_point dpixel, psf_table *ptable,
 		 tracedata *acttrace);
 
 extern beam
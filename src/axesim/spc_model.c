@@ -293,6 +293,10 @@ make_gauss_spectra2(object **oblist, dirobject **dirlist,
   spectrum        *resp;
   beam             actbeam;
   tracedata       *acttrace;
+  psf_table       *ptable;
+  trace_lsf       *lsf;
+  ekernel_cache   *kcache;
+  const emission_kernel *kernel;
 
   //double eval=0.0;
   double psf_offset=0;
@@ -302,7 +306,9 @@ make_gauss_spectra2(object **oblist, dirobject **dirlist,
   //int j=0;
   //int jj=0;
   int ii=0;
-  int nobjects;
+
+  id_index *obidx;
+  id_index *diridx;
 
   //int kk, ll;
   double sval;
@@ -311,24 +317,30 @@ make_gauss_spectra2(object **oblist, dirobject **dirlist,
   int nx, ny;
   d_point dpixel;
 
-  // determine the number of objects in the object list
-  nobjects = object_list_size(oblist);
+  // index the object and the direct object list
+  obidx  = index_oblist(oblist);
+  diridx = index_dirlist(dirlist);
 
   // load the configuration file
   conf = get_aperture_descriptor (CONF_file);
 
+  // the emission kernels of the gaussian models
+  kcache = NULL;
+  if (conf->ekernel_tol >= 0.0)
+    kcache = alloc_ekernel_cache(conf->ekernel_tol);
+
   // allocate ther list of spectral beams
-  speclist = alloc_beamlist_from_dirlist(oblist, dirlist, npixels, conf);
+  speclist = alloc_beamlist_from_dirlist(oblist, obidx, dirlist, npixels, conf);
 
   // go over each beam model
   ii = 0;
   while (speclist[ii] != NULL)
     {
       // get the direct object for the actual model spectrum
-      actdir = get_dirobject_from_list(dirlist, speclist[ii]->objectID);
+      actdir = get_dirobject_from_index(dirlist, diridx, speclist[ii]->objectID);
 
       // get the beam for the actual model spectrum
-      actbeam = get_beam_for_beamspec(oblist,nobjects,speclist[ii]);
+      actbeam = get_beam_for_beamspec_index(oblist, obidx, speclist[ii]);
 
       // get the psf offset values
       psf_offset = get_psf_offset(conf, actbeam);
@@ -365,6 +377,20 @@ make_gauss_spectra2(object **oblist, dirobject **dirlist,
       // give feedback to the screen
       fprintf(stdout, "aXe_PETCONT: modelling object %i beam %c ...", speclist[ii]->objectID, BEAM(speclist[ii]->beamID));
 
+      // the widths of the emission model along the trace
+      ptable = NULL;
+      if (!actdir->dirim)
+        ptable = compute_psf_table(actbeam, actdir, lambda_psf, conf, psf_offset, acttrace);
+
+      // the emission stamp for wavelength independent models
+      kernel = NULL;
+      if (!actdir->dirim && !ptable && kcache)
+        kernel = get_emission_kernel(kcache, actbeam, actdir);
+
+      // the contribution along the trace,
+      // identical for all pixels up to a shift
+      lsf = compute_trace_lsf(actdir, acttrace, resp, speclist[ii]);
+
       frac_prev=10.0;
       // go over each pixel in the direct object area
       for (nx=actdir->ix_min; nx<=actdir->ix_max; nx++)
@@ -396,24 +422,27 @@ make_gauss_spectra2(object **oblist, dirobject **dirlist,
                 {
                   // check whether a wavelength-dependent
                   // emission profile is given
-                  if ((conf->psfcoeffs && conf->psfrange) || psf_offset)
+                  if (ptable)
                     {
                       // fill in the wavelength dependend
                       // emission values
-                      fill_gaussvalues(dpixel, actbeam, actdir, lambda_psf, conf, psf_offset, acttrace);
+                      fill_gaussvalues(dpixel, ptable, acttrace);
                     }
                   else
                     {
                       // do a subsampling over the pixel
                       // to get a more appropriate value for the
                       // emission val
-                      sval = get_sub_emodel_value(dpixel, actbeam, actdir->drzscale);
+                      if (kernel)
+                        sval = get_kernel_emission(kernel, dpixel, actbeam, actdir->drzscale);
+                      else
+                        sval = get_sub_emodel_value(dpixel, actbeam, actdir->drzscale);
                       gsl_vector_set_all (acttrace->gvalue, sval);
                     }
                 }
 
               // insert the spectrum of this direct object pixel in the beam spectrum
-              fill_pixel_in_speed(actdir, acttrace, dpixel, resp, speclist[ii], wl_calibration);
+              fill_pixel_from_lsf(lsf, acttrace, dpixel, speclist[ii]);
             }
         }
 
@@ -422,13 +451,23 @@ make_gauss_spectra2(object **oblist, dirobject **dirlist,
       free_calib(wl_calibration);
       free_spectrum(resp);
       free_tracedata(acttrace);
+      free_psf_table(ptable);
+      free_trace_lsf(lsf);
 
       // enhance the counter
       ii++;
     }
 
+  if (kcache != NULL)
+    {
+      print_ekernel_cache_stats(kcache, "aXe_PETCONT");
+      free_ekernel_cache(kcache);
+    }
+
   // free the memory in the conf structure
   free_aperture_conf(conf);
+  free_id_index(obidx);
+  free_id_index(diridx);
 
   // return the list of modelled beams
   return speclist;
@@ -462,6 +501,8 @@ make_gauss_spectra(object **oblist, dirobject **dirlist,
   spectrum        *resp;
   beam             actbeam;
   tracedata       *acttrace;
+  psf_table       *ptable;
+  trace_lsf       *lsf;
 
   //double eval=0.0;
   double psf_offset=0;
@@ -575,6 +616,13 @@ make_gauss_spectra(object **oblist, dirobject **dirlist,
 
       fprintf(stdout, "aXe_PETCONT: modelling object %i beam %c ...", speclist[ii]->objectID, BEAM(speclist[ii]->beamID));
 
+      // the widths of the emission model along the trace
+      ptable = compute_psf_table(actbeam, actdir, lambda_psf, conf, psf_offset, acttrace);
+
+      // the contribution along the trace,
+      // identical for all pixels up to a shift
+      lsf = compute_trace_lsf(actdir, acttrace, resp, speclist[ii]);
+
       // go over each pixel in the direct object area
       for (nx=actdir->ix_min; nx<=actdir->ix_max; nx++)
         {
@@ -589,11 +637,11 @@ make_gauss_spectra(object **oblist, dirobject **dirlist,
 
               // check whether a wavelength-dependent
               // emission profile is given
-              if ((conf->psfcoeffs && conf->psfrange) || psf_offset)
+              if (ptable)
                 {
                   // fill in the wavelength dependend
                   // emission values
-                  fill_gaussvalues(dpixel, actbeam, actdir, lambda_psf, conf, psf_offset, acttrace);
+                  fill_gaussvalues(dpixel, ptable, acttrace);
                 }
               else
                 {
@@ -605,7 +653,7 @@ make_gauss_spectra(object **oblist, dirobject **dirlist,
                 }
 
               //
-              fill_pixel_in_speed(actdir, acttrace, dpixel, resp, speclist[ii], wl_calibration);
+              fill_pixel_from_lsf(lsf, acttrace, dpixel, speclist[ii]);
             }
         }
 
@@ -614,6 +662,8 @@ make_gauss_spectra(object **oblist, dirobject **dirlist,
       free_calib(wl_calibration);
       free_spectrum(resp);
       free_tracedata(acttrace);
+      free_psf_table(ptable);
+      free_trace_lsf(lsf);
 
       // enhance the counter
       ii++;
@@ -767,7 +817,9 @@ make_fcube_spectra(object **oblist, dirobject **dirlist,
   tracedata       *acttrace;
 
   int i;
-  int nobjects;
+
+  id_index *obidx;
+  id_index *diridx;
 
   int nx, ny;
   //d_point dpixel;
@@ -777,13 +829,14 @@ make_fcube_spectra(object **oblist, dirobject **dirlist,
   d_point tmp2;
 
 
-  // determine the number of objects in the object list
-  nobjects = object_list_size(oblist);
+  // index the object and the direct object list
+  obidx  = index_oblist(oblist);
+  diridx = index_dirlist(dirlist);
 
   // load the configuration file
   conf = get_aperture_descriptor (CONF_file);
 
-  speclist = alloc_beamlist_from_dirlist(oblist, dirlist, npixels, conf);
+  speclist = alloc_beamlist_from_dirlist(oblist, obidx, dirlist, npixels, conf);
 
   // go over each beam model
   i = 0;
@@ -791,10 +844,10 @@ make_fcube_spectra(object **oblist, dirobject **dirlist,
     {
 
       // get the direct object for the actual model spectrum
-      actdir = get_dirobject_from_list(dirlist, speclist[i]->objectID);
+      actdir = get_dirobject_from_index(dirlist, diridx, speclist[i]->objectID);
 
       // get the beam for the actual model spectrum
-      actbeam = get_beam_for_beamspec(oblist,nobjects,speclist[i]);
+      actbeam = get_beam_for_beamspec_index(oblist, obidx, speclist[i]);
 
       // get the wavelength calibration for the actual model spectrum
       wl_calibration = get_calib_function(speclist[i], actdir, CONF_file, conf);
@@ -860,6 +913,8 @@ make_fcube_spectra(object **oblist, dirobject **dirlist,
     }
   // release memory
   free_aperture_conf(conf);
+  free_id_index(obidx);
+  free_id_index(diridx);
 
   // return the spectrum list
   return speclist;
@@ -874,6 +929,7 @@ make_fcube_spectra(object **oblist, dirobject **dirlist,
  *
  * Parameters:
  * @param  oblist    - the object list as input to select beams
+ * @param  obidx     - the index of the object list
  * @param  dirlist   - the direct object list to dimension the models
  * @param  npixels   - the dimensions of the model for the whole image
  * @param  conf      - configuration structure
@@ -882,7 +938,7 @@ make_fcube_spectra(object **oblist, dirobject **dirlist,
  * @return speclist  - the list of modelled beams
  */
 beamspec **
-alloc_beamlist_from_dirlist(object **oblist, dirobject **dirlist,
+alloc_beamlist_from_dirlist(object **oblist, const id_index *obidx, dirobject **dirlist,
                             const px_point npixels, aperture_conf *conf)
 {
   beamspec  **speclist;
@@ -912,7 +968,7 @@ alloc_beamlist_from_dirlist(object **oblist, dirobject **dirlist,
     {
 
       // find the object structure to the directo object
-      objindex = find_object_in_object_list(oblist, dirlist[i]->ID);
+      objindex = find_in_id_index(obidx, dirlist[i]->ID);
       if (objindex < 0)
         {
           i++;
@@ -1113,10 +1169,31 @@ fill_pixel_in_speed(const dirobject *actdir, const tracedata *acttrace,
   int xact;
   int ipos;
   int nguess;
+  int size1, size2;
+
+  // the trace data, accessed directly
+  const double *t_dx      = acttrace->dx->data;
+  const double *t_dy      = acttrace->dy->data;
+  const double *t_lambda  = acttrace->lambda->data;
+  const double *t_dlambda = acttrace->dlambda->data;
+  const double *t_flux    = acttrace->flux->data;
+  const double *t_gvalue  = acttrace->gvalue->data;
+  const size_t s_dx      = acttrace->dx->stride;
+  const size_t s_dy      = acttrace->dy->stride;
+  const size_t s_lambda  = acttrace->lambda->stride;
+  const size_t s_dlambda = acttrace->dlambda->stride;
+  const size_t s_flux    = acttrace->flux->stride;
+  const size_t s_gvalue  = acttrace->gvalue->stride;
+
+  const double xoff = actdir->xy_off[actspec->beamID].x;
+  const double yoff = actdir->xy_off[actspec->beamID].y;
+
+  size1 = (int)actspec->model->size1;
+  size2 = (int)actspec->model->size2;
 
   // define the dx-range for which a pixel is modelled
   xstart = actspec->model_ref.x;
-  xend   = actspec->model_ref.x + actspec->model->size1;
+  xend   = actspec->model_ref.x + size1;
 
   // nguess is the approximate possition
   // to find a wavelength in the sensitivity table.
@@ -1145,40 +1222,40 @@ fill_pixel_in_speed(const dirobject *actdir, const tracedata *acttrace,
         }
 
       // compute the y-position in the matrix of the beamspec
-      iy = (int)(gsl_vector_get(acttrace->dy,ipos) + actdir->xy_off[actspec->beamID].y + 0.5) + (int)dpixel.y - actspec->model_ref.y;
+      iy = (int)(t_dy[ipos*s_dy] + yoff + 0.5) + (int)dpixel.y - actspec->model_ref.y;
 
       // the same quantity as a double
-      ddy = gsl_vector_get(acttrace->dy,ipos) + actdir->xy_off[actspec->beamID].y + dpixel.y - actspec->model_ref.y;
+      ddy = t_dy[ipos*s_dy] + yoff + dpixel.y - actspec->model_ref.y;
 
       // if the y-position is outside, go to the next dx value
-      if (iy < 0 || iy > actspec->model->size2-1)
+      if (iy < 0 || iy > size2-1)
         continue;
 
       // in case that the actual wavelength is outside the range
       // of the sensitivity data, continue with the next dx-value
-      if (gsl_vector_get(acttrace->lambda, ipos) < resp->lambdamin || gsl_vector_get(acttrace->lambda, ipos) > resp->lambdamax)
+      if (t_lambda[ipos*s_lambda] < resp->lambdamin || t_lambda[ipos*s_lambda] > resp->lambdamax)
         continue;
 
       // compute the x-position in the matrix of the beamspec
-      ix = (int)(gsl_vector_get(acttrace->dx,ipos) + actdir->xy_off[actspec->beamID].x) + (int)dpixel.x - actspec->model_ref.x;
+      ix = (int)(t_dx[ipos*s_dx] + xoff) + (int)dpixel.x - actspec->model_ref.x;
 
       // the same quantity as double
-      ddx = gsl_vector_get(acttrace->dx,ipos) + actdir->xy_off[actspec->beamID].x + dpixel.x - actspec->model_ref.x;
+      ddx = t_dx[ipos*s_dx] + xoff + dpixel.x - actspec->model_ref.x;
 
       // get the total flux value of the source at the wavelength of the actual dx-value
-      fval = gsl_vector_get(acttrace->gvalue, ipos) * gsl_vector_get(acttrace->flux, ipos);
+      fval = t_gvalue[ipos*s_gvalue] * t_flux[ipos*s_flux];
 
 
       // get the sensitivity at the wavelength of the actual dx-value
-      sens = get_response_value_plus(resp, gsl_vector_get(acttrace->lambda, ipos), &nguess);
+      sens = get_response_value_plus(resp, t_lambda[ipos*s_lambda], &nguess);
 
       // compute the contribution of the actual dx-value to the model spectrum
-      tmp1 = fval * sens * gsl_vector_get(acttrace->dlambda,ipos);
+      tmp1 = fval * sens * t_dlambda[ipos*s_dlambda];
 
       // double check whether we are inside the image
-      if (ix < 0 || iy < 0 || ix > (actspec->model->size1-1) || iy > (actspec->model->size2-1))
+      if (ix < 0 || iy < 0 || ix > size1-1 || iy > size2-1)
         {
-          fprintf(stdout, "xval: %i, yval: %i, size1: %i, size2: %i\n",ix, iy, (int)actspec->model->size1, (int)actspec->model->size2);
+          fprintf(stdout, "xval: %i, yval: %i, size1: %i, size2: %i\n",ix, iy, size1, size2);
         }
       else
         {
@@ -1201,6 +1278,215 @@ fill_pixel_in_speed(const dirobject *actdir, const tracedata *acttrace,
 }
 
 
+/**
+ * Function: compute_trace_lsf
+ * The function computes the dispersed contribution of a direct
+ * image pixel along the trace of a beam, which is the same for
+ * all pixels of the direct object up to a shift. The trace
+ * positions, the sensitivity, the flux and the wavelength
+ * interval are evaluated once per beam, in the same way as
+ * in 'fill_pixel_in_speed()' for each pixel.
+ *
+ * Parameters:
+ * @param  actdir   - the direct object of the model spectrum
+ * @param  acttrace - the tracedata of the model spectrum
+ * @param  resp     - the sensitivity data
+ * @param  actspec  - the structure for the model spectrum
+ *
+ * Returns:
+ * @return lsf      - the contribution along the trace
+ */
+trace_lsf *
+compute_trace_lsf(const dirobject *actdir, const tracedata *acttrace,
+                  const spectrum *resp, const beamspec *actspec)
+{
+  trace_lsf *lsf;
+
+  double lambda;
+  double xoff, yoff;
+
+  int kmin, kmax;
+  int k, ipos;
+  int n=0;
+  int nguess=0;
+
+  lsf = (trace_lsf *) malloc(sizeof(trace_lsf));
+  if (lsf == NULL)
+    aXe_message (aXe_M_FATAL, __FILE__, __LINE__,
+                 "compute_trace_lsf: Could not allocate memory!");
+
+  // the range of integer dx-values
+  // which can be inside the tracedata
+  kmin = (int)floor(acttrace->dx_start) - 1;
+  kmax = (int)ceil(acttrace->dx_start) + acttrace->npoints + 1;
+
+  lsf->kx      = (int *)    malloc((kmax-kmin+1) * sizeof(int));
+  lsf->ipos    = (int *)    malloc((kmax-kmin+1) * sizeof(int));
+  lsf->ixoff   = (int *)    malloc((kmax-kmin+1) * sizeof(int));
+  lsf->iyoff   = (int *)    malloc((kmax-kmin+1) * sizeof(int));
+  lsf->ddx     = (double *) malloc((kmax-kmin+1) * sizeof(double));
+  lsf->ddy     = (double *) malloc((kmax-kmin+1) * sizeof(double));
+  lsf->flux    = (double *) malloc((kmax-kmin+1) * sizeof(double));
+  lsf->sens    = (double *) malloc((kmax-kmin+1) * sizeof(double));
+  lsf->dlambda = (double *) malloc((kmax-kmin+1) * sizeof(double));
+  if (!lsf->kx || !lsf->ipos || !lsf->ixoff || !lsf->iyoff || !lsf->ddx
+      || !lsf->ddy || !lsf->flux || !lsf->sens || !lsf->dlambda)
+    aXe_message (aXe_M_FATAL, __FILE__, __LINE__,
+                 "compute_trace_lsf: Could not allocate memory for %i positions!",
+                 kmax-kmin+1);
+
+  xoff = actdir->xy_off[actspec->beamID].x;
+  yoff = actdir->xy_off[actspec->beamID].y;
+
+  for (k=kmin; k <= kmax; k++)
+    {
+      // get the index to find the data for the dx-value
+      ipos = get_index_for_tracepoint(acttrace, (double)k);
+      if (ipos < 0)
+        continue;
+
+      // skip wavelengths outside of the sensitivity data
+      lambda = gsl_vector_get(acttrace->lambda, ipos);
+      if (lambda < resp->lambdamin || lambda > resp->lambdamax)
+        continue;
+
+      lsf->kx[n]      = k;
+      lsf->ipos[n]    = ipos;
+      lsf->ixoff[n]   = (int)(gsl_vector_get(acttrace->dx,ipos) + xoff);
+      lsf->iyoff[n]   = (int)(gsl_vector_get(acttrace->dy,ipos) + yoff + 0.5);
+      lsf->ddx[n]     = gsl_vector_get(acttrace->dx,ipos) + xoff;
+      lsf->ddy[n]     = gsl_vector_get(acttrace->dy,ipos) + yoff;
+      lsf->flux[n]    = gsl_vector_get(acttrace->flux, ipos);
+      lsf->sens[n]    = get_response_value_plus(resp, lambda, &nguess);
+      lsf->dlambda[n] = gsl_vector_get(acttrace->dlambda,ipos);
+      n++;
+    }
+  lsf->npoints = n;
+
+  return lsf;
+}
+
+/**
+ * Function: fill_pixel_from_lsf
+ * The function coadds the contribution of a single pixel in
+ * the direct image area to the model spectrum, shifting and
+ * adding the contribution along the trace computed in
+ * 'compute_trace_lsf()'. The result is identical to
+ * 'fill_pixel_in_speed()' for pixels with integer coordinates.
+ *
+ * Parameters:
+ * @param  lsf      - the contribution along the trace
+ * @param  acttrace - the tracedata with the emission values
+ * @param  dpixel   - the (integer) coordinates of the modelled pixel
+ * @param  actspec  - the structure for the model spectrum
+ */
+void
+fill_pixel_from_lsf(const trace_lsf *lsf, const tracedata *acttrace,
+                    const d_point dpixel, beamspec *actspec)
+{
+  float  *model;        // gsl_matrix is gsl_matrix_float (aXe_grism.h)
+  const double *gvalue;
+  size_t s_gvalue;
+  double cps;
+  double ddx, ddy;
+  double p, q, p_rem, q_rem;
+
+  int size1, size2, tda;
+  int kstart, kend;
+  int ix, iy, ix_rem, iy_rem;
+  int n;
+
+  model = actspec->model->data;
+  size1 = (int)actspec->model->size1;
+  size2 = (int)actspec->model->size2;
+  tda   = (int)actspec->model->tda;
+
+  gvalue   = acttrace->gvalue->data;
+  s_gvalue = acttrace->gvalue->stride;
+
+  // the dx-range for which the pixel is modelled
+  kstart = actspec->model_ref.x - (int)dpixel.x;
+  kend   = actspec->model_ref.x + size1 - (int)dpixel.x;
+
+  for (n=0; n < lsf->npoints; n++)
+    {
+      if (lsf->kx[n] < kstart || lsf->kx[n] >= kend)
+        continue;
+
+      // compute the y-position in the matrix of the beamspec,
+      // go to the next position if outside
+      iy = lsf->iyoff[n] + (int)dpixel.y - actspec->model_ref.y;
+      if (iy < 0 || iy > size2-1)
+        continue;
+
+      // compute the x-position in the matrix of the beamspec
+      ix = lsf->ixoff[n] + (int)dpixel.x - actspec->model_ref.x;
+      if (ix < 0 || ix > size1-1)
+        {
+          fprintf(stdout, "xval: %i, yval: %i, size1: %i, size2: %i\n",ix, iy, size1, size2);
+          continue;
+        }
+
+      // compute the contribution of the position
+      cps = gvalue[lsf->ipos[n]*s_gvalue] * lsf->flux[n] * lsf->sens[n] * lsf->dlambda[n];
+
+      // distribute the contribution proportional
+      // to the area, as in 'diffuse_spectrumII()'
+      ddx = lsf->ddx[n] + dpixel.x - actspec->model_ref.x;
+      ddy = lsf->ddy[n] + dpixel.y - actspec->model_ref.y;
+
+      ix     = (int)floor(ddx);
+      iy     = (int)floor(ddy);
+      ix_rem = ix + 1;
+      iy_rem = iy + 1;
+
+      p_rem = ddx - floor(ddx);
+      q_rem = ddy - floor(ddy);
+      p     = 1.0 - p_rem;
+      q     = 1.0 - q_rem;
+
+      if (ix >= 0 && ix < size1)
+        {
+          if (iy >= 0 && iy < size2)
+            model[ix*tda + iy] = model[ix*tda + iy] + p*q*cps;
+          if (iy_rem >= 0 && iy_rem < size2)
+            model[ix*tda + iy_rem] = model[ix*tda + iy_rem] + p*q_rem*cps;
+        }
+      if (ix_rem >= 0 && ix_rem < size1)
+        {
+          if (iy >= 0 && iy < size2)
+            model[ix_rem*tda + iy] = model[ix_rem*tda + iy] + p_rem*q*cps;
+          if (iy_rem >= 0 && iy_rem < size2)
+            model[ix_rem*tda + iy_rem] = model[ix_rem*tda + iy_rem] + p_rem*q_rem*cps;
+        }
+    }
+}
+
+/**
+ * Function: free_trace_lsf
+ * Releases the memory of a trace contribution.
+ *
+ * Parameters:
+ * @param lsf - the structure to be freed
+ */
+void
+free_trace_lsf(trace_lsf *lsf)
+{
+  if (lsf == NULL)
+    return;
+
+  free(lsf->kx);
+  free(lsf->ipos);
+  free(lsf->ixoff);
+  free(lsf->iyoff);
+  free(lsf->ddx);
+  free(lsf->ddy);
+  free(lsf->flux);
+  free(lsf->sens);
+  free(lsf->dlambda);
+  free(lsf);
+}
+
 /**
  * Function: get_index_for_tracepoint
  * For a given dx-value, the function derives the index
@@ -1368,6 +1654,9 @@ diffuse_spectrum(double ddx, double ddy, double cps, beamspec *actspec)
 int
 diffuse_spectrumII(double ddx, double ddy, double cps, beamspec *actspec)
 {
+  float *model;         // gsl_matrix is gsl_matrix_float (aXe_grism.h)
+
+  int size1, size2, tda;
   int ix;
   int iy;
   int ix_rem;
@@ -1381,7 +1670,10 @@ diffuse_spectrumII(double ddx, double ddy, double cps, beamspec *actspec)
   double d_incr = 0.0;
   double oldvalue;
 
-  double sum = 0.0;
+  model = actspec->model->data;
+  size1 = (int)actspec->model->size1;
+  size2 = (int)actspec->model->size2;
+  tda   = (int)actspec->model->tda;
 
   // compute the indices
   // of the pixels involved
@@ -1402,60 +1694,42 @@ diffuse_spectrumII(double ddx, double ddy, double cps, beamspec *actspec)
   p     = 1.0 - p_rem;
   q     = 1.0 - q_rem;
 
-
-  // increment the first quarter
-  // double check whether we are inside the image
-  if ( ! (ix < 0 || iy < 0 || ix > (actspec->model->size1-1) || iy > (actspec->model->size2-1)))
-    {
-      // compute the area
-      d_incr = p * q;
-
-      // add the fractional contribution to the model spectrum
-      oldvalue = gsl_matrix_get(actspec->model, ix, iy);
-      gsl_matrix_set(actspec->model, ix, iy, oldvalue + d_incr*cps);
-      sum += d_incr;
-    }
-
-  // increment the second quarter
+  // the first and the second quarter,
   // double check whether we are inside the image
-  if ( ! (ix < 0 || iy_rem < 0 || ix > (actspec->model->size1-1) || iy_rem > (actspec->model->size2-1)))
+  if (ix >= 0 && ix < size1)
     {
-      // compute the area
-      d_incr = p * q_rem;
-
-      // add the fractional contribution to the model spectrum
-      oldvalue = gsl_matrix_get(actspec->model, ix, iy_rem);
-      gsl_matrix_set(actspec->model, ix, iy_rem, oldvalue + d_incr*cps);
-      sum += d_incr;
-    }
-
-  // increment the third quarter
-  // double check whether we are inside the image
-  if ( ! (ix_rem < 0 || iy < 0 || ix_rem > (actspec->model->size1-1) || iy > (actspec->model->size2-1)))
-    {
-      // compute the area
-      d_incr = p_rem * q;
-
-      // add the fractional contribution to the model spectrum
-      oldvalue = gsl_matrix_get(actspec->model, ix_rem, iy);
-      gsl_matrix_set(actspec->model, ix_rem, iy, oldvalue + d_incr*cps);
-      sum += d_incr;
+      if (iy >= 0 && iy < size2)
+        {
+          // add the fractional contribution to the model spectrum
+          d_incr   = p * q;
+          oldvalue = model[ix*tda + iy];
+          model[ix*tda + iy] = oldvalue + d_incr*cps;
+        }
+      if (iy_rem >= 0 && iy_rem < size2)
+        {
+          d_incr   = p * q_rem;
+          oldvalue = model[ix*tda + iy_rem];
+          model[ix*tda + iy_rem] = oldvalue + d_incr*cps;
+        }
     }
 
-  // increment the fourth quarter
-  // double check whether we are inside the image
-  if ( ! (ix_rem < 0 || iy_rem < 0 || ix_rem > (actspec->model->size1-1) || iy_rem > (actspec->model->size2-1)))
+  // the third and the fourth quarter
+  if (ix_rem >= 0 && ix_rem < size1)
     {
-      // compute the area
-      d_incr = p_rem * q_rem;
-
-      // add the fractional contribution to the model spectrum
-      oldvalue = gsl_matrix_get(actspec->model, ix_rem, iy_rem);
-      gsl_matrix_set(actspec->model, ix_rem, iy_rem, oldvalue + d_incr*cps);
-      sum += d_incr;
+      if (iy >= 0 && iy < size2)
+        {
+          d_incr   = p_rem * q;
+          oldvalue = model[ix_rem*tda + iy];
+          model[ix_rem*tda + iy] = oldvalue + d_incr*cps;
+        }
+      if (iy_rem >= 0 && iy_rem < size2)
+        {
+          d_incr   = p_rem * q_rem;
+          oldvalue = model[ix_rem*tda + iy_rem];
+          model[ix_rem*tda + iy_rem] = oldvalue + d_incr*cps;
+        }
     }
 
-
   // return a dummy
   return 1.0;
 }
@@ -1479,12 +1753,17 @@ make_model_image(const px_point npixels, observation *obs, beamspec **speclist)
 {
 
   gsl_matrix *all_models;
+  const beamspec *actspec;
+
+  const float *mrow;    // gsl_matrix is gsl_matrix_float (aXe_grism.h)
+  float *arow;
 
   double oldval, addval;
 
   int i=0;
   int xact, yact;
-  int ix, iy;
+  int xref, yref;
+  int xmin, xmax, ymin, ymax;
 
   // allocate space for the result,
   // set the matrix to 0.0
@@ -1497,30 +1776,32 @@ make_model_image(const px_point npixels, observation *obs, beamspec **speclist)
   // go over each beam in the list
    while (speclist[i] != NULL)
      {
+       actspec = speclist[i];
+
+       fprintf(stdout, "aXe_PETCONT: summing up object %i beam %c ...", actspec->objectID, BEAM(actspec->beamID));
 
-       fprintf(stdout, "aXe_PETCONT: summing up object %i beam %c ...", speclist[i]->objectID, BEAM(speclist[i]->beamID));
+       // the part of the beam model inside the whole image model,
+       // checked once for the beam
+       xref = (int)actspec->model_ref.x;
+       yref = (int)actspec->model_ref.y;
+       xmin = MAX(0, -xref);
+       ymin = MAX(0, -yref);
+       xmax = MIN((int)actspec->model->size1, npixels.x - xref);
+       ymax = MIN((int)actspec->model->size2, npixels.y - yref);
+       if (xmin > 0 || ymin > 0 || xmax < (int)actspec->model->size1 || ymax < (int)actspec->model->size2)
+         fprintf(stdout, "This should not happen!\n");
 
        // go over each pixel in the array of the beam model
-       for (xact=0; xact < speclist[i]->model->size1; xact++)
+       for (xact=xmin; xact < xmax; xact++)
          {
-           for (yact=0; yact < speclist[i]->model->size2; yact++)
+           mrow = actspec->model->data + (size_t)xact*actspec->model->tda;
+           arow = all_models->data + (size_t)(xref + xact)*all_models->tda;
+           for (yact=ymin; yact < ymax; yact++)
              {
-
-               // find the coordinates of the pixels in the whole image model
-               ix = speclist[i]->model_ref.x + xact;
-               iy = speclist[i]->model_ref.y + yact;
-
-               // check for safety reasons whether the coordinates are inside
-               if (ix < 0 || iy < 0 || ix > (npixels.x-1) || ix > (npixels.x-1)){
-                 fprintf(stdout, "This should not happen!\n");
-               }
-               else{
-
-                 // summ up the pixel
-                 addval = gsl_matrix_get(speclist[i]->model, xact, yact);
-                 oldval = gsl_matrix_get(all_models, ix, iy);
-                 gsl_matrix_set(all_models, ix, iy, oldval+addval);
-               }
+               // summ up the pixel
+               addval = mrow[yact];
+               oldval = arow[yref + yact];
+               arow[yref + yact] = oldval+addval;
              }
          }
 
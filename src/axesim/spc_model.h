@@ -31,6 +31,30 @@
 #ifndef _SPC_MODEL_H
 #define _SPC_MODEL_H
 
+/*
+ * Struct: trace_lsf
+ * The dispersed contribution of a direct image pixel
+ * along the trace of a beam. All quantities which are
+ * identical for all pixels of the direct object, i.e.
+ * the offsets, flux, sensitivity and wavelength interval
+ * at each trace position, are computed once per beam.
+ */
+typedef struct
+{
+  int npoints;          // number of valid trace positions
+
+  int    *kx;           // the integer dx-value of the position
+  int    *ipos;         // the index in the tracedata
+  int    *ixoff;        // integer x-offset of the position
+  int    *iyoff;        // integer y-offset of the position
+  double *ddx;          // x-offset of the position
+  double *ddy;          // y-offset of the position
+  double *flux;         // flux at the position
+  double *sens;         // sensitivity at the position
+  double *dlambda;      // wavelength interval at the position
+}
+trace_lsf;
+
 extern int
 compute_gauss_cont(char grism_file[], char OAF_file[], char CONF_file[],
 		   const char specmod_file[], const double model_scale, 
@@ -74,7 +98,7 @@ make_fcube_spectra(object **oblist, dirobject **dirlist,
 		   const flux_cube *fcube, const int inter_type);
 
 extern beamspec **
-alloc_beamlist_from_dirlist(object **oblist, dirobject **dirlist,
+alloc_beamlist_from_dirlist(object **oblist, const id_index *obidx, dirobject **dirlist,
 			    const px_point npixels, aperture_conf *conf);
 
 extern gsl_matrix *
@@ -97,6 +121,17 @@ fill_pixel_in_speed(const dirobject *actdir, const tracedata *acttrace,
 		    const d_point dpixel, const spectrum *resp,
 		    beamspec *actspec, const calib_function  *wl_calibration);
 
+extern trace_lsf *
+compute_trace_lsf(const dirobject *actdir, const tracedata *acttrace,
+		  const spectrum *resp, const beamspec *actspec);
+
+extern void
+fill_pixel_from_lsf(const trace_lsf *lsf, const tracedata *acttrace,
+		    const d_point dpixel, beamspec *actspec);
+
+extern void
+free_trace_lsf(trace_lsf *lsf);
+
 extern int 
 no_diffuse_spectrum(int ix, int iy, double cps, beamspec *actspec);
 
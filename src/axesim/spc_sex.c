@@ -1712,6 +1712,98 @@ get_SexObject_from_catalog (char filename[], const double lambda_mark)
   return sobjs;
 }
 
+/**
+ * Function: get_SexObject_from_catalog_nodim
+ * Parses a model object table and outputs a NULL terminated array
+ * of SexObjects pointers with the image coordinates computed on the
+ * grism image. This is the in-memory equivalent of writing a GOL
+ * with 'catalog_to_wcs_nodim()' and reading it back with
+ * 'get_SexObject_from_catalog()'.
+ *
+ * Parameters:
+ * @param filename    - the model object table
+ * @param grism_wcs   - the WCS of the grism image
+ * @param lambda_mark - the wavelength to select the magnitude column
+ *
+ * Returns:
+ * @return sobjs - a pointer to an array of SeXObject pointer. NULL terminated
+ */
+SexObject **
+get_SexObject_from_catalog_nodim (char filename[], struct WorldCoor *grism_wcs,
+                                  const double lambda_mark)
+{
+  FILE *input;
+  char line[CATBUFFERSIZE];
+  gsl_vector *waves;
+  gsl_vector *cnums;
+  int nobjs=0, i, hasmags=0, magcencol=0;
+  int compute_imcoos=0;
+  SexObject **sobjs, *sobj;
+  colinfo * actcatinfo;
+  px_point  backwin_cols;
+  px_point  modinfo_cols;
+
+  actcatinfo = get_sex_col_descr (filename);
+  hasmags = has_magnitudes(actcatinfo);
+  if (!hasmags)
+    aXe_message (aXe_M_FATAL, __FILE__, __LINE__,
+                 "No magnitudes in file %s", filename);
+  waves = gsl_vector_alloc (hasmags);
+  cnums = gsl_vector_alloc (hasmags);
+  hasmags = get_magcols(actcatinfo, waves, cnums);
+  magcencol = get_magauto_col(waves, cnums, lambda_mark);
+
+  backwin_cols = has_backwindow(actcatinfo);
+  modinfo_cols = has_modelinfo(actcatinfo);
+
+  if (check_worldcoo_input(actcatinfo, 1))
+    aXe_message (aXe_M_FATAL, __FILE__, __LINE__,
+                 "Catalogue %s does not have all necessary columns\n", filename);
+  if (check_imagecoo_input(actcatinfo))
+    compute_imcoos=1;
+
+  if (!(input = fopen (filename, "r")))
+    aXe_message (aXe_M_FATAL, __FILE__, __LINE__,
+                 "Could not open catalog file %s,\n", filename);
+
+  // count the catalogue entries
+  while (fgets (line, CATBUFFERSIZE, input))
+    if (line_is_valid (actcatinfo, line) && line[0] != ';')
+      nobjs++;
+  rewind (input);
+
+  /* Allocate enough room for nobjs+1 SexObject  pointers */
+  sobjs = (SexObject **) malloc ((nobjs + 1) * sizeof (SexObject *));
+  if (!sobjs)
+    aXe_message (aXe_M_FATAL, __FILE__, __LINE__, "Out of memory.");
+
+  i = 0;
+  while (i < nobjs && fgets (line, CATBUFFERSIZE, input))
+    {
+      if (!(line_is_valid (actcatinfo, line)) || line[0] == ';')
+        continue;
+
+      lv1ws (line);
+      sobj = create_SexObject (actcatinfo, line, waves, cnums, backwin_cols,
+                               modinfo_cols, magcencol, 0);
+
+      // compute the image coordinates
+      // on the grism image
+      if (compute_imcoos)
+        compute_new_image_sexobject (sobj, grism_wcs, 1);
+
+      sobjs[i++] = sobj;
+    }
+  sobjs[i] = NULL;
+
+  fclose (input);
+  gsl_vector_free (waves);
+  gsl_vector_free (cnums);
+  free (actcatinfo);
+
+  return sobjs;
+}
+
 /**
  * Function: el_to_ABC_world
  * Convert a wold coordinate ellipse into a set of 3 points on the
@@ -119,6 +119,10 @@ size_of_sextractor_catalog (char filename[]);
 extern SexObject **
 get_SexObject_from_catalog (char filename[], const double lambda_mark);
 
+extern SexObject **
+get_SexObject_from_catalog_nodim (char filename[], struct WorldCoor *grism_wcs,
+                                  const double lambda_mark);
+
 extern void
 ABC_image_to_el (d_point *a, d_point *b, d_point *c, ellipse *el);
 
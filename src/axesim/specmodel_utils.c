@@ -18,6 +18,8 @@
 #include "specmodel_utils.h"
 #include "model_utils.h"
 
+#define MAX(x,y) (((x)>(y))?(x):(y))
+#define MIN(x,y) (((x)<(y))?(x):(y))
 
 /**
  * Function: load_object_models
@@ -374,6 +376,144 @@ get_diremission_value(const dirim_emission *diremission,
   return value;
 }
 
+/**
+ * Function: compute_diremission_stamp
+ * The function computes the direct emission values on a rectangle of
+ * pixels, e.g. the area of a direct object. The values are identical
+ * to 'get_diremission_value()' at each pixel. Since the pixels
+ * are on a regular grid, the lower matrix indices and the interpolation
+ * offsets are computed once per column and row, and all values are
+ * then filled in one pass over the contiguous float data of the
+ * emission model, without function calls and bounds checks per pixel.
+ *
+ * Parameters:
+ * @param diremission - the direct emission model
+ * @param ix_min      - the x-index of the first pixel
+ * @param iy_min      - the y-index of the first pixel
+ * @param nx          - the number of pixels in x
+ * @param ny          - the number of pixels in y
+ * @param refpoint    - the position of the emission model center
+ *
+ * Returns:
+ * @return stamp - the values, pixel (ix_min+i, iy_min+j) at stamp[i*ny+j]
+ */
+double *
+compute_diremission_stamp(const dirim_emission *diremission,
+			  const int ix_min, const int iy_min, const int nx,
+			  const int ny, const d_point refpoint)
+{
+  const float *data;
+  const float *row0;
+  const float *row1;
+  double *srow;
+  double *stamp;
+
+  int    *x_lower;
+  int    *y_lower;
+  double *t_off;
+  double *u_off;
+  char   *x_hit;
+  char   *y_hit;
+
+  double x_abs, y_abs;
+  double t, u;
+
+  size_t tda;
+  int has_hit=0;
+  int jmin, jmax;
+  int i, j;
+
+  stamp   = (double *) malloc((size_t)nx * (size_t)ny * sizeof(double));
+  x_lower = (int *) malloc(nx * sizeof(int));
+  y_lower = (int *) malloc(ny * sizeof(int));
+  t_off   = (double *) malloc(nx * sizeof(double));
+  u_off   = (double *) malloc(ny * sizeof(double));
+  x_hit   = (char *) malloc(nx * sizeof(char));
+  y_hit   = (char *) malloc(ny * sizeof(char));
+  if (stamp == NULL || x_lower == NULL || y_lower == NULL || t_off == NULL
+      || u_off == NULL || x_hit == NULL || y_hit == NULL)
+    aXe_message (aXe_M_FATAL, __FILE__, __LINE__,
+		 "compute_diremission_stamp:" " Could not allocate"
+		 " memory for a stamp of %ix%i pixels!", nx, ny);
+
+  // the lower matrix index and the offset of each column,
+  // -1 for columns outside of the matrix
+  for (i=0; i < nx; i++)
+    {
+      x_abs = ((double)(ix_min+i) - refpoint.x) + diremission->xmean;
+      if (x_abs < 0.0 || x_abs >= (float)(diremission->dim_x-1))
+	{
+	  x_lower[i] = -1;
+	  continue;
+	}
+      x_lower[i] = (int) x_abs;
+      t_off[i]   = x_abs - (float)x_lower[i];
+      x_hit[i]   = fabs((float)x_lower[i]-x_abs) < 1.0e-06;
+    }
+
+  // the same for the rows; the valid
+  // rows are in one range [jmin, jmax]
+  jmin = ny;
+  jmax = -1;
+  for (j=0; j < ny; j++)
+    {
+      y_abs = ((double)(iy_min+j) - refpoint.y) + diremission->ymean;
+      if (y_abs < 0.0 || y_abs >= (float)(diremission->dim_y-1))
+	{
+	  y_lower[j] = -1;
+	  continue;
+	}
+      y_lower[j] = (int) y_abs;
+      u_off[j]   = y_abs - (float)y_lower[j];
+      y_hit[j]   = fabs((float)y_lower[j]-y_abs) < 1.0e-06;
+      jmin = MIN(jmin, j);
+      jmax = MAX(jmax, j);
+    }
+
+  data = diremission->modimage->data;
+  tda  = diremission->modimage->tda;
+  for (i=0; i < nx; i++)
+    {
+      srow = stamp + (size_t)i * (size_t)ny;
+      for (j=0; j < ny; j++)
+	srow[j] = 0.0;
+
+      if (x_lower[i] < 0)
+	continue;
+
+      // bi-linear interpolation between two rows
+      // of the matrix, as in 'bilin_interp_matrix()'
+      row0 = data + (size_t)x_lower[i] * tda;
+      row1 = row0 + tda;
+      t    = t_off[i];
+      for (j=jmin; j <= jmax; j++)
+	{
+	  u = u_off[j];
+	  srow[j] = (1-t)*(1-u)*row0[y_lower[j]] + t*(1-u)*row1[y_lower[j]]
+	    + t*u*row1[y_lower[j]+1] + (1-t)*u*row0[y_lower[j]+1];
+	}
+      has_hit = has_hit || x_hit[i];
+    }
+
+  // give the full pixel value where
+  // a pixel center is directly hit
+  if (has_hit)
+    for (i=0; i < nx; i++)
+      if (x_lower[i] >= 0 && x_hit[i])
+	for (j=jmin; j <= jmax; j++)
+	  if (y_hit[j])
+	    stamp[(size_t)i * (size_t)ny + j] = data[(size_t)x_lower[i] * tda + y_lower[j]];
+
+  free(x_lower);
+  free(y_lower);
+  free(t_off);
+  free(u_off);
+  free(x_hit);
+  free(y_hit);
+
+  return stamp;
+}
+
 /**
  * Function: bilin_interp_matrix
  * The function computes and returns the bilinear interpolated value
@@ -448,12 +588,34 @@ bilin_interp_matrix(const gsl_matrix *modimage, const double x, const double y)
 spectral_models *
 load_spectral_models(const char spectral_models_file[])
 {
+  int i;
   int n_models=0;
   spectral_models *smodels;
+  fits_access *m_access;
 
   // allocate space for the spectral models structure
   smodels = (spectral_models *)malloc(sizeof(spectral_models));
 
+  // open the file and check for the packed format
+  m_access = access_fits_models(spectral_models_file);
+  if (m_access->packed)
+    {
+      // the index gives the number of models;
+      // slice all SEDs out of the single data table
+      n_models = m_access->n_modelHDU;
+      smodels->SEDlist = (energy_distrib **)malloc(n_models * sizeof(energy_distrib *));
+      for (i=0; i < n_models; i++)
+	smodels->SEDlist[i] = load_model_sed(m_access, i+1);
+      smodels->n_models = n_models;
+
+      // release the access structure
+      free_fits_access(m_access);
+
+      // return the structure
+      return smodels;
+    }
+  free_fits_access(m_access);
+
   // get the number of models
   n_models = get_num_extensions(spectral_models_file);
 
@@ -499,9 +661,33 @@ access_fits_models(const char fits_models_file[])
 		   fits_models_file);
     }
 
-  // get the number of models
-  m_access->n_modelHDU =  get_num_extensions(fits_models_file);
+  // set the default for the per-HDU format
   m_access->act_hdu =  -1;
+  m_access->pk_offset  = NULL;
+  m_access->pk_npoints = NULL;
+
+  // check for the packed format
+  m_access->packed = is_packed_models(m_access->fits_ptr);
+  if (m_access->packed)
+    {
+      // load the index, which gives the number of models,
+      // and stay in the data table for all later reads
+      m_access->n_modelHDU = load_packed_index(fits_models_file, m_access->fits_ptr,
+					       &m_access->pk_offset, &m_access->pk_npoints);
+      fits_movnam_hdu(m_access->fits_ptr, BINARY_TBL, SMODEL_PACK_DATA, 0, &f_status);
+      if (f_status)
+	{
+	  ffrprt (stderr, f_status);
+	  aXe_message (aXe_M_FATAL, __FILE__, __LINE__,
+		       "aXe_DISPIMAGE: " "Could not find extension %s in file: %s",
+		       SMODEL_PACK_DATA, fits_models_file);
+	}
+    }
+  else
+    {
+      // get the number of models
+      m_access->n_modelHDU =  get_num_extensions(fits_models_file);
+    }
 
   // return the structure
   return m_access;
@@ -605,17 +791,7 @@ energy_distrib *
 load_SED_from_fitsext(const char spectral_models_file[], fitsfile *s_models)
 {
   int f_status=0;
-  int anynul;
   long nrows=0;
-  int colnum1;
-  int colnum2;
-  
-  energy_distrib *sed=NULL;
-  double *sed_wavs;
-  double *sed_flux;
-
-  // allocate memory for the energy distribution
-  sed = (energy_distrib *) malloc(sizeof(energy_distrib));
 
   // get number of rows
   fits_get_num_rows (s_models, &nrows, &f_status);
@@ -627,6 +803,42 @@ load_SED_from_fitsext(const char spectral_models_file[], fitsfile *s_models)
 		 " table %s",spectral_models_file);
   }
 
+  // load the energy distribution from all rows
+  return load_SED_from_rows(spectral_models_file, s_models, 1, nrows);
+}
+
+
+/**
+ * Function: load_SED_from_rows
+ * The function creates a energy distribution from a range of rows
+ * in the current table of a fits file. The data must be stored in
+ * the columns "WAV_NM" and "FLUX".
+ *
+ * Parameters:
+ * @param  spectral_models_file - pathname to the spectral models file
+ * @param  s_models             - pointer to the fits file extension
+ * @param  firstrow             - the first row to read (starting at 1)
+ * @param  nrows                - the number of rows to read
+ *
+ * Returns:
+ * @return sed - the energy distribution created
+ */
+energy_distrib *
+load_SED_from_rows(const char spectral_models_file[], fitsfile *s_models,
+		   const long firstrow, const long nrows)
+{
+  int f_status=0;
+  int anynul;
+  int colnum1;
+  int colnum2;
+
+  energy_distrib *sed=NULL;
+  double *sed_wavs;
+  double *sed_flux;
+
+  // allocate memory for the energy distribution
+  sed = (energy_distrib *) malloc(sizeof(energy_distrib));
+
   // allocate memory for the data
   sed_wavs = (double *) malloc(nrows*sizeof(double));
   if (!sed_wavs) { 
@@ -650,7 +862,7 @@ load_SED_from_fitsext(const char spectral_models_file[], fitsfile *s_models)
 		   " table %s", "WAV_NM", spectral_models_file);
     }
   // read the wavelength
-  fits_read_col (s_models, TDOUBLE, colnum1, 1, 1, nrows, NULL, sed_wavs,
+  fits_read_col (s_models, TDOUBLE, colnum1, firstrow, 1, nrows, NULL, sed_wavs,
                     &anynul, &f_status);
   if (f_status)
     {
@@ -672,7 +884,7 @@ load_SED_from_fitsext(const char spectral_models_file[], fitsfile *s_models)
   		   " table %s", "FLUX", spectral_models_file);
     }
   // read the flux column 
-  fits_read_col (s_models, TDOUBLE, colnum2, 1, 1, nrows, NULL, sed_flux,
+  fits_read_col (s_models, TDOUBLE, colnum2, firstrow, 1, nrows, NULL, sed_flux,
                     &anynul, &f_status);
   if (f_status)
     {
@@ -701,6 +913,147 @@ load_SED_from_fitsext(const char spectral_models_file[], fitsfile *s_models)
 }
 
 
+/**
+ * Function: load_SED_from_packed
+ * The function creates a energy distribution from the packed
+ * spectral models format, where all models are stored one after
+ * the other in a single table. The current HDU must be that table.
+ *
+ * Parameters:
+ * @param  spectral_models_file - pathname to the spectral models file
+ * @param  s_models             - pointer to the fits file
+ * @param  offset               - the first row of the model (starting at 0)
+ * @param  npoints              - the number of rows of the model
+ *
+ * Returns:
+ * @return sed - the energy distribution created
+ */
+energy_distrib *
+load_SED_from_packed(const char spectral_models_file[], fitsfile *s_models,
+		     const long offset, const long npoints)
+{
+  if (npoints < 1)
+    aXe_message (aXe_M_FATAL, __FILE__, __LINE__,
+		 "load_SED_from_packed: "
+		 "Empty model at row %li in table %s", offset+1,
+		 spectral_models_file);
+
+  return load_SED_from_rows(spectral_models_file, s_models, offset+1, npoints);
+}
+
+
+/**
+ * Function: is_packed_models
+ * The function checks whether a spectral models file is in the
+ * packed format. This is marked by a logical keyword in the
+ * primary header. The current HDU must be the primary HDU.
+ *
+ * Parameters:
+ * @param  s_models - pointer to the fits file
+ *
+ * Returns:
+ * @return packed   - 1 for the packed format, 0 otherwise
+ */
+int
+is_packed_models(fitsfile *s_models)
+{
+  int f_status=0;
+  int packed=0;
+
+  // read the keyword, a missing keyword
+  // means the per-HDU format
+  fits_read_key(s_models, TLOGICAL, SMODEL_PACK_KEY, &packed, NULL, &f_status);
+  if (f_status)
+    return 0;
+
+  return packed ? 1 : 0;
+}
+
+
+/**
+ * Function: load_packed_index
+ * The function loads the index of a packed spectral models file.
+ * For each model the index gives the first row and the number of
+ * rows in the data table. The model number is the row number in
+ * the index.
+ *
+ * Parameters:
+ * @param  spectral_models_file - pathname to the spectral models file
+ * @param  s_models             - pointer to the fits file
+ * @param  pk_offset            - the first row of each model (starting at 0)
+ * @param  pk_npoints           - the number of rows of each model
+ *
+ * Returns:
+ * @return n_models             - the number of spectral models
+ */
+int
+load_packed_index(const char spectral_models_file[], fitsfile *s_models,
+		  long **pk_offset, long **pk_npoints)
+{
+  int f_status=0;
+  int anynul;
+  int colnum;
+  long nrows=0;
+
+  // move to the index table
+  fits_movnam_hdu(s_models, BINARY_TBL, SMODEL_PACK_INDEX, 0, &f_status);
+  if (f_status)
+    {
+      ffrprt (stderr, f_status);
+      aXe_message (aXe_M_FATAL, __FILE__, __LINE__,
+		   "load_packed_index: " "Could not find extension %s in file: %s",
+		   SMODEL_PACK_INDEX, spectral_models_file);
+    }
+
+  // get number of rows
+  fits_get_num_rows (s_models, &nrows, &f_status);
+  if (f_status || nrows < 1)
+    {
+      ffrprt (stderr, f_status);
+      aXe_message (aXe_M_FATAL, __FILE__, __LINE__,
+		   "load_packed_index: "
+		   "Could not determine the number of rows in"
+		   " table %s",spectral_models_file);
+    }
+
+  // allocate memory for the index
+  *pk_offset  = (long *) malloc(nrows*sizeof(long));
+  *pk_npoints = (long *) malloc(nrows*sizeof(long));
+  if (!*pk_offset || !*pk_npoints)
+    aXe_message (aXe_M_FATAL, __FILE__, __LINE__,
+		 "Memory allocation failed");
+
+  // read the offsets
+  fits_get_colnum (s_models, CASEINSEN, "OFFSET", &colnum, &f_status);
+  fits_read_col (s_models, TLONG, colnum, 1, 1, nrows, NULL, *pk_offset,
+		 &anynul, &f_status);
+  if (f_status)
+    {
+      ffrprt (stderr, f_status);
+      aXe_message (aXe_M_FATAL, __FILE__, __LINE__,
+		   "load_packed_index: "
+		   "Could not read content of OFFSET column "
+		   " from BINARY table %s", spectral_models_file);
+    }
+
+  // read the number of points
+  fits_get_colnum (s_models, CASEINSEN, "NPOINTS", &colnum, &f_status);
+  fits_read_col (s_models, TLONG, colnum, 1, 1, nrows, NULL, *pk_npoints,
+		 &anynul, &f_status);
+  if (f_status)
+    {
+      ffrprt (stderr, f_status);
+      aXe_message (aXe_M_FATAL, __FILE__, __LINE__,
+		   "load_packed_index: "
+		   "Could not read content of NPOINTS column "
+		   " from BINARY table %s", spectral_models_file);
+    }
+
+  // return the number of models
+  return (int)nrows;
+}
+
+
 /**
  * Function: get_num_extensions
  * The function determines the number of extensions in
@@ -815,6 +1168,12 @@ free_fits_access(fits_access *m_access)
 				m_access->fits_file);
 	}
 
+	// free the index of the packed format
+	if (m_access->pk_offset)
+		free(m_access->pk_offset);
+	if (m_access->pk_npoints)
+		free(m_access->pk_npoints);
+
 	// free the structure
 	free(m_access);
 	m_access = NULL;
@@ -873,6 +1232,19 @@ load_model_sed(fits_access *m_access, const int modspec)
 
 	energy_distrib *sed;
 
+	// in the packed format the SED is a slice
+	// of the data table given by the index
+	if (m_access->packed)
+	{
+		if (modspec < 1 || modspec >  m_access->n_modelHDU)
+			aXe_message (aXe_M_FATAL, __FILE__, __LINE__,
+					"aXe_DISPIMAGE: " "Model number %i does NOT exist!",
+					modspec);
+		return load_SED_from_packed(m_access->fits_file, m_access->fits_ptr,
+				m_access->pk_offset[modspec-1],
+				m_access->pk_npoints[modspec-1]);
+	}
+
 	move_in_fits(m_access, modspec);
 	/*
 	// make sure the SED does exist
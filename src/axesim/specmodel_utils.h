@@ -14,6 +14,12 @@
 // spectral models
 #define SMODEL_INTERP_TYPE gsl_interp_linear
 
+// names of the keyword and the extensions
+// which mark and hold the packed model format
+#define SMODEL_PACK_KEY "SPCPACK"
+#define SMODEL_PACK_INDEX "SPCINDEX"
+#define SMODEL_PACK_DATA "SPECTRA"
+
 /*
  * Struct: energy_distrib
  */
@@ -50,6 +56,9 @@ typedef struct
 	int n_modelHDU;          // number of model HDU's which is the number of HDU's minus
 	                         // the primary HDU, which supposedly does NOT contain data
 	int act_hdu;             // the present HDU
+	int packed;              // flag for the packed format (all SEDs in one table)
+	long *pk_offset;         // packed format: first table row of each SED
+	long *pk_npoints;        // packed format: number of table rows of each SED
 }
 fits_access;
 
@@ -103,6 +112,11 @@ extern double
 get_diremission_value(const dirim_emission *diremission,
 		      const double xpos, const double ypos);
 
+extern double *
+compute_diremission_stamp(const dirim_emission *diremission,
+			  const int ix_min, const int iy_min, const int nx,
+			  const int ny, const d_point refpoint);
+
 extern double
 bilin_interp_matrix(const gsl_matrix *modimage, const double x, const double y);
 
@@ -124,6 +138,21 @@ load_SED_from_fitsext(const char spectral_models_file[], fitsfile *s_models);
 extern int
 get_num_extensions(const char spectral_models_file[]);
 
+extern int
+is_packed_models(fitsfile *s_models);
+
+extern int
+load_packed_index(const char spectral_models_file[], fitsfile *s_models,
+		  long **pk_offset, long **pk_npoints);
+
+extern energy_distrib *
+load_SED_from_packed(const char spectral_models_file[], fitsfile *s_models,
+		     const long offset, const long npoints);
+
+extern energy_distrib *
+load_SED_from_rows(const char spectral_models_file[], fitsfile *s_models,
+		   const long firstrow, const long nrows);
+
 extern void
 free_spectral_models(spectral_models *smodels);
 
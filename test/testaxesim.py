@@ -6,10 +6,20 @@
 """
 
 import os
+import sys
 import shutil
+import threading
+import numpy
+import pyfits
 import tips
 import axesim
 from axesim import axesimerror
+from axesim import realworld
+from axesim import thumbnails
+from axesim import axecommands
+from axesim import configfile
+from axesim import imagemaker
+from axesim import modspeclist
 
 import unittest
 
@@ -346,6 +356,252 @@ Error: %s alredy exist and is not a directory!
                 axesim.simdispim(incat=None, config='axesim_d4_zero.conf', dispim_name='output_test_img4_zero_dark.fits',
                                 model_spectra=None, bck_flux='SB_map.fits', detector=True, model_images=None)
                 self.assertTrue(os.path.isfile(os.environ['AXE_OUTSIM_PATH']+'output_test_img4_zero_dark.fits'))               
+
+        def test49_img1_threads(self):
+                # run two simulations with their own directories in threads;
+                # the sensitivity table exists only in the CONF directory
+                # of each simulation and not in the process environment
+                threads = []
+                refNames = []
+                for i in range(2):
+                        workDir = './testaxesim/THREAD%d/' % i
+                        self._mkdir(workDir)
+                        for subDir in ['DATA', 'CONF', 'OUTPUT', 'OUTSIM']:
+                                self._mkdir(workDir+subDir)
+                        shutil.copy(self.dataDir+'input_cat_test.dat', workDir+'DATA/')
+                        shutil.copy(self.dataDir+'input_cat_test.spc.fits', workDir+'DATA/')
+                        sensName = 'sensfunc_thread%d.fits' % i
+                        confFile = open(self.dataDir+'axesim_d1.conf')
+                        confText = confFile.read().replace('sensfunc_d1.fits', sensName)
+                        confFile.close()
+                        confFile = open(workDir+'CONF/axesim_d1.conf', 'w')
+                        confFile.write(confText)
+                        confFile.close()
+                        shutil.copy(self.dataDir+'sensfunc_d1.fits', workDir+'CONF/'+sensName)
+                        paths = axesim.AxePaths(image_path=workDir+'DATA/', config_path=workDir+'CONF/',
+                                                output_path=workDir+'OUTPUT/', outsim_path=workDir+'OUTSIM/')
+                        kwargs = {'incat':'input_cat_test.dat', 'config':'axesim_d1.conf',
+                                  'model_spectra':'input_cat_test.spc.fits', 'bck_flux':0.5, 'detector':False, 'paths':paths}
+                        # the reference from the C-executables
+                        axesim.simdispim(dispim_name='output_test_img1_ref.fits', single_pass=False, **kwargs)
+                        refNames.append(workDir+'OUTSIM/output_test_img1_ref.fits')
+                        kwargs['dispim_name'] = 'output_test_img1.fits'
+                        threads.append(threading.Thread(target=axesim.simdispim, kwargs=kwargs))
+                configPath = os.environ.pop('AXE_CONFIG_PATH')
+                try:
+                        for one in threads:
+                                one.start()
+                        for one in threads:
+                                one.join()
+                finally:
+                        os.environ['AXE_CONFIG_PATH'] = configPath
+                for i in range(2):
+                        outName = './testaxesim/THREAD%d/OUTSIM/output_test_img1.fits' % i
+                        self.assertTrue(os.path.isfile(outName))
+                        img1 = pyfits.open(outName)
+                        img2 = pyfits.open(refNames[i])
+                        self.assertTrue(numpy.allclose(img1['SCI'].data, img2['SCI'].data, rtol=1.0e-5, atol=1.0e-10),
+                                        msg='thread %i differs from the C-executables' % i)
+                        img1.close()
+                        img2.close()
+
+        def test50_realworld_seed(self):
+                # identical seeds give identical noise
+                scis = []
+                for i in range(3):
+                        imgPath = './testaxesim/DATA/realworld_%d.fits' % i
+                        img = pyfits.HDUList([pyfits.PrimaryHDU(), pyfits.ImageHDU(numpy.ones((50, 40), dtype=numpy.float32))])
+                        img[1].header.update('EXTNAME', 'SCI')
+                        img.writeto(imgPath, clobber=True)
+                        rworld = realworld.RealWorld(imgPath, extname='SCI', exptime=100.0, bck_flux=0.5, qe=0.9,
+                                                     dc=0.01, rn=5.0, seed=[1, i//2])
+                        rworld.make_real()
+                        img = pyfits.open(imgPath)
+                        scis.append(numpy.array(img['SCI'].data))
+                        self.assertEqual(img['ERR'].data.shape, (50, 40))
+                        self.assertTrue(numpy.allclose(img['ERR'].data, ((150.0*0.9+1.0+25.0)**0.5)/100.0))
+                        img.close()
+                self.assertTrue((scis[0] == scis[1]).all())
+                self.assertFalse((scis[0] == scis[2]).all())
+
+        def test51_img1_det_renoise(self):
+                axesim.simdispim(incat=None, config='axesim_d1_det.conf', dispim_name='output_test_img1_renoise.fits',
+                                model_spectra=None, bck_flux=0.5, detector=True, model_images=None,
+                                signal_name='output_test_img1_signal.fits', seed=3)
+                signalName = os.environ['AXE_OUTSIM_PATH']+'output_test_img1_signal.fits'
+                self.assertTrue(os.path.isfile(signalName))
+                # the same seed gives the same realisation as the full run
+                outNames = [os.environ['AXE_OUTSIM_PATH']+'output_test_img1_renoise_R%d.fits' % i for i in range(3)]
+                realworld.renoise(signalName, outNames[:1], seed=3)
+                img1 = pyfits.open(os.environ['AXE_OUTSIM_PATH']+'output_test_img1_renoise.fits')
+                img2 = pyfits.open(outNames[0])
+                for ext in ['SCI', 'ERR', 'DQ']:
+                        self.assertTrue((img1[ext].data == img2[ext].data).all(), msg='renoise differs from simdispim ('+ext+')')
+                img1.close()
+                img2.close()
+                # a batch of new realisations
+                realworld.renoise(signalName, outNames, seed=4, exptime=200.0)
+                scis = []
+                for outName in outNames:
+                        img = pyfits.open(outName)
+                        self.assertEqual(len(img), 4)
+                        self.assertEqual(img['SCI'].header['EXPTIME'], 200.0)
+                        scis.append(numpy.array(img['SCI'].data))
+                        img.close()
+                self.assertFalse((scis[0] == scis[1]).all())
+
+        def test52_realworld_memory(self):
+                # an image in memory gets the same noise as on disk
+                imgPath = './testaxesim/DATA/realworld_disk.fits'
+                img = pyfits.HDUList([pyfits.PrimaryHDU(), pyfits.ImageHDU(numpy.ones((50, 40), dtype=numpy.float32))])
+                img[1].header.update('EXTNAME', 'SCI')
+                img.writeto(imgPath, clobber=True)
+                rworld = realworld.RealWorld(imgPath, extname='SCI', exptime=100.0, bck_flux=0.5, qe=0.9,
+                                             dc=0.01, rn=5.0, seed=7)
+                rworld.make_real()
+                rworld = realworld.RealWorld(img, extname='SCI', exptime=100.0, bck_flux=0.5, qe=0.9,
+                                             dc=0.01, rn=5.0, seed=7)
+                rworld.make_real()
+                self.assertEqual(len(img), 4)
+                disk = pyfits.open(imgPath)
+                for ext in ['SCI', 'ERR', 'DQ']:
+                        self.assertTrue((img[ext].data == disk[ext].data).all(), msg='memory differs from disk ('+ext+')')
+                disk.close()
+
+        def test53_thumbnails_batch(self):
+                # the batched thumbnails agree with the single thumbnail functions
+                rng = numpy.random.RandomState(5)
+                thumbs = [rng.uniform(0.0, 1.0, (20, 20)) for i in range(3)] + [rng.uniform(0.0, 1.0, (16, 16))]
+                smpfacs = [0.5, 1.0, 0.5, 0.5]
+                for (sigma1, sigma2, c) in [(None, None, None), (1.2, None, None), (0.8, 2.5, 0.7)]:
+                        prepped = thumbnails.prep_thumbnails(thumbs, smpfacs, sigma1, sigma2, c)
+                        for i in range(len(thumbs)):
+                                ref = axesim.resample(axesim.doubleGaussConv(thumbs[i], sigma1, sigma2, c, smpfacs[i]), smpfacs[i])
+                                self.assertEqual(prepped[i].shape, ref.shape)
+                                self.assertTrue(numpy.allclose(prepped[i], ref, rtol=1.0e-6, atol=1.0e-10), msg='thumbnail %i differs' % i)
+
+        def test54_modimg_cache(self):
+                # identical PSFs share the prepared model images
+                thm = pyfits.HDUList([pyfits.PrimaryHDU()])
+                for i in range(3):
+                        thm.append(pyfits.ImageHDU(numpy.ones((12, 12))))
+                        thm[-1].header.update('SMPFAC', 0.5)
+                thm.writeto(os.environ['AXE_IMAGE_PATH']+'modimg_cache.thm.fits', clobber=True)
+                cache = axesim.ModImgCache()
+                name1 = cache.get('modimg_cache.thm.fits', 1.0, None, None)
+                name2 = cache.get('modimg_cache.thm.fits', 1.0, None, None)
+                name3 = cache.get('modimg_cache.thm.fits', 1.0, 2.0, 0.5)
+                self.assertEqual(name1, name2)
+                self.assertNotEqual(name1, name3)
+                img = pyfits.open(os.environ['AXE_IMAGE_PATH']+name1)
+                self.assertEqual(len(img), 4)
+                self.assertEqual(img[1].data.shape, (24, 24))
+                img.close()
+                cache.close()
+                self.assertFalse(os.path.isfile(os.environ['AXE_IMAGE_PATH']+name1))
+                self.assertFalse(os.path.isfile(os.environ['AXE_IMAGE_PATH']+name3))
+
+        def test55_error_unmutes(self):
+                # a failing silent simulation restores stdout
+                stdout = sys.stdout
+                self.assertRaises(axesimerror.aXeSIMError, axesim.simdispim, incat='input_cat_test.dat',
+                                  config='axesim_d1.conf', dispim_name='output_test_error.fits', exptime=-1.0,
+                                  model_spectra='input_cat_test.spc.fits', detector=False, silent=True)
+                self.assertTrue(sys.stdout is stdout)
+                self.assertEqual(axesim.axesimutils._mute_count, 0)
+
+        def test56_error_dummies(self):
+                # a failing finish step leaves no dummy images
+                def finish(img):
+                        raise axesimerror.aXeSIMError('finish failed')
+                imageDir = os.environ['AXE_IMAGE_PATH']
+                before = set([f for f in os.listdir(imageDir) if f.endswith('_DISP.fits')])
+                for single_pass in [True, False]:
+                        self.assertRaises(axesimerror.aXeSIMError, axesim.simdispim, incat='input_cat_test.dat',
+                                          config='axesim_d1.conf', dispim_name='output_test_error.fits',
+                                          model_spectra='input_cat_test.spc.fits', detector=False,
+                                          single_pass=single_pass, finish=finish)
+                        after = set([f for f in os.listdir(imageDir) if f.endswith('_DISP.fits')])
+                        self.assertEqual(after, before, msg='dummy images left (single_pass=%s)' % single_pass)
+
+        @unittest.skipIf(vscipylt12, "not supported in with scipy < 0.12.0")
+        def test57_packed_thumbnails(self):
+                # packed thumbnails give the same dispersed image as one extension per thumbnail
+                shutil.copy(self.dataDir+'thumbnails.fits',os.environ['AXE_IMAGE_PATH'])
+                shutil.copy(self.dataDir+'input_cat_thumbs.dat',os.environ['AXE_IMAGE_PATH'])
+                inthm = pyfits.open(os.environ['AXE_IMAGE_PATH']+'thumbnails.fits')
+                (thumbs, smpfacs) = thumbnails.read_thumbnails(inthm)
+                packed = thumbnails.pack_thumbnails(thumbs, smpfacs, numpy.arange(1, len(thumbs)+1))
+                packed.writeto(os.environ['AXE_IMAGE_PATH']+'thumbnails_packed.fits', clobber=True)
+                packed.close()
+                inthm.close()
+                inthm = pyfits.open(os.environ['AXE_IMAGE_PATH']+'thumbnails_packed.fits')
+                (pthumbs, psmpfacs) = thumbnails.read_thumbnails(inthm)
+                self.assertEqual(psmpfacs, smpfacs)
+                for i in range(len(thumbs)):
+                        self.assertTrue((pthumbs[i] == thumbs[i]).all(), msg='thumbnail %i differs' % i)
+                inthm.close()
+                for (modImg, outName) in [('thumbnails.fits', 'output_test_img1_hdus.fits'), ('thumbnails_packed.fits', 'output_test_img1_packed.fits')]:
+                        axesim.simdispim(incat='input_cat_thumbs.dat', config='axesim_d1.conf', dispim_name=outName,
+                                        model_spectra='input_cat_test.spc.fits', bck_flux=0.5, detector=False, model_images=modImg)
+                img1 = pyfits.open(os.environ['AXE_OUTSIM_PATH']+'output_test_img1_hdus.fits')
+                img2 = pyfits.open(os.environ['AXE_OUTSIM_PATH']+'output_test_img1_packed.fits')
+                self.assertTrue(numpy.allclose(img1['SCI'].data, img2['SCI'].data, rtol=1.0e-6, atol=1.0e-10),
+                                msg='packed thumbnails give a different image')
+                img1.close()
+                img2.close()
+
+        def test58_binary_aper(self):
+                # the binary aperture file gives the same dispersed image as the text
+                # aperture file, a truncated file or an unknown format is rejected
+                paths = axesim.AxePaths()
+                conf = configfile.ConfigFile(paths.putCONF('axesim_d1.conf'))
+                beam = sorted(conf.beams.keys())[0]
+                psfsig = axesim.getBeamPSF(conf, beam)[0]
+                config_simul = conf.axesim_prep(beam)
+                nx = int(conf.get_gvalue('NPIXX'))
+                ny = int(conf.get_gvalue('NPIXY'))
+                images = {}
+                grismators = {}
+                for text_af in [0, 1]:
+                        grisName = 'output_test_aper%d_DISP.fits' % text_af
+                        catName = paths.putIMAGE('output_test_aper%d.cat' % text_af)
+                        shutil.copy(paths.putIMAGE('input_cat_test.dat'), catName)
+                        i_maker = imagemaker.DummyImages(paths.putCONF(config_simul), paths.putIMAGE(grisName), None, nx, ny)
+                        i_maker.makeImages()
+                        inobjects = modspeclist.ModelObjectTable(catName, 'input_cat_test.spc.fits', None)
+                        inobjects.fill_columns(i_maker.WCSimage, i_maker.WCSext, psfsig)
+                        grismators[text_af] = axecommands.DispImator(i_maker, config_simul, catName, conf.confirm_lambda_psf(),
+                                                                     'input_cat_test.spc.fits', None, paths=paths,
+                                                                     use_engine=False, text_af=text_af)
+                        grismators[text_af].run()
+                        img = pyfits.open(paths.putIMAGE(grisName))
+                        images[text_af] = numpy.array(img['SCI'].data, dtype=numpy.float64)
+                        img.close()
+                        os.unlink(catName)
+                # the text aperture file rounds the trace coefficients to four digits
+                self.assertTrue(images[0].sum() > 0.0)
+                self.assertTrue(abs(images[0].sum() - images[1].sum()) <= 1.0e-3 * images[0].sum())
+                self.assertTrue(numpy.allclose(images[0], images[1], rtol=0.0, atol=0.05 * images[0].max()),
+                                msg='binary and text aperture files give different images')
+                # corrupt the binary aperture file
+                oafName = paths.putOUTPUT('output_test_aper0_DISP_2.OAF')
+                oafFile = open(oafName, 'rb')
+                oafData = oafFile.read()
+                oafFile.close()
+                self.assertEqual(oafData[:8], 'aXeOAFB\0')
+                for (badData, what) in [(oafData[:len(oafData)-8], 'truncated'), ('aXeOAFX\0' + oafData[8:], 'wrong magic')]:
+                        oafFile = open(oafName, 'wb')
+                        oafFile.write(badData)
+                        oafFile.close()
+                        dispimage = axecommands.aXe_DISPIMAGE('output_test_aper0_DISP.fits', config_simul,
+                                                              model_spectra='input_cat_test.spc.fits', paths=paths)
+                        retcode = dispimage.run(silent=True)
+                        dispimage.cleanup()
+                        self.assertNotEqual(retcode, axecommands.GOOD_RETURN_VALUE, msg='%s aperture file accepted' % what)
+                for text_af in [0, 1]:
+                        grismators[text_af].mopup()
+                        os.unlink(paths.putIMAGE('output_test_aper%d_DISP.fits' % text_af))
  
 if __name__ == '__main__':
         unittest.main()
@@ -11,6 +11,7 @@ import sys
 import tips
 import unittest
 import pyfits
+import numpy
 
 # check scipy version and print warning is < 0.12
 import scipy
@@ -226,6 +227,136 @@ Error: %s alredy exist and is not a directory!
                             self.assertEqual(len(img), 4, msg=imgname+' contains %d hdu, 4 was expected' % len(img))
                obs.close()
 
+       def test13_parallel(self):
+               self.ra0 = 150.0
+               self.dec0 = 2.6
+               self._mkdir('./testtips/serial')
+               self._mkdir('./testtips/parallel')
+               obs = tips.Observation(self.inCat, self.inSpc)
+               obs.loadEUCLIDDefault(grismName='Gblue0', exptime=560.0, ra0=self.ra0, dec0=self.dec0)
+               obs.runSimulation(workDir='./testtips/serial', seed=1234)
+               obs.runSimulation(workDir='./testtips/parallel', ncpu=4, seed=1234)
+               for i in range(4):
+                       for j in range(4):
+                            imgname = 'OUTSIM/CMC_test_NISP_GBLUE0_'+str(i)+str(j)+'_IMG.fits'
+                            self.assertTrue(os.path.isfile('testtips/parallel/'+imgname), msg=imgname+' does not exist.')
+                            img1 = pyfits.open('testtips/serial/'+imgname)
+                            img2 = pyfits.open('testtips/parallel/'+imgname)
+                            for ext in ['SCI', 'ERR', 'DQ']:
+                                 self.assertTrue((img1[ext].data == img2[ext].data).all(), msg=imgname+' differs between serial and parallel run ('+ext+')')
+                            img1.close()
+                            img2.close()
+               self.assertEqual(len([d for d in os.listdir('./testtips/parallel') if d.startswith('JOB_')]), 0)
+               obs.close()
+
+       def test14_packed_spc(self):
+               self._mkdir('./testtips/packed')
+               obs = tips.Observation(self.inCat, self.inSpc)
+               obs.loadEUCLIDDefault(grismName='Gblue0', exptime=560.0, ra0=self.ra0, dec0=self.dec0)
+               obs.runSimulation(workDir='./testtips/packed')
+               obs.close()
+               sky = tips.SkySources(self.inCat, self.inSpc, inCatForm='TIPS', inSpcForm='TIPS')
+               spcname = 'testtips/packed/DATA/CMC_test.spc.fits'
+               self.assertTrue(os.path.isfile(spcname), msg=spcname+' does not exist.')
+               spc = pyfits.open(spcname)
+               self.assertTrue(spc[0].header['SPCPACK'])
+               self.assertEqual(len(spc), 3, msg=spcname+' contains %d hdu, 3 was expected' % len(spc))
+               index = spc['SPCINDEX'].data
+               data = spc['SPECTRA'].data
+               self.assertEqual(spc[0].header['NMODELS'], len(index))
+               self.assertEqual(index.field('NPOINTS').sum(), len(data))
+               for i in range(0, len(index), max(1, len(index)/10)):
+                       (wave, flux) = sky.getSpcIdent(index.field('ID')[i])
+                       o = index.field('OFFSET')[i]
+                       n = index.field('NPOINTS')[i]
+                       self.assertEqual(index.field('NUMBER')[i], i+1)
+                       self.assertTrue(numpy.allclose(data.field('WAV_NM')[o:o+n]*10.0, wave, rtol=1e-6))
+                       self.assertTrue(numpy.allclose(data.field('FLUX')[o:o+n], flux, rtol=1e-6))
+               # all the detectors reference the shared store
+               for i in range(4):
+                       for j in range(4):
+                            motname = 'testtips/packed/DATA/CMC_test_NISP_GBLUE0_'+str(i)+str(j)+'.cat'
+                            self.assertFalse(os.path.isfile(motname.replace('.cat', '.spc.fits')))
+                            if not os.path.isfile(motname):
+                                 continue
+                            mot = numpy.loadtxt(motname, ndmin=2)
+                            self.assertTrue((index.field('ID')[mot[:,6].astype(int)-1] == mot[:,9]).all(), msg=motname+' MODSPEC does not match the store')
+               spc.close()
+               sky.close()
+
+       def test15_seed_one_detector(self):
+               # the noise seeds of the detectors are distinct
+               obs = tips.Observation(self.inCat, self.inSpc)
+               obs.loadEUCLIDDefault(grismName='Gblue0', exptime=560.0, ra0=self.ra0, dec0=self.dec0)
+               spectros = obs.getSpectros()
+               seeds = [tuple(tips.noise_seed(1234, spectro)) for spectro in spectros]
+               self.assertEqual(len(set(seeds)), len(spectros))
+               # the full run over all the detectors
+               self._mkdir('./testtips/seed_full')
+               obs.runSimulation(workDir='./testtips/seed_full', seed=1234)
+               # a single detector is simulated again as in the full run
+               self._mkdir('./testtips/seed_single')
+               obs.runSimulation(workDir='./testtips/seed_single', seed=1234, spectros=[spectros[5]])
+               imgname = 'OUTSIM/CMC_test_NISP_GBLUE0_11_IMG.fits'
+               img1 = pyfits.open('testtips/seed_full/'+imgname)
+               img2 = pyfits.open('testtips/seed_single/'+imgname)
+               for ext in ['SCI', 'ERR', 'DQ']:
+                    self.assertTrue((img1[ext].data == img2[ext].data).all(), msg=imgname+' differs from the full run ('+ext+')')
+               self.assertEqual(img2['SCI'].header['NSEED'], '1234 0 5')
+               img1.close()
+               img2.close()
+               obs.close()
+
+       def test16_large_ids(self):
+               # identifiers above 2**53 are written exactly in the MOT
+               self._mkdir('./testtips/largeid')
+               inCat = './testtips/largeid/CMC_test_largeid.fits'
+               cat = pyfits.open(self.inCat)
+               bigIds = 2**60 + 2*numpy.arange(len(cat[1].data), dtype=numpy.int64) + 1
+               cols = [pyfits.Column(name='NUMBER', format='K', array=bigIds)]
+               for col in cat[1].columns:
+                    if col.name != 'NUMBER':
+                         cols.append(pyfits.Column(name=col.name, format=col.format, unit=col.unit, array=cat[1].data.field(col.name)))
+               pyfits.new_table(cols).writeto(inCat, clobber=True)
+               cat.close()
+               obs = tips.Observation(inCat, self.inSpc)
+               obs.loadEUCLIDDefault(grismName='Gblue0', exptime=560.0, ra0=self.ra0, dec0=self.dec0)
+               ngal = 0
+               for spectro in obs.getSpectros():
+                    simulation = tips.tipsaxesim.Simulation('./testtips/largeid', obs.dataDir, obs.confDir)
+                    simulation.importSrc(obs.skySrc, spectro)
+                    if simulation.ngal > 0:
+                         motFile = open('./testtips/largeid/DATA/'+simulation.motName)
+                         motIds = [int(line.split()[9]) for line in motFile if not line.startswith('#')]
+                         motFile.close()
+                         self.assertEqual(len(motIds), simulation.ngal)
+                         self.assertTrue(set(motIds) <= set(bigIds.tolist()), msg=simulation.motName+' contains corrupted IDs')
+                         ngal += simulation.ngal
+                    simulation.close()
+               self.assertTrue(ngal > 0)
+               obs.close()
+
+       def test17_worker_cleanup(self):
+               # a failing worker leaves no private directory tree
+               workDir = './testtips/workers'
+               self._mkdir(workDir)
+               obs = tips.Observation(self.inCat, self.inSpc)
+               obs.loadEUCLIDDefault(grismName='Gblue0', exptime=560.0, ra0=self.ra0, dec0=self.dec0)
+               srcArgs = (self.dataDir+'does_not_exist.fits',) + obs.srcArgs[1:]
+               args = (workDir, obs.dataDir, obs.confDir, srcArgs, obs.getSpectros()[0], False, False, True, 1234, None)
+               self.assertRaises(tips.TIPSError, tips.tipsobservation.run_single, args)
+               self.assertEqual(len([d for d in os.listdir(workDir) if d.startswith('JOB_')]), 0)
+               obs.close()
+               # products in nested and missing directories are moved
+               self._mkdir(workDir+'/JOB_test')
+               os.makedirs(workDir+'/JOB_test/OUTSIM/sub')
+               open(workDir+'/JOB_test/OUTSIM/sub/product.fits', 'w').close()
+               open(workDir+'/JOB_test/toplevel.txt', 'w').close()
+               tips.tipsobservation.move_products(workDir+'/JOB_test', workDir)
+               self.assertTrue(os.path.isfile(workDir+'/OUTSIM/sub/product.fits'))
+               self.assertTrue(os.path.isfile(workDir+'/toplevel.txt'))
+               shutil.rmtree(workDir)
+
 if __name__ == '__main__':
        unittest.main()
 
@@ -10,6 +10,7 @@ import pyfits
 import numpy
 import os
 import shutil
+import tempfile
 import tips
 
 import unittest
@@ -144,6 +145,68 @@ class Test_TipsSource(unittest.TestCase):
 #               rsky.close()
 #               ssky.close()
 
+        def test08_getSpcIdents(self):
+                ssky = tips.SkySources(inCatDir=self.dataDir+"CMC_test.fits", inSpcDir=self.dataDir+"CMC_test.spc.fits")
+                ids = ssky.getCatCol("NUMBER")
+                tspc = numpy.random.randint(low=0, high=ssky.nSources, size=10)
+                spcs = ssky.getSpcIdents(ids[tspc])
+                self.assertEqual(ssky.getIndexes(ids[tspc]), list(tspc))
+                for (i, (w, f)) in zip(tspc, spcs):
+                        (wCheck, fCheck) = ssky.getSpcIndex(i)
+                        wDiff = numpy.sum((w-wCheck)**2)
+                        fDiff = numpy.sum((f-fCheck)**2)
+                        error_message = 'Error in SkySources Class, method getSpcIdents, lambda column'
+                        self.assertAlmostEqual(wDiff, 0.0, places=30, msg=error_message)
+                        error_message = 'Error in SkySources Class, method getSpcIdents, flux column'
+                        self.assertAlmostEqual(fDiff, 0.0, places=30, msg=error_message)
+                self.assertRaises(tips.TIPSError, ssky.getSpcIdent, ids.max()+1)
+                self.assertRaises(tips.TIPSError, ssky.getSpcIdents, [ids[0], ids.max()+1])
+                ssky.close()
+
+        def test09_catCache(self):
+                tmpDir = tempfile.mkdtemp()
+                inCat = tmpDir+"/CMC_test.out"
+                shutil.copy(self.dataDir+"CMC_test.out", inCat)
+                # a modification time with more digits than the file system keeps
+                catTime = os.stat(inCat).st_mtime + 0.3640342
+                os.utime(inCat, (catTime, catTime))
+                ssky = tips.SkySources(inCatDir=inCat, inSpcDir=self.dataDir+"CMC_test.spc.fits", inCatForm='CMC')
+                check = ssky.getCatCol("RA").copy()
+                ssky.close()
+                error_message = 'Error in SkySources Class, the ascii catalog cache was not written'
+                self.assertTrue(os.path.isfile(inCat+'.npy'), msg=error_message)
+                cacheStat = os.stat(inCat+'.npy')
+                # second load from the memory mapped cache
+                ssky = tips.SkySources(inCatDir=inCat, inSpcDir=self.dataDir+"CMC_test.spc.fits", inCatForm='CMC')
+                self.assertTrue(isinstance(ssky.inCat, numpy.memmap))
+                error_message = 'Error in SkySources Class, the ascii catalog cache was written again'
+                self.assertEqual((os.stat(inCat+'.npy').st_mtime, os.stat(inCat+'.npy').st_ino), (cacheStat.st_mtime, cacheStat.st_ino), msg=error_message)
+                diff = numpy.sum((ssky.getCatCol("RA")-check)**2)
+                error_message = 'Error in SkySources Class, with cached ascii catalog, method getCatCol, RA column'
+                self.assertAlmostEqual(diff, 0.0, places=30, msg=error_message)
+                ssky.close()
+                # a modified catalog invalidates the cache
+                os.utime(inCat, (os.stat(inCat).st_atime, os.stat(inCat).st_mtime+10))
+                ssky = tips.SkySources(inCatDir=inCat, inSpcDir=self.dataDir+"CMC_test.spc.fits", inCatForm='CMC')
+                self.assertFalse(isinstance(ssky.inCat, numpy.memmap))
+                ssky.close()
+                shutil.rmtree(tmpDir)
+
+        def test10_getConeIndexes(self):
+                ssky = tips.SkySources(inCatDir=self.dataDir+"CMC_test.fits", inSpcDir=self.dataDir+"CMC_test.spc.fits")
+                ra = numpy.radians(ssky.getCatCol("RA"))
+                dec = numpy.radians(ssky.getCatCol("DEC"))
+                (ra0, dec0) = (ra.mean(), dec.mean())
+                dist = numpy.degrees(numpy.arccos(numpy.clip(numpy.sin(dec)*numpy.sin(dec0)+numpy.cos(dec)*numpy.cos(dec0)*numpy.cos(ra-ra0), -1.0, 1.0)))
+                for radius in [0.0, numpy.median(dist), dist.max()]:
+                        rows = ssky.getConeIndexes(numpy.degrees(ra0), numpy.degrees(dec0), radius)
+                        check = numpy.nonzero(dist <= radius)[0]
+                        error_message = 'Error in SkySources Class, method getConeIndexes, radius %f' % radius
+                        self.assertTrue(numpy.all(numpy.in1d(check, rows)), msg=error_message)
+                        self.assertTrue(numpy.all(dist[rows] <= radius*(1.0+1e-6)+1e-9), msg=error_message)
+                        self.assertTrue(numpy.all(numpy.diff(rows) > 0), msg=error_message)
+                ssky.close()
+
 class Test_TipsNoise(unittest.TestCase):
         def setUp(self):
                 self.dataDir = os.path.abspath(os.path.dirname(__file__)+'/../data/')+'/'